@@ -0,0 +1,240 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+from cache_utils import TTLCache
+
+
+# Служебные слова, не влияющие на смысл юридического вопроса
+STOP_WORDS = {
+    "и", "в", "во", "на", "с", "со", "по", "к", "ко", "о", "об", "от", "до", "за", "из", "у", "для",
+    "а", "но", "или", "ли", "же", "бы", "то", "что", "как", "какой", "какие", "какая",
+    "каких", "это", "этот", "эта", "мне", "меня", "мой", "моя", "мои", "я", "мы", "вы", "он", "она",
+    "они", "его", "ее", "их", "можно", "нужно", "надо", "где", "почему",
+    "зачем", "сколько", "подскажите", "пожалуйста", "скажите", "здравствуйте", "добрый", "день"
+}
+
+# Отрицания и условия меняют юридический смысл вопроса на противоположный:
+# похожий вопрос подходит, только если эти слова у вопросов совпадают
+MODIFIER_WORDS = frozenset({"не", "ни", "нет", "нельзя", "без", "если", "когда"})
+
+WORD_PATTERN = re.compile(r"[а-яa-z0-9]+")
+NUMBER_PATTERN = re.compile(r"\d+")
+
+# Длина основы слова для грубого стемминга (отсечение окончаний)
+STEM_LENGTH = 6
+
+
+def normalize_question(text: str) -> str:
+    """Нормализация вопроса: регистр, ё, пунктуация и лишние пробелы"""
+    text = text.lower().replace("ё", "е")
+    return " ".join(WORD_PATTERN.findall(text))
+
+
+def extract_modifiers(normalized: str) -> frozenset:
+    """Отрицания и условия в нормализованном вопросе"""
+    return MODIFIER_WORDS.intersection(normalized.split())
+
+
+def extract_terms(normalized: str) -> List[str]:
+    """Выделение основ значимых слов из нормализованного вопроса"""
+    return [word[:STEM_LENGTH] for word in normalized.split()
+            if word not in STOP_WORDS and not word.isdigit()]
+
+
+class _IndexEntry:
+    __slots__ = ("question", "answer", "terms", "numbers", "modifiers")
+
+    def __init__(self, question: str, answer: str, terms: Counter, numbers: frozenset, modifiers: frozenset):
+        self.question = question
+        self.answer = answer
+        self.terms = terms
+        self.numbers = numbers
+        self.modifiers = modifiers
+
+
+class AnswerCache:
+    """
+    Двухуровневый кэш ответов ИИ
+
+    Первый уровень - точное совпадение нормализованного вопроса.
+    Второй уровень - поиск похожих вопросов по TF-IDF косинусной близости
+    с инвертированным индексом основ слов.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = 7 * 24 * 3600,
+                 similarity_threshold: float = 0.85, max_candidates: int = 50):
+        """
+        Args:
+            max_size: Максимальное количество записей на каждом уровне
+            ttl: Время жизни ответа в секундах
+            similarity_threshold: Минимальная косинусная близость для второго уровня
+            max_candidates: Сколько кандидатов из индекса сравнивать с вопросом
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_candidates = max_candidates
+
+        self.exact = TTLCache(max_size=max_size, ttl=ttl)
+        self.semantic = TTLCache(max_size=max_size, ttl=ttl, on_evict=self._remove_from_index)
+
+        self._postings: Dict[str, Set[int]] = {}
+        self._entry_ids: Dict[str, int] = {}
+        self._next_id = 0
+
+        self.semantic_hits = 0
+        self.semantic_misses = 0
+
+    def _remove_from_index(self, entry_id: int, entry: _IndexEntry):
+        """Удаление вытесненной записи из инвертированного индекса"""
+        for term in entry.terms:
+            ids = self._postings.get(term)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._postings[term]
+        if self._entry_ids.get(entry.question) == entry_id:
+            del self._entry_ids[entry.question]
+
+    def _idf(self, term: str) -> float:
+        total = len(self.semantic) + 1
+        return math.log(total / (len(self._postings.get(term, ())) + 1)) + 1.0
+
+    def _vector(self, terms: Counter) -> Dict[str, float]:
+        return {term: count * self._idf(term) for term, count in terms.items()}
+
+    @staticmethod
+    def _cosine(left: Dict[str, float], right: Dict[str, float]) -> float:
+        dot = sum(weight * right.get(term, 0.0) for term, weight in left.items())
+        if not dot:
+            return 0.0
+        norm = math.sqrt(sum(w * w for w in left.values())) * math.sqrt(sum(w * w for w in right.values()))
+        return dot / norm if norm else 0.0
+
+    def get(self, question: str) -> Optional[str]:
+        """
+        Поиск готового ответа на вопрос
+
+        Args:
+            question: Вопрос пользователя
+
+        Returns:
+            str: Ответ из кэша или None
+        """
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+
+        answer = self.exact.get(normalized)
+        if answer is not None:
+            return answer
+
+        terms = Counter(extract_terms(normalized))
+        # Для слишком коротких вопросов похожесть ненадежна
+        if len(terms) < 2:
+            self.semantic_misses += 1
+            return None
+
+        # Кандидаты - записи с наибольшим числом общих основ
+        overlap: Counter = Counter()
+        for term in terms:
+            for entry_id in self._postings.get(term, ()):
+                overlap[entry_id] += 1
+
+        numbers = frozenset(NUMBER_PATTERN.findall(normalized))
+        modifiers = extract_modifiers(normalized)
+        query_vector = self._vector(terms)
+        best_id, best_score = None, 0.0
+
+        for entry_id, _ in overlap.most_common(self.max_candidates):
+            entry = self.semantic.peek(entry_id)
+            # Вопросы с разными числами (суммы, сроки, статьи) или отрицаниями считаем разными
+            if entry is None or entry.numbers != numbers or entry.modifiers != modifiers:
+                continue
+            score = self._cosine(query_vector, self._vector(entry.terms))
+            if score > best_score:
+                best_id, best_score = entry_id, score
+
+        if best_id is not None and best_score >= self.similarity_threshold:
+            entry = self.semantic.get(best_id)
+            if entry is not None:
+                self.semantic_hits += 1
+                self.exact.set(normalized, entry.answer)
+                logger.debug(f"Похожий вопрос найден в кэше (близость {best_score:.2f})")
+                return entry.answer
+
+        self.semantic_misses += 1
+        return None
+
+    def put(self, question: str, answer: str):
+        """
+        Сохранение ответа в оба уровня кэша
+
+        Args:
+            question: Вопрос пользователя
+            answer: Ответ ИИ
+        """
+        normalized = normalize_question(question)
+        if not normalized or not answer:
+            return
+
+        self.exact.set(normalized, answer)
+
+        old_id = self._entry_ids.get(normalized)
+        if old_id is not None:
+            old_entry = self.semantic.pop(old_id)
+            if old_entry is not None:
+                self._remove_from_index(old_id, old_entry)
+
+        terms = Counter(extract_terms(normalized))
+        if not terms:
+            return
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entry_ids[normalized] = entry_id
+        for term in terms:
+            self._postings.setdefault(term, set()).add(entry_id)
+        self.semantic.set(entry_id, _IndexEntry(
+            normalized, answer, terms, frozenset(NUMBER_PATTERN.findall(normalized)),
+            extract_modifiers(normalized)
+        ))
+
+    def warm(self, consultations: Iterable[Dict], skip_answers: Iterable[str] = ()) -> int:
+        """
+        Заполнение кэша из истории ai_consultations
+
+        Args:
+            consultations: Строки с полями question и answer (от старых к новым)
+            skip_answers: Ответы, которые нельзя кэшировать (сообщения об ошибках)
+
+        Returns:
+            int: Количество загруженных записей
+        """
+        skip = set(skip_answers)
+        loaded = 0
+        for row in consultations:
+            answer = row.get("answer")
+            if not answer or answer in skip:
+                continue
+            self.put(row["question"], answer)
+            loaded += 1
+        return loaded
+
+    def get_metrics(self) -> Dict:
+        """Счетчики попаданий по уровням кэша"""
+        semantic_total = self.semantic_hits + self.semantic_misses
+        return {
+            "exact": self.exact.get_metrics(),
+            "semantic": {
+                "size": len(self.semantic),
+                "hits": self.semantic_hits,
+                "misses": self.semantic_misses,
+                "hit_rate": round(self.semantic_hits / semantic_total, 4) if semantic_total else 0.0,
+                "evictions": self.semantic.evictions,
+                "expirations": self.semantic.expirations,
+                "indexed_terms": len(self._postings)
+            }
+        }
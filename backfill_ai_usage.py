@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Скрипт для заполнения таблицы учета ИИ консультаций (ai_usage)
+по существующим записям ai_consultations и ai_subscriptions
+"""
+
+import sys
+from dotenv import load_dotenv
+from database import Database
+
+
+def main():
+    """Пересчитывает счетчики использования для всех пользователей"""
+    load_dotenv()
+    
+    print("🔄 Пересчет учета ИИ консультаций...")
+    database = Database()
+    
+    try:
+        rows = database.backfill_ai_usage()
+    finally:
+        database.close()
+    
+    if rows < 0:
+        print("❌ Пересчет не удался, подробности в логе")
+        sys.exit(1)
+    
+    print(f"✅ Готово: пересчитано пользователей - {rows}")
+
+
+if __name__ == "__main__":
+    main()
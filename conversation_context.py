@@ -0,0 +1,138 @@
+import math
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from cache_utils import TTLCache
+
+
+# Средняя длина токена для русского текста в символах (оценка с запасом)
+CHARS_PER_TOKEN = 3.0
+# Служебные токены на одно сообщение в запросе (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Оценка количества токенов текста без токенизатора модели"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+class _Turn:
+    __slots__ = ("question", "answer", "tokens")
+
+    def __init__(self, question: str, answer: str):
+        self.question = question
+        self.answer = answer
+        self.tokens = estimate_tokens(question) + estimate_tokens(answer)
+
+
+class ConversationContext:
+    """
+    Контекст диалога с ИИ для уточняющих вопросов
+
+    Последние пары вопрос-ответ пользователя загружаются из ai_consultations
+    один раз и хранятся в LRU кэше; в запрос попадают самые новые пары,
+    укладывающиеся в бюджет токенов. Счетчики токенов показывают, насколько
+    короче становятся уточняющие вопросы по сравнению с первыми.
+    """
+
+    def __init__(self, database, token_budget: int = 2000, max_turns: int = 6, window: float = 3600.0,
+                 max_users: int = 10000, skip_answers: Iterable[str] = ()):
+        """
+        Args:
+            database: AsyncDatabase
+            token_budget: Максимум токенов истории в одном запросе
+            max_turns: Максимум пар вопрос-ответ в истории
+            window: Учитывать консультации за последние N секунд
+            max_users: Сколько пользователей хранить в кэше
+            skip_answers: Ответы, которые не попадают в историю (сообщения об ошибках)
+        """
+        self.database = database
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.window = window
+        self.skip_answers = set(skip_answers)
+        # Неактивный дольше окна пользователь вытесняется, новая история читается из базы
+        self._cache = TTLCache(max_size=max_users, ttl=window)
+
+        # Метрики
+        self.requests = 0
+        self.followups = 0
+        self.history_tokens = 0
+        self.first_question_tokens = 0
+        self.followup_question_tokens = 0
+        self.trimmed_turns = 0
+
+    async def _load(self, user_id: int) -> deque:
+        turns = self._cache.get(user_id)
+        if turns is None:
+            rows = await self.database.get_ai_history(user_id, self.max_turns, self.window)
+            turns = deque(
+                (_Turn(row["question"], row["answer"]) for row in reversed(rows)
+                 if row["answer"] not in self.skip_answers),
+                maxlen=self.max_turns
+            )
+            self._cache.set(user_id, turns)
+        return turns
+
+    async def get_history(self, user_id: int, question: str) -> List[Dict]:
+        """
+        Сообщения истории для запроса к модели
+
+        Args:
+            user_id: ID пользователя в Telegram
+            question: Текущий вопрос (для метрик)
+
+        Returns:
+            List[Dict]: Сообщения user/assistant от старых к новым в пределах бюджета
+        """
+        turns = await self._load(user_id)
+
+        selected = []
+        used = 0
+        for turn in reversed(turns):
+            if used + turn.tokens > self.token_budget:
+                break
+            selected.append(turn)
+            used += turn.tokens
+        self.trimmed_turns += len(turns) - len(selected)
+
+        self.requests += 1
+        self.history_tokens += used
+        if selected:
+            self.followups += 1
+            self.followup_question_tokens += estimate_tokens(question)
+        else:
+            self.first_question_tokens += estimate_tokens(question)
+
+        messages = []
+        for turn in reversed(selected):
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.answer})
+        return messages
+
+    def add_turn(self, user_id: int, question: str, answer: Optional[str]):
+        """Добавление ответа модели в историю пользователя"""
+        if not answer or answer in self.skip_answers:
+            return
+        turns = self._cache.peek(user_id)
+        if turns is None:
+            turns = deque(maxlen=self.max_turns)
+        turns.append(_Turn(question, answer))
+        # Повторное сохранение продлевает время жизни истории
+        self._cache.set(user_id, turns)
+
+    def get_metrics(self) -> Dict:
+        """Счетчики токенов истории и вопросов"""
+        first_questions = self.requests - self.followups
+        return {
+            "requests": self.requests,
+            "followups": self.followups,
+            "history_tokens": self.history_tokens,
+            "avg_history_tokens": round(self.history_tokens / self.followups, 1) if self.followups else 0.0,
+            "avg_first_question_tokens": round(self.first_question_tokens / first_questions, 1) if first_questions else 0.0,
+            "avg_followup_question_tokens": round(self.followup_question_tokens / self.followups, 1) if self.followups else 0.0,
+            "trimmed_turns": self.trimmed_turns,
+            "cached_users": len(self._cache)
+        }
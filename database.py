@@ -1,51 +1,177 @@
 import os
+import json
+import asyncio
+import threading
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import pool, extensions, errors
+from psycopg2.extras import RealDictCursor, execute_values, Json
 from loguru import logger
 from datetime import datetime
 from typing import Optional, Dict, List
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import time
 
+from message_parser import LEGACY_CODE_WORD, generate_code_word
+
+
+# Запросы горячего пути поиска консультаций. Используются методами Database
+# и самопроверкой планов выполнения (check_query_plans)
+HOT_QUERIES = {
+    "get_last_consultation": """
+        SELECT c.*, u.username, u.phone
+        FROM consultations c
+        JOIN users u ON c.user_id = u.telegram_id
+        WHERE c.user_id = %(user_id)s
+        ORDER BY c.created_at DESC
+        LIMIT 1
+    """,
+    "verify_code_word": """
+        SELECT EXISTS (
+            SELECT 1 FROM consultations
+            WHERE user_id = %(user_id)s AND code_word = %(code_word)s AND payment_status = 'completed'
+        )
+    """,
+    "get_consultation_by_code_word": """
+        SELECT c.*, u.username, u.first_name, u.last_name, u.phone
+        FROM consultations c
+        JOIN users u ON c.user_id = u.telegram_id
+        WHERE c.user_id = %(user_id)s AND c.code_word = %(code_word)s
+        ORDER BY c.created_at DESC
+        LIMIT 1
+    """,
+    "get_consultation_by_code": """
+        SELECT c.*, u.username, u.first_name, u.last_name, u.phone
+        FROM consultations c
+        JOIN users u ON c.user_id = u.telegram_id
+        WHERE c.code_word = %(code_word)s
+    """,
+    "get_last_paid_consultation": """
+        SELECT c.*, u.username, u.phone
+        FROM consultations c
+        JOIN users u ON c.user_id = u.telegram_id
+        WHERE c.user_id = %(user_id)s AND c.payment_status = 'completed'
+        ORDER BY c.created_at DESC
+        LIMIT 1
+    """,
+    "get_consultation_by_payment_id": """
+        SELECT user_id, consultation_type, amount, payment_status, email, code_word FROM consultations
+        WHERE payment_id = %(payment_id)s
+        ORDER BY created_at DESC
+        LIMIT 1
+    """,
+    "get_consultation_email": """
+        SELECT email FROM consultations
+        WHERE payment_id = %(payment_id)s
+        ORDER BY created_at DESC
+        LIMIT 1
+    """,
+    "get_ai_history": """
+        SELECT question, answer, created_at FROM ai_consultations
+        WHERE user_id = %(user_id)s
+          AND answer IS NOT NULL
+          AND created_at > CURRENT_TIMESTAMP - %(since_seconds)s * INTERVAL '1 second'
+        ORDER BY created_at DESC
+        LIMIT %(limit)s
+    """,
+    "get_ai_usage": """
+        SELECT consultations_used, subscription_consultations FROM ai_usage
+        WHERE user_id = %(user_id)s
+    """
+}
+
+# Количество бесплатных ИИ консультаций до начала списания из подписки
+FREE_AI_CONSULTATIONS = 5
+
+# Индексы под форму каждого запроса горячего пути
+INDEXES = [
+    # get_last_consultation, get_user_statistics, проверка оплаты юристом
+    "CREATE INDEX IF NOT EXISTS idx_consultations_user_created ON consultations (user_id, created_at DESC)",
+    # verify_code_word, get_consultation_by_code_word
+    "CREATE INDEX IF NOT EXISTS idx_consultations_user_code_created ON consultations (user_id, code_word, created_at DESC)",
+    # уникальные кодовые слова консультаций (get_consultation_by_code, redeem_code_word);
+    # общее кодовое слово прежних консультаций повторяется и в индекс не входит
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_consultations_code_word ON consultations (code_word) WHERE code_word <> 'ЮРИСТ2024'",
+    # get_consultation_email
+    "CREATE INDEX IF NOT EXISTS idx_consultations_payment_id ON consultations (payment_id)",
+    # история ИИ консультаций пользователя (get_ai_history)
+    "CREATE INDEX IF NOT EXISTS idx_ai_consultations_user_created ON ai_consultations (user_id, created_at DESC)",
+    # пересчет учета использования (backfill_ai_usage)
+    "CREATE INDEX IF NOT EXISTS idx_ai_subscriptions_user_completed ON ai_subscriptions (user_id) WHERE payment_status = 'completed'",
+    # сверка неоплаченных консультаций с ЮKassa (get_pending_payments)
+    "CREATE INDEX IF NOT EXISTS idx_consultations_pending ON consultations (id) WHERE payment_status = 'pending'",
+    # статистика юриста по последнему контакту (get_lawyer_stats_page)
+    "CREATE INDEX IF NOT EXISTS idx_lawyer_contacts_last_contact ON lawyer_contacts (last_contact DESC)",
+    # удаление истекшего состояния диалогов (purge_expired_state)
+    "CREATE INDEX IF NOT EXISTS idx_conversation_state_expires ON conversation_state (expires_at)"
+]
+
+# Таблицы, последовательное сканирование которых на горячем пути недопустимо
+INDEXED_TABLES = {"consultations", "ai_consultations", "ai_subscriptions", "ai_usage"}
+
 
 class Database:
     def __init__(self):
-        self.connection = None
+        self.pool = None
         self.max_retries = 3
         self.retry_delay = 2
+        
+        # Размеры пула соединений настраиваются через переменные окружения
+        self.pool_min_size = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+        self.pool_max_size = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+        self.pool_timeout = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+        # Соединения, простаивавшие дольше этого времени, проверяются запросом SELECT 1
+        self.pool_check_idle = float(os.getenv('DB_POOL_CHECK_IDLE', '30'))
+        
+        # ThreadedConnectionPool не ждет освобождения соединений, поэтому ограничиваем выдачу семафором
+        self._pool_slots = threading.BoundedSemaphore(self.pool_max_size)
+        self._last_used: Dict[int, float] = {}
+        # Состояние потока: AsyncDatabase выполняет операции в одну попытку и повторяет их сам
+        self._local = threading.local()
+        
         self.connect()
         self.create_tables()
+        
+        # Самопроверка: горячие запросы не должны требовать последовательного сканирования
+        if os.getenv('DB_EXPLAIN_CHECK', 'true').lower() == 'true':
+            self.check_query_plans()
+    
+    def _connection_params(self) -> Dict:
+        """Параметры подключения к базе данных"""
+        # Дополнительные параметры для стабильности
+        params = {
+            'keepalives_idle': 30,
+            'keepalives_interval': 10,
+            'keepalives_count': 5,
+            'connect_timeout': 10
+        }
+        
+        # Сначала пробуем использовать DATABASE_URL
+        database_url = os.getenv('DATABASE_URL')
+        if database_url:
+            params['dsn'] = database_url
+        else:
+            # Если DATABASE_URL нет, используем отдельные переменные
+            params.update({
+                'host': os.getenv('PGHOST'),
+                'database': os.getenv('PGDATABASE'),
+                'user': os.getenv('PGUSER'),
+                'password': os.getenv('PGPASSWORD'),
+                'sslmode': os.getenv('PGSSLMODE'),
+                'channel_binding': os.getenv('PGCHANNELBINDING')
+            })
+        return params
     
     def connect(self):
-        """Подключение к базе данных с retry логикой"""
+        """Создание пула соединений с базой данных с retry логикой"""
         for attempt in range(self.max_retries):
             try:
-                # Сначала пробуем использовать DATABASE_URL
-                database_url = os.getenv('DATABASE_URL')
-                if database_url:
-                    self.connection = psycopg2.connect(
-                        database_url,
-                        # Дополнительные параметры для стабильности
-                        keepalives_idle=30,
-                        keepalives_interval=10,
-                        keepalives_count=5,
-                        connect_timeout=10
-                    )
-                else:
-                    # Если DATABASE_URL нет, используем отдельные переменные
-                    self.connection = psycopg2.connect(
-                        host=os.getenv('PGHOST'),
-                        database=os.getenv('PGDATABASE'),
-                        user=os.getenv('PGUSER'),
-                        password=os.getenv('PGPASSWORD'),
-                        sslmode=os.getenv('PGSSLMODE'),
-                        channel_binding=os.getenv('PGCHANNELBINDING'),
-                        # Дополнительные параметры для стабильности
-                        keepalives_idle=30,
-                        keepalives_interval=10,
-                        keepalives_count=5,
-                        connect_timeout=10
-                    )
-                logger.info("✅ Подключение к базе данных установлено")
+                self.pool = pool.ThreadedConnectionPool(
+                    self.pool_min_size,
+                    self.pool_max_size,
+                    **self._connection_params()
+                )
+                logger.info(f"✅ Пул соединений с базой данных создан (min={self.pool_min_size}, max={self.pool_max_size})")
                 return
             except Exception as e:
                 logger.warning(f"⚠️ Попытка подключения {attempt + 1}/{self.max_retries} не удалась: {e}")
@@ -53,42 +179,137 @@ class Database:
                     time.sleep(self.retry_delay)
                 else:
                     logger.error(f"❌ Ошибка подключения к базе данных после {self.max_retries} попыток: {e}")
-                    self.connection = None
+                    self.pool = None
     
     def ensure_connection(self):
-        """Проверяет и восстанавливает соединение с базой данных"""
+        """Проверяет наличие пула соединений и создает его при необходимости"""
         try:
-            if self.connection is None or self.connection.closed:
-                logger.info("🔄 Восстановление соединения с базой данных...")
+            if self.pool is None or self.pool.closed:
+                logger.info("🔄 Восстановление пула соединений с базой данных...")
                 self.connect()
-                if self.connection and not self.connection.closed:
-                    return True
-                else:
-                    return False
+                return self.pool is not None
             return True
         except Exception as e:
             logger.error(f"❌ Ошибка проверки соединения: {e}")
             return False
     
+    def is_available(self) -> bool:
+        """
+        Проверка доступности базы данных (SELECT 1)
+        
+        Returns:
+            bool: True если запрос выполнен
+        """
+        def _ping_operation(connection):
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        
+        try:
+            return self.execute_with_retry(_ping_operation)
+        except Exception as e:
+            logger.warning(f"⚠️ База данных недоступна: {e}")
+            return False
+    
+    def _is_healthy(self, connection) -> bool:
+        """Проверка соединения при выдаче из пула"""
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        
+        # Давно простаивавшее соединение могло быть разорвано сервером (новые не проверяем)
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used > self.pool_check_idle:
+            try:
+                cursor = connection.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+                connection.rollback()
+            except Exception:
+                return False
+        return True
+    
+    def _release(self, connection, broken: bool = False):
+        """Возврат соединения в пул; сломанное соединение закрывается и будет пересоздано"""
+        try:
+            if not broken and not connection.closed:
+                if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                self._last_used[id(connection)] = time.monotonic()
+                self.pool.putconn(connection)
+            else:
+                self._last_used.pop(id(connection), None)
+                self.pool.putconn(connection, close=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка возврата соединения в пул: {e}")
+            self._last_used.pop(id(connection), None)
+            try:
+                self.pool.putconn(connection, close=True)
+            except Exception:
+                pass
+    
+    @contextmanager
+    def get_connection(self):
+        """Выдача соединения из пула на время одной операции"""
+        if not self.ensure_connection():
+            raise Exception("Не удалось установить соединение с базой данных")
+        
+        if not self._pool_slots.acquire(timeout=self.pool_timeout):
+            raise pool.PoolError(f"Нет свободных соединений в пуле за {self.pool_timeout}с")
+        
+        connection = None
+        try:
+            connection = self.pool.getconn()
+            if not self._is_healthy(connection):
+                logger.info("🔄 Соединение из пула неработоспособно, создаем новое")
+                self._last_used.pop(id(connection), None)
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+            
+            try:
+                yield connection
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self._release(connection, broken=True)
+                connection = None
+                raise
+            except Exception:
+                # Откатываем транзакцию, чтобы не вернуть в пул соединение с ошибкой
+                try:
+                    connection.rollback()
+                except Exception:
+                    pass
+                raise
+        finally:
+            if connection is not None:
+                self._release(connection)
+            self._pool_slots.release()
+    
     def execute_with_retry(self, operation, *args, **kwargs):
-        """Выполняет операцию с автоматическим retry при ошибках подключения"""
-        for attempt in range(self.max_retries):
+        """
+        Выполняет операцию на соединении из пула с автоматическим retry при ошибках подключения
+        
+        Операция получает соединение первым аргументом. При сетевой ошибке
+        пересоздается только соединение, на котором она произошла.
+        """
+        single_attempt = getattr(self._local, 'single_attempt', False)
+        attempts = 1 if single_attempt else self.max_retries
+        
+        for attempt in range(attempts):
             try:
-                if not self.ensure_connection():
-                    raise Exception("Не удалось установить соединение с базой данных")
-                
-                return operation(*args, **kwargs)
+                with self.get_connection() as connection:
+                    return operation(connection, *args, **kwargs)
                 
             except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if single_attempt:
+                    # Повтор с неблокирующей паузой выполнит AsyncDatabase
+                    self._local.retryable_error = e
+                    logger.warning(f"⚠️ Ошибка подключения: {e}")
+                    raise
                 logger.warning(f"⚠️ Ошибка подключения (попытка {attempt + 1}/{self.max_retries}): {e}")
                 if attempt < self.max_retries - 1:
-                    # Закрываем соединение и пробуем переподключиться
-                    if self.connection:
-                        try:
-                            self.connection.close()
-                        except:
-                            pass
-                    self.connection = None
                     time.sleep(self.retry_delay)
                 else:
                     logger.error(f"❌ Операция не удалась после {self.max_retries} попыток: {e}")
@@ -103,83 +324,192 @@ class Database:
             return
         
         try:
-            cursor = self.connection.cursor()
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
             
-            # Таблица пользователей
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    phone VARCHAR(20),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+                # Таблица пользователей
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS users (
+                        id SERIAL PRIMARY KEY,
+                        telegram_id BIGINT UNIQUE NOT NULL,
+                        username VARCHAR(255),
+                        first_name VARCHAR(255),
+                        last_name VARCHAR(255),
+                        phone VARCHAR(20),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
             
-            # Таблица консультаций
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS consultations (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    consultation_type VARCHAR(50) NOT NULL,
-                    amount DECIMAL(10,2) NOT NULL,
-                    payment_id VARCHAR(255),
-                    payment_status VARCHAR(50) DEFAULT 'pending',
-                    code_word VARCHAR(50) DEFAULT 'ЮРИСТ2024',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                )
-            """)
+                # Таблица консультаций
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS consultations (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        consultation_type VARCHAR(50) NOT NULL,
+                        amount DECIMAL(10,2) NOT NULL,
+                        payment_id VARCHAR(255),
+                        payment_status VARCHAR(50) DEFAULT 'pending',
+                        code_word VARCHAR(50),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+                    )
+                """)
             
-            # Добавляем поле code_word, если его нет
-            cursor.execute("""
-                ALTER TABLE consultations 
-                ADD COLUMN IF NOT EXISTS code_word VARCHAR(50) DEFAULT 'ЮРИСТ2024'
-            """)
+                # Добавляем поле code_word, если его нет
+                cursor.execute("""
+                    ALTER TABLE consultations 
+                    ADD COLUMN IF NOT EXISTS code_word VARCHAR(50)
+                """)
+                # Кодовое слово генерируется для каждой консультации (add_consultation)
+                cursor.execute("ALTER TABLE consultations ALTER COLUMN code_word DROP DEFAULT")
+                cursor.execute("""
+                    ALTER TABLE consultations 
+                    ADD COLUMN IF NOT EXISTS code_word_redeemed_at TIMESTAMP,
+                    ADD COLUMN IF NOT EXISTS code_word_redeemed_by BIGINT
+                """)
             
-            # Добавляем поле email, если его нет
-            cursor.execute("""
-                ALTER TABLE consultations 
-                ADD COLUMN IF NOT EXISTS email VARCHAR(255)
-            """)
+                # Добавляем поле email, если его нет
+                cursor.execute("""
+                    ALTER TABLE consultations 
+                    ADD COLUMN IF NOT EXISTS email VARCHAR(255)
+                """)
             
-            # Таблица ИИ консультаций
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ai_consultations (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    question TEXT NOT NULL,
-                    answer TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                )
-            """)
+                # Добавляем поле paid_at, если его нет
+                cursor.execute("""
+                    ALTER TABLE consultations 
+                    ADD COLUMN IF NOT EXISTS paid_at TIMESTAMP
+                """)
             
-            # Таблица подписок на ИИ консультации
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ai_subscriptions (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    subscription_type VARCHAR(50) NOT NULL,
-                    consultations_count INT NOT NULL,
-                    amount DECIMAL(10,2) NOT NULL,
-                    payment_id VARCHAR(255),
-                    payment_status VARCHAR(50) DEFAULT 'pending',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                )
-            """)
+                # Таблица ИИ консультаций
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ai_consultations (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        question TEXT NOT NULL,
+                        answer TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+                    )
+                """)
             
-            self.connection.commit()
-            cursor.close()
+                # Таблица подписок на ИИ консультации
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ai_subscriptions (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT NOT NULL,
+                        subscription_type VARCHAR(50) NOT NULL,
+                        consultations_count INT NOT NULL,
+                        amount DECIMAL(10,2) NOT NULL,
+                        payment_id VARCHAR(255),
+                        payment_status VARCHAR(50) DEFAULT 'pending',
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+                    )
+                """)
+                
+                # Учет использования ИИ консультаций: одна строка на пользователя
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ai_usage (
+                        user_id BIGINT PRIMARY KEY,
+                        consultations_used INT NOT NULL DEFAULT 0,
+                        subscription_consultations INT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+                    )
+                """)
+                
+                # Клиенты, обратившиеся к юристу (общие для бота и клиента юриста)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS lawyer_contacts (
+                        client_id BIGINT PRIMARY KEY,
+                        sender_id BIGINT,
+                        sender_username VARCHAR(255),
+                        user_info JSONB,
+                        payment_info JSONB,
+                        contacts_count INT NOT NULL DEFAULT 1,
+                        first_contact TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_contact TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                # Позиции фоновых задач для продолжения после перезапуска
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS worker_checkpoints (
+                        name VARCHAR(100) PRIMARY KEY,
+                        last_id BIGINT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                # Состояние диалогов с ботом (общее для всех экземпляров бота)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS conversation_state (
+                        namespace VARCHAR(50) NOT NULL,
+                        key VARCHAR(100) NOT NULL,
+                        value JSONB NOT NULL,
+                        expires_at TIMESTAMP NOT NULL,
+                        PRIMARY KEY (namespace, key)
+                    )
+                """)
+                
+                # Миграция: индексы для запросов горячего пути
+                for index_sql in INDEXES:
+                    cursor.execute(index_sql)
+                
+                connection.commit()
+                cursor.close()
             logger.info("✅ Таблицы созданы/проверены")
             
         except Exception as e:
             logger.error(f"❌ Ошибка создания таблиц: {e}")
     
+    def check_query_plans(self) -> Dict[str, List[str]]:
+        """
+        Проверка планов выполнения запросов горячего пути через EXPLAIN
+        
+        Последовательное сканирование запрещается на время проверки (enable_seqscan = off),
+        поэтому Seq Scan в плане означает, что подходящего индекса нет.
+        
+        Returns:
+            Dict[str, List[str]]: Запросы и таблицы, которые сканируются последовательно
+        """
+        sample_params = {"user_id": 0, "code_word": "", "payment_id": "", "limit": 1, "since_seconds": 3600}
+        
+        def _collect_seq_scans(plan: Dict, found: List[str]):
+            if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in INDEXED_TABLES:
+                found.append(plan["Relation Name"])
+            for child in plan.get("Plans", []):
+                _collect_seq_scans(child, found)
+        
+        def _explain_operation(connection):
+            report = {}
+            cursor = connection.cursor()
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            for name, query in HOT_QUERIES.items():
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query, sample_params)
+                plan = cursor.fetchone()[0][0]["Plan"]
+                seq_scans = []
+                _collect_seq_scans(plan, seq_scans)
+                if seq_scans:
+                    report[name] = seq_scans
+            cursor.close()
+            connection.rollback()
+            return report
+        
+        try:
+            report = self.execute_with_retry(_explain_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки планов запросов: {e}")
+            return {}
+        
+        if report:
+            for name, tables in report.items():
+                logger.warning(f"⚠️ Запрос {name} выполняет последовательное сканирование: {', '.join(tables)}")
+        else:
+            logger.info("✅ Запросы горячего пути используют индексы")
+        return report
+    
     def add_user(self, telegram_id: int, username: Optional[str] = None, 
                  first_name: Optional[str] = None, last_name: Optional[str] = None,
                  phone: Optional[str] = None) -> bool:
@@ -196,8 +526,8 @@ class Database:
         Returns:
             bool: True если успешно
         """
-        def _add_user_operation():
-            cursor = self.connection.cursor()
+        def _add_user_operation(connection):
+            cursor = connection.cursor()
             
             cursor.execute("""
                 INSERT INTO users (telegram_id, username, first_name, last_name, phone, updated_at)
@@ -211,7 +541,7 @@ class Database:
                     updated_at = CURRENT_TIMESTAMP
             """, (telegram_id, username, first_name, last_name, phone))
             
-            self.connection.commit()
+            connection.commit()
             cursor.close()
             logger.info(f"✅ Пользователь {telegram_id} добавлен/обновлен")
             return True
@@ -222,9 +552,82 @@ class Database:
             logger.error(f"❌ Ошибка добавления пользователя {telegram_id}: {e}")
             return False
     
+    def write_batch(self, users: List[Dict], ai_consultations: List[Dict]) -> bool:
+        """
+        Пакетная запись пользователей и ИИ консультаций одной транзакцией
+        
+        Args:
+            users: Строки пользователей (telegram_id, username, first_name, last_name, phone)
+            ai_consultations: Строки ИИ консультаций (user_id, question, answer)
+            
+        Returns:
+            bool: True если успешно
+        """
+        def _write_batch_operation(connection):
+            cursor = connection.cursor()
+            
+            if users:
+                # ON CONFLICT не может обновить одну строку дважды - оставляем последнюю запись
+                latest = {row['telegram_id']: row for row in users}
+                execute_values(cursor, """
+                    INSERT INTO users (telegram_id, username, first_name, last_name, phone, updated_at)
+                    VALUES %s
+                    ON CONFLICT (telegram_id)
+                    DO UPDATE SET
+                        username = EXCLUDED.username,
+                        first_name = EXCLUDED.first_name,
+                        last_name = EXCLUDED.last_name,
+                        phone = EXCLUDED.phone,
+                        updated_at = CURRENT_TIMESTAMP
+                """, [
+                    (row['telegram_id'], row.get('username'), row.get('first_name'),
+                     row.get('last_name'), row.get('phone'))
+                    for row in latest.values()
+                ], template="(%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)")
+            
+            if ai_consultations:
+                user_ids = sorted({row['user_id'] for row in ai_consultations})
+                
+                # Пользователь мог написать боту без /start - создаем запись, чтобы не нарушить внешний ключ
+                execute_values(cursor, """
+                    INSERT INTO users (telegram_id) VALUES %s
+                    ON CONFLICT (telegram_id) DO NOTHING
+                """, [(user_id,) for user_id in user_ids])
+                
+                execute_values(cursor, """
+                    INSERT INTO ai_consultations (user_id, question, answer, created_at)
+                    VALUES %s
+                """, [
+                    (row['user_id'], row['question'], row.get('answer'), row.get('created_at') or datetime.now())
+                    for row in ai_consultations
+                ])
+                
+                # Счетчики использования обновляются в той же транзакции
+                used = {}
+                for row in ai_consultations:
+                    used[row['user_id']] = used.get(row['user_id'], 0) + 1
+                execute_values(cursor, """
+                    INSERT INTO ai_usage (user_id, consultations_used)
+                    VALUES %s
+                    ON CONFLICT (user_id)
+                    DO UPDATE SET
+                        consultations_used = ai_usage.consultations_used + EXCLUDED.consultations_used,
+                        updated_at = CURRENT_TIMESTAMP
+                """, sorted(used.items()))
+            
+            connection.commit()
+            cursor.close()
+            return True
+        
+        try:
+            return self.execute_with_retry(_write_batch_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетной записи ({len(users)} пользователей, {len(ai_consultations)} ИИ консультаций): {e}")
+            return False
+    
     def add_consultation(self, user_id: int, consultation_type: str, 
                         amount: float, payment_id: Optional[str] = None, 
-                        code_word: str = "ЮРИСТ2024", email: Optional[str] = None) -> bool:
+                        code_word: Optional[str] = None, email: Optional[str] = None) -> Optional[str]:
         """
         Добавление записи о консультации
         
@@ -233,28 +636,47 @@ class Database:
             consultation_type: Тип консультации
             amount: Сумма платежа
             payment_id: ID платежа
+            code_word: Кодовое слово (по умолчанию генерируется уникальное)
+            email: Email для чека
             
         Returns:
-            bool: True если успешно
+            str: Кодовое слово консультации или None при ошибке
         """
-        def _add_consultation_operation():
-            cursor = self.connection.cursor()
+        def _add_consultation_operation(connection):
+            cursor = connection.cursor()
             
+            # Запись пользователя может еще находиться в буфере отложенной записи
             cursor.execute("""
-                INSERT INTO consultations (user_id, consultation_type, amount, payment_id, payment_status, code_word, email)
-                VALUES (%s, %s, %s, %s, 'completed', %s, %s)
-            """, (user_id, consultation_type, amount, payment_id, code_word, email))
+                INSERT INTO users (telegram_id) VALUES (%s)
+                ON CONFLICT (telegram_id) DO NOTHING
+            """, (user_id,))
+            
+            # Совпадение случайных кодов маловероятно, но возможно - генерируем заново
+            for attempt in range(5):
+                consultation_code = code_word or generate_code_word()
+                cursor.execute("SAVEPOINT add_consultation")
+                try:
+                    cursor.execute("""
+                        INSERT INTO consultations (user_id, consultation_type, amount, payment_id, payment_status, code_word, email)
+                        VALUES (%s, %s, %s, %s, 'pending', %s, %s)
+                    """, (user_id, consultation_type, amount, payment_id, consultation_code, email))
+                    break
+                except errors.UniqueViolation:
+                    cursor.execute("ROLLBACK TO SAVEPOINT add_consultation")
+                    if code_word or attempt == 4:
+                        raise
+                    logger.warning(f"Кодовое слово {consultation_code} уже занято, генерируем новое")
             
-            self.connection.commit()
+            connection.commit()
             cursor.close()
-            logger.info(f"✅ Консультация добавлена для пользователя {user_id}")
-            return True
+            logger.info(f"✅ Консультация добавлена для пользователя {user_id} (ожидает оплаты)")
+            return consultation_code
         
         try:
             return self.execute_with_retry(_add_consultation_operation)
         except Exception as e:
             logger.error(f"❌ Ошибка добавления консультации для {user_id}: {e}")
-            return False
+            return None
     
     def get_user_info(self, telegram_id: int) -> Optional[Dict]:
         """
@@ -266,8 +688,8 @@ class Database:
         Returns:
             Dict: Информация о пользователе или None
         """
-        def _get_user_operation():
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
+        def _get_user_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
             
             cursor.execute("""
                 SELECT * FROM users WHERE telegram_id = %s
@@ -294,17 +716,10 @@ class Database:
         Returns:
             Dict: Информация о последней консультации или None
         """
-        def _get_consultation_operation():
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
+        def _get_consultation_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
             
-            cursor.execute("""
-                SELECT c.*, u.username, u.phone
-                FROM consultations c
-                JOIN users u ON c.user_id = u.telegram_id
-                WHERE c.user_id = %s
-                ORDER BY c.created_at DESC
-                LIMIT 1
-            """, (telegram_id,))
+            cursor.execute(HOT_QUERIES["get_last_consultation"], {"user_id": telegram_id})
             
             consultation = cursor.fetchone()
             cursor.close()
@@ -317,6 +732,348 @@ class Database:
             logger.error(f"❌ Ошибка получения последней консультации для {telegram_id}: {e}")
             return None
     
+    def get_last_paid_consultation(self, telegram_id: int) -> Optional[Dict]:
+        """
+        Получение последней оплаченной консультации пользователя
+        
+        Args:
+            telegram_id: ID пользователя в Telegram
+            
+        Returns:
+            Dict: Информация о консультации или None
+        """
+        def _get_consultation_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(HOT_QUERIES["get_last_paid_consultation"], {"user_id": telegram_id})
+            
+            consultation = cursor.fetchone()
+            cursor.close()
+            
+            return dict(consultation) if consultation else None
+        
+        try:
+            return self.execute_with_retry(_get_consultation_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения оплаченной консультации для {telegram_id}: {e}")
+            return None
+    
+    def get_consultation_by_payment_id(self, payment_id: str) -> Optional[Dict]:
+        """
+        Получение консультации по ID платежа
+        
+        Args:
+            payment_id: ID платежа в ЮKassa
+            
+        Returns:
+            Dict: user_id, consultation_type, amount, payment_status, email или None
+        """
+        def _get_consultation_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(HOT_QUERIES["get_consultation_by_payment_id"], {"payment_id": payment_id})
+            
+            consultation = cursor.fetchone()
+            cursor.close()
+            
+            return dict(consultation) if consultation else None
+        
+        try:
+            return self.execute_with_retry(_get_consultation_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения консультации по платежу {payment_id}: {e}")
+            return None
+    
+    def update_payment_status(self, payment_id: str, status: str) -> Optional[Dict]:
+        """
+        Перевод консультации из статуса pending в новый статус
+        
+        Обновление идемпотентно: повторное уведомление о том же платеже
+        не меняет запись и возвращает None.
+        
+        Args:
+            payment_id: ID платежа в ЮKassa
+            status: Новый статус (completed/canceled)
+            
+        Returns:
+            Dict: Обновленная консультация, если статус изменился, иначе None
+        """
+        def _update_status_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute("""
+                UPDATE consultations
+                SET payment_status = %(status)s,
+                    paid_at = CASE WHEN %(status)s = 'completed' THEN CURRENT_TIMESTAMP ELSE paid_at END
+                WHERE payment_id = %(payment_id)s AND payment_status = 'pending'
+                RETURNING user_id, consultation_type, amount, email, code_word
+            """, {"payment_id": payment_id, "status": status})
+            
+            consultation = cursor.fetchone()
+            connection.commit()
+            cursor.close()
+            
+            if consultation:
+                logger.info(f"✅ Платеж {payment_id}: статус консультации изменен на {status}")
+            return dict(consultation) if consultation else None
+        
+        try:
+            return self.execute_with_retry(_update_status_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления статуса платежа {payment_id}: {e}")
+            return None
+    
+    def get_pending_payments(self, after_id: int, limit: int, min_age_seconds: float = 0) -> List[Dict]:
+        """
+        Пакет неоплаченных консультаций по возрастанию id (keyset-пагинация)
+        
+        Args:
+            after_id: id последней обработанной консультации
+            limit: Размер пакета
+            min_age_seconds: Пропускать консультации моложе этого возраста
+            
+        Returns:
+            List[Dict]: Строки id, payment_id
+        """
+        def _get_pending_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute("""
+                SELECT id, payment_id FROM consultations
+                WHERE payment_status = 'pending' AND id > %s AND payment_id IS NOT NULL
+                  AND created_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                ORDER BY id
+                LIMIT %s
+            """, (after_id, min_age_seconds, limit))
+            
+            rows = cursor.fetchall()
+            cursor.close()
+            
+            return [dict(row) for row in rows]
+        
+        try:
+            return self.execute_with_retry(_get_pending_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения неоплаченных консультаций: {e}")
+            return []
+    
+    def apply_payment_statuses(self, statuses: List[tuple]) -> Optional[List[Dict]]:
+        """
+        Пакетный перевод консультаций из pending в новые статусы
+        
+        Args:
+            statuses: Пары (payment_id, статус completed/canceled)
+            
+        Returns:
+            List[Dict]: Консультации, статус которых изменился, или None при ошибке
+        """
+        if not statuses:
+            return []
+        
+        def _apply_statuses_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            rows = execute_values(cursor, """
+                UPDATE consultations AS c
+                SET payment_status = v.status,
+                    paid_at = CASE WHEN v.status = 'completed' THEN CURRENT_TIMESTAMP ELSE c.paid_at END
+                FROM (VALUES %s) AS v (payment_id, status)
+                WHERE c.payment_id = v.payment_id AND c.payment_status = 'pending'
+                RETURNING c.payment_id, c.payment_status, c.user_id, c.consultation_type, c.amount, c.email, c.code_word
+            """, statuses, fetch=True)
+            
+            connection.commit()
+            cursor.close()
+            
+            return [dict(row) for row in rows]
+        
+        try:
+            return self.execute_with_retry(_apply_statuses_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного обновления статусов платежей ({len(statuses)}): {e}")
+            return None
+    
+    def get_checkpoint(self, name: str) -> int:
+        """
+        Позиция фоновой задачи
+        
+        Args:
+            name: Имя задачи
+            
+        Returns:
+            int: Последний обработанный id (0, если позиции нет)
+        """
+        def _get_checkpoint_operation(connection):
+            cursor = connection.cursor()
+            
+            cursor.execute("SELECT last_id FROM worker_checkpoints WHERE name = %s", (name,))
+            
+            row = cursor.fetchone()
+            cursor.close()
+            
+            return row[0] if row else 0
+        
+        try:
+            return self.execute_with_retry(_get_checkpoint_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения позиции задачи {name}: {e}")
+            return 0
+    
+    def save_checkpoint(self, name: str, last_id: int) -> bool:
+        """
+        Сохранение позиции фоновой задачи
+        
+        Args:
+            name: Имя задачи
+            last_id: Последний обработанный id
+            
+        Returns:
+            bool: True если успешно
+        """
+        def _save_checkpoint_operation(connection):
+            cursor = connection.cursor()
+            
+            cursor.execute("""
+                INSERT INTO worker_checkpoints (name, last_id) VALUES (%s, %s)
+                ON CONFLICT (name)
+                DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = CURRENT_TIMESTAMP
+            """, (name, last_id))
+            
+            connection.commit()
+            cursor.close()
+            return True
+        
+        try:
+            return self.execute_with_retry(_save_checkpoint_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения позиции задачи {name}: {e}")
+            return False
+    
+    def get_state(self, namespace: str, key: str):
+        """
+        Чтение состояния диалога
+        
+        Args:
+            namespace: Вид состояния (например, email_waiting)
+            key: Ключ (обычно Telegram ID)
+            
+        Returns:
+            Значение или None, если его нет или срок истек
+        """
+        def _get_state_operation(connection):
+            cursor = connection.cursor()
+            
+            cursor.execute("""
+                SELECT value FROM conversation_state
+                WHERE namespace = %s AND key = %s AND expires_at > CURRENT_TIMESTAMP
+            """, (namespace, key))
+            
+            row = cursor.fetchone()
+            cursor.close()
+            return row[0] if row else None
+        
+        try:
+            return self.execute_with_retry(_get_state_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения состояния {namespace}:{key}: {e}")
+            return None
+    
+    def set_state(self, namespace: str, key: str, value, ttl: float) -> bool:
+        """
+        Сохранение состояния диалога
+        
+        Args:
+            namespace: Вид состояния
+            key: Ключ
+            value: Значение (сериализуемое в JSON)
+            ttl: Время жизни в секундах
+            
+        Returns:
+            bool: True если успешно
+        """
+        def _set_state_operation(connection):
+            cursor = connection.cursor()
+            
+            cursor.execute("""
+                INSERT INTO conversation_state (namespace, key, value, expires_at)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                ON CONFLICT (namespace, key)
+                DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+            """, (namespace, key, self._json(value), ttl))
+            
+            connection.commit()
+            cursor.close()
+            return True
+        
+        try:
+            return self.execute_with_retry(_set_state_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения состояния {namespace}:{key}: {e}")
+            return False
+    
+    def pop_state(self, namespace: str, key: str):
+        """
+        Удаление состояния диалога с возвратом значения
+        
+        Удаление и чтение выполняются одним запросом, поэтому при нескольких
+        экземплярах бота значение получает только один из них.
+        
+        Returns:
+            Значение или None, если его нет или срок истек
+        """
+        def _pop_state_operation(connection):
+            cursor = connection.cursor()
+            
+            cursor.execute("""
+                DELETE FROM conversation_state
+                WHERE namespace = %s AND key = %s
+                RETURNING value, expires_at > CURRENT_TIMESTAMP
+            """, (namespace, key))
+            
+            row = cursor.fetchone()
+            connection.commit()
+            cursor.close()
+            return row[0] if row and row[1] else None
+        
+        try:
+            return self.execute_with_retry(_pop_state_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления состояния {namespace}:{key}: {e}")
+            return None
+    
+    def purge_expired_state(self, limit: int = 10000) -> int:
+        """
+        Удаление истекшего состояния диалогов
+        
+        Args:
+            limit: Максимум строк за один вызов (короткая транзакция)
+            
+        Returns:
+            int: Количество удаленных строк
+        """
+        def _purge_state_operation(connection):
+            cursor = connection.cursor()
+            
+            cursor.execute("""
+                DELETE FROM conversation_state
+                WHERE ctid IN (
+                    SELECT ctid FROM conversation_state
+                    WHERE expires_at <= CURRENT_TIMESTAMP
+                    LIMIT %s
+                )
+            """, (limit,))
+            deleted = cursor.rowcount
+            
+            connection.commit()
+            cursor.close()
+            return deleted
+        
+        try:
+            return self.execute_with_retry(_purge_state_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления истекшего состояния: {e}")
+            return 0
+    
     def verify_code_word(self, telegram_id: int, code_word: str) -> bool:
         """
         Проверка кодового слова для пользователя
@@ -328,20 +1085,15 @@ class Database:
         Returns:
             bool: True если кодовое слово верное
         """
-        def _verify_operation():
-            cursor = self.connection.cursor()
+        def _verify_operation(connection):
+            cursor = connection.cursor()
             
-            cursor.execute("""
-                SELECT COUNT(*) FROM consultations 
-                WHERE user_id = %s AND code_word = %s AND payment_status = 'completed'
-                ORDER BY created_at DESC
-                LIMIT 1
-            """, (telegram_id, code_word))
+            cursor.execute(HOT_QUERIES["verify_code_word"], {"user_id": telegram_id, "code_word": code_word})
             
-            count = cursor.fetchone()[0]
+            exists = cursor.fetchone()[0]
             cursor.close()
             
-            return count > 0
+            return bool(exists)
         
         try:
             return self.execute_with_retry(_verify_operation)
@@ -360,17 +1112,10 @@ class Database:
         Returns:
             Dict: Информация о консультации или None
         """
-        def _get_consultation_operation():
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
+        def _get_consultation_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
             
-            cursor.execute("""
-                SELECT c.*, u.username, u.first_name, u.last_name, u.phone
-                FROM consultations c
-                JOIN users u ON c.user_id = u.telegram_id
-                WHERE c.user_id = %s AND c.code_word = %s
-                ORDER BY c.created_at DESC
-                LIMIT 1
-            """, (telegram_id, code_word))
+            cursor.execute(HOT_QUERIES["get_consultation_by_code_word"], {"user_id": telegram_id, "code_word": code_word})
             
             consultation = cursor.fetchone()
             cursor.close()
@@ -383,6 +1128,90 @@ class Database:
             logger.error(f"❌ Ошибка получения консультации по кодовому слову для {telegram_id}: {e}")
             return None
     
+    def get_consultation_by_code(self, code_word: str) -> Optional[Dict]:
+        """
+        Получение консультации по уникальному кодовому слову
+        
+        Args:
+            code_word: Кодовое слово (ЮР-XXXXXX)
+            
+        Returns:
+            Dict: Консультация с данными пользователя или None
+        """
+        def _get_by_code_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute(HOT_QUERIES["get_consultation_by_code"], {"code_word": code_word})
+            
+            consultation = cursor.fetchone()
+            cursor.close()
+            
+            return dict(consultation) if consultation else None
+        
+        try:
+            return self.execute_with_retry(_get_by_code_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения консультации по кодовому слову {code_word}: {e}")
+            return None
+    
+    def redeem_code_word(self, code_word: str, lawyer_id: int) -> Dict:
+        """
+        Погашение кодового слова оплаченной консультации
+        
+        Проверка и отметка о погашении выполняются одним UPDATE, поэтому при
+        одновременной проверке несколькими юристами код погашает только один.
+        
+        Args:
+            code_word: Уникальное кодовое слово (ЮР-XXXXXX)
+            lawyer_id: Telegram ID юриста, погасившего код
+            
+        Returns:
+            Dict: status (redeemed, already_redeemed, unpaid, not_found, error) и consultation
+        """
+        if code_word == LEGACY_CODE_WORD:
+            # Общее кодовое слово не определяет консультацию
+            return {"status": "not_found", "consultation": None}
+        
+        def _redeem_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute("""
+                WITH redeemed AS (
+                    UPDATE consultations
+                    SET code_word_redeemed_at = CURRENT_TIMESTAMP, code_word_redeemed_by = %(lawyer_id)s
+                    WHERE code_word = %(code_word)s
+                      AND payment_status = 'completed'
+                      AND code_word_redeemed_at IS NULL
+                    RETURNING *
+                )
+                SELECT r.*, u.username, u.first_name, u.last_name, u.phone
+                FROM redeemed r
+                JOIN users u ON r.user_id = u.telegram_id
+            """, {"code_word": code_word, "lawyer_id": lawyer_id})
+            consultation = cursor.fetchone()
+            connection.commit()
+            
+            if consultation:
+                cursor.close()
+                return {"status": "redeemed", "consultation": dict(consultation)}
+            
+            # Код не погашен - выясняем причину
+            cursor.execute(HOT_QUERIES["get_consultation_by_code"], {"code_word": code_word})
+            consultation = cursor.fetchone()
+            cursor.close()
+            
+            if not consultation:
+                return {"status": "not_found", "consultation": None}
+            if consultation["payment_status"] != "completed":
+                return {"status": "unpaid", "consultation": dict(consultation)}
+            return {"status": "already_redeemed", "consultation": dict(consultation)}
+        
+        try:
+            return self.execute_with_retry(_redeem_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка погашения кодового слова {code_word}: {e}")
+            return {"status": "error", "consultation": None}
+    
     def get_consultation_email(self, payment_id: str) -> Optional[str]:
         """
         Получение email из консультации по ID платежа
@@ -393,15 +1222,10 @@ class Database:
         Returns:
             str: Email или None
         """
-        def _get_email_operation():
-            cursor = self.connection.cursor()
+        def _get_email_operation(connection):
+            cursor = connection.cursor()
             
-            cursor.execute("""
-                SELECT email FROM consultations 
-                WHERE payment_id = %s 
-                ORDER BY created_at DESC 
-                LIMIT 1
-            """, (payment_id,))
+            cursor.execute(HOT_QUERIES["get_consultation_email"], {"payment_id": payment_id})
             
             result = cursor.fetchone()
             cursor.close()
@@ -424,8 +1248,8 @@ class Database:
         Returns:
             Dict: Статистика пользователя
         """
-        def _get_stats_operation():
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
+        def _get_stats_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
             
             # Общее количество консультаций
             cursor.execute("""
@@ -450,10 +1274,10 @@ class Database:
             return {}
     
     def close(self):
-        """Закрытие соединения с базой данных"""
-        if self.connection:
-            self.connection.close()
-            logger.info("🔌 Соединение с базой данных закрыто")
+        """Закрытие всех соединений пула"""
+        if self.pool and not self.pool.closed:
+            self.pool.closeall()
+            logger.info("🔌 Соединения с базой данных закрыты")
     
     def add_ai_consultation(self, user_id: int, question: str, answer: str = None) -> bool:
         """
@@ -467,14 +1291,24 @@ class Database:
         Returns:
             bool: True если успешно
         """
-        def _add_ai_consultation_operation():
-            cursor = self.connection.cursor()
+        def _add_ai_consultation_operation(connection):
+            cursor = connection.cursor()
             cursor.execute("""
                 INSERT INTO ai_consultations (user_id, question, answer)
                 VALUES (%s, %s, %s)
             """, (user_id, question, answer))
             
-            self.connection.commit()
+            # Счетчик использования обновляется в той же транзакции
+            cursor.execute("""
+                INSERT INTO ai_usage (user_id, consultations_used)
+                VALUES (%s, 1)
+                ON CONFLICT (user_id)
+                DO UPDATE SET
+                    consultations_used = ai_usage.consultations_used + 1,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (user_id,))
+            
+            connection.commit()
             cursor.close()
             return True
         
@@ -484,6 +1318,18 @@ class Database:
             logger.error(f"❌ Ошибка добавления ИИ консультации для {user_id}: {e}")
             return False
     
+    def _get_ai_usage(self, user_id: int) -> Dict:
+        """Чтение строки учета использования ИИ консультаций по первичному ключу"""
+        def _get_usage_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(HOT_QUERIES["get_ai_usage"], {"user_id": user_id})
+            
+            usage = cursor.fetchone()
+            cursor.close()
+            return dict(usage) if usage else {'consultations_used': 0, 'subscription_consultations': 0}
+        
+        return self.execute_with_retry(_get_usage_operation)
+    
     def get_ai_consultations_count(self, user_id: int) -> int:
         """
         Получение количества ИИ консультаций пользователя
@@ -494,46 +1340,246 @@ class Database:
         Returns:
             int: Количество консультаций
         """
-        def _get_count_operation():
-            cursor = self.connection.cursor()
+        try:
+            return self._get_ai_usage(user_id)['consultations_used']
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения количества ИИ консультаций для {user_id}: {e}")
+            return 0
+    
+    @staticmethod
+    def _json(value) -> Optional[Json]:
+        # В строках из базы есть datetime и Decimal
+        if value is None:
+            return None
+        return Json(value, dumps=lambda obj: json.dumps(obj, ensure_ascii=False, default=str))
+    
+    def upsert_lawyer_contact(self, client_id: int, user_info: Optional[Dict] = None,
+                              payment_info: Optional[Dict] = None, sender_id: Optional[int] = None,
+                              sender_username: Optional[str] = None) -> bool:
+        """
+        Сохранение обращения клиента к юристу
+        
+        Args:
+            client_id: Telegram ID клиента
+            user_info: Данные пользователя
+            payment_info: Данные оплаченной консультации
+            sender_id: Telegram ID отправителя сообщения
+            sender_username: Username отправителя сообщения
+            
+        Returns:
+            bool: True если успешно
+        """
+        def _upsert_contact_operation(connection):
+            cursor = connection.cursor()
+            
             cursor.execute("""
-                SELECT COUNT(*) FROM ai_consultations 
-                WHERE user_id = %s
-            """, (user_id,))
+                INSERT INTO lawyer_contacts (client_id, sender_id, sender_username, user_info, payment_info)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (client_id)
+                DO UPDATE SET
+                    sender_id = COALESCE(EXCLUDED.sender_id, lawyer_contacts.sender_id),
+                    sender_username = COALESCE(EXCLUDED.sender_username, lawyer_contacts.sender_username),
+                    user_info = COALESCE(EXCLUDED.user_info, lawyer_contacts.user_info),
+                    payment_info = COALESCE(EXCLUDED.payment_info, lawyer_contacts.payment_info),
+                    contacts_count = lawyer_contacts.contacts_count + 1,
+                    last_contact = CURRENT_TIMESTAMP
+            """, (client_id, sender_id, sender_username, self._json(user_info), self._json(payment_info)))
             
-            count = cursor.fetchone()[0]
+            connection.commit()
             cursor.close()
-            return count
+            return True
         
         try:
-            return self.execute_with_retry(_get_count_operation)
+            return self.execute_with_retry(_upsert_contact_operation)
         except Exception as e:
-            logger.error(f"❌ Ошибка получения количества ИИ консультаций для {user_id}: {e}")
+            logger.error(f"❌ Ошибка сохранения обращения клиента {client_id}: {e}")
+            return False
+    
+    def import_lawyer_contacts(self, contacts: List[Dict]) -> int:
+        """
+        Импорт клиентов юриста из локальных файлов (существующие записи не меняются)
+        
+        Args:
+            contacts: Строки client_id, user_info, payment_info, last_contact, sender_id, sender_username
+            
+        Returns:
+            int: Количество импортированных клиентов или -1 при ошибке
+        """
+        if not contacts:
             return 0
+        
+        def _import_contacts_operation(connection):
+            cursor = connection.cursor()
+            
+            rows = execute_values(cursor, """
+                INSERT INTO lawyer_contacts (client_id, sender_id, sender_username, user_info, payment_info, last_contact)
+                VALUES %s
+                ON CONFLICT (client_id) DO NOTHING
+                RETURNING client_id
+            """, [
+                (int(row["client_id"]), row.get("sender_id"), row.get("sender_username"),
+                 self._json(row.get("user_info")), self._json(row.get("payment_info")),
+                 row.get("last_contact") or datetime.now())
+                for row in contacts
+            ], fetch=True)
+            imported = len(rows)
+            
+            connection.commit()
+            cursor.close()
+            return imported
+        
+        try:
+            return self.execute_with_retry(_import_contacts_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка импорта клиентов юриста: {e}")
+            return -1
     
-    def get_ai_subscription_consultations(self, user_id: int) -> int:
+    def get_lawyer_stats_summary(self) -> Dict:
         """
-        Получение количества доступных консультаций по подписке
+        Сводная статистика для юриста: клиенты, оплаченные консультации и выручка
+        
+        Returns:
+            Dict: clients, last_contact, paid_consultations, paying_users, revenue
+        """
+        def _get_stats_summary_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            cursor.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM lawyer_contacts) AS clients,
+                    (SELECT MAX(last_contact) FROM lawyer_contacts) AS last_contact,
+                    COUNT(*) AS paid_consultations,
+                    COUNT(DISTINCT user_id) AS paying_users,
+                    COALESCE(SUM(amount), 0) AS revenue
+                FROM consultations
+                WHERE payment_status = 'completed'
+            """)
+            
+            row = cursor.fetchone()
+            cursor.close()
+            return dict(row)
+        
+        try:
+            return self.execute_with_retry(_get_stats_summary_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения статистики юриста: {e}")
+            return {}
+    
+    def get_lawyer_stats_page(self, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """
+        Страница клиентов юриста по убыванию времени последнего контакта
         
         Args:
-            user_id: ID пользователя
+            limit: Размер страницы
+            offset: Смещение
             
         Returns:
-            int: Количество доступных консультаций
+            List[Dict]: Клиенты с именем из users и суммой оплаченных консультаций
         """
-        def _get_subscription_operation():
-            cursor = self.connection.cursor()
+        def _get_stats_page_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            
+            # Агрегаты считаются только для клиентов выбранной страницы
             cursor.execute("""
-                SELECT SUM(consultations_count) FROM ai_subscriptions 
-                WHERE user_id = %s AND payment_status = 'completed'
-            """, (user_id,))
+                SELECT c.client_id, c.sender_username, c.contacts_count, c.last_contact,
+                       u.username, u.first_name, u.last_name,
+                       paid.consultations AS paid_consultations, paid.amount AS paid_amount
+                FROM (
+                    SELECT * FROM lawyer_contacts
+                    ORDER BY last_contact DESC
+                    LIMIT %s OFFSET %s
+                ) c
+                LEFT JOIN users u ON u.telegram_id = c.client_id
+                CROSS JOIN LATERAL (
+                    SELECT COUNT(*) AS consultations, COALESCE(SUM(amount), 0) AS amount
+                    FROM consultations
+                    WHERE user_id = c.client_id AND payment_status = 'completed'
+                ) paid
+                ORDER BY c.last_contact DESC
+            """, (limit, offset))
+            
+            rows = cursor.fetchall()
+            cursor.close()
+            return [dict(row) for row in rows]
+        
+        try:
+            return self.execute_with_retry(_get_stats_page_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения клиентов юриста: {e}")
+            return []
+    
+    def get_recent_ai_consultations(self, limit: int = 1000) -> List[Dict]:
+        """
+        Получение последних ИИ консультаций с ответами (для прогрева кэша ответов)
+        
+        Args:
+            limit: Максимальное количество записей
+            
+        Returns:
+            List[Dict]: Вопросы и ответы в порядке от старых к новым
+        """
+        def _get_recent_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT question, answer, created_at FROM (
+                    SELECT question, answer, created_at FROM ai_consultations
+                    WHERE answer IS NOT NULL
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                ) recent
+                ORDER BY created_at
+            """, (limit,))
+            
+            rows = cursor.fetchall()
+            cursor.close()
+            return [dict(row) for row in rows]
+        
+        try:
+            return self.execute_with_retry(_get_recent_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения последних ИИ консультаций: {e}")
+            return []
+    
+    def get_ai_history(self, user_id: int, limit: int = 10, since_seconds: float = 3600) -> List[Dict]:
+        """
+        Последние вопросы и ответы ИИ консультаций пользователя (контекст диалога)
+        
+        Args:
+            user_id: ID пользователя в Telegram
+            limit: Максимальное количество пар вопрос-ответ
+            since_seconds: Учитывать только консультации за последние N секунд
+            
+        Returns:
+            List[Dict]: Вопросы и ответы от новых к старым
+        """
+        def _get_history_operation(connection):
+            cursor = connection.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(HOT_QUERIES["get_ai_history"], {
+                "user_id": user_id, "limit": limit, "since_seconds": since_seconds
+            })
             
-            result = cursor.fetchone()[0]
+            rows = cursor.fetchall()
             cursor.close()
-            return int(result) if result else 0
+            return [dict(row) for row in rows]
+        
+        try:
+            return self.execute_with_retry(_get_history_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения истории ИИ консультаций для {user_id}: {e}")
+            return []
+    
+    def get_ai_subscription_consultations(self, user_id: int) -> int:
+        """
+        Получение количества доступных консультаций по подписке
         
+        Args:
+            user_id: ID пользователя
+            
+        Returns:
+            int: Количество доступных консультаций
+        """
         try:
-            return self.execute_with_retry(_get_subscription_operation)
+            return self._get_ai_usage(user_id)['subscription_consultations']
         except Exception as e:
             logger.error(f"❌ Ошибка получения подписки ИИ консультаций для {user_id}: {e}")
             return 0
@@ -542,33 +1588,16 @@ class Database:
         """
         Получение количества использованных консультаций из подписки
         
+        Из подписки списываются консультации сверх FREE_AI_CONSULTATIONS бесплатных.
+        
         Args:
             user_id: ID пользователя
             
         Returns:
             int: Количество использованных консультаций из подписки
         """
-        def _get_used_operation():
-            cursor = self.connection.cursor()
-            cursor.execute("""
-                SELECT COUNT(*) FROM ai_consultations 
-                WHERE user_id = %s AND id > (
-                    SELECT COALESCE(MAX(id), 0) FROM ai_consultations 
-                    WHERE user_id = %s AND id <= (
-                        SELECT COALESCE(MAX(id), 0) FROM ai_consultations 
-                        WHERE user_id = %s 
-                        ORDER BY created_at 
-                        LIMIT 5
-                    )
-                )
-            """, (user_id, user_id, user_id))
-            
-            result = cursor.fetchone()[0]
-            cursor.close()
-            return int(result) if result else 0
-        
         try:
-            return self.execute_with_retry(_get_used_operation)
+            return max(self._get_ai_usage(user_id)['consultations_used'] - FREE_AI_CONSULTATIONS, 0)
         except Exception as e:
             logger.error(f"❌ Ошибка получения использованных подписочных консультаций для {user_id}: {e}")
             return 0
@@ -589,14 +1618,24 @@ class Database:
         Returns:
             bool: True если успешно
         """
-        def _add_subscription_operation():
-            cursor = self.connection.cursor()
+        def _add_subscription_operation(connection):
+            cursor = connection.cursor()
             cursor.execute("""
                 INSERT INTO ai_subscriptions (user_id, subscription_type, consultations_count, amount, payment_id, payment_status)
                 VALUES (%s, %s, %s, %s, %s, 'completed')
             """, (user_id, subscription_type, consultations_count, amount, payment_id))
             
-            self.connection.commit()
+            # Счетчик доступных консультаций обновляется в той же транзакции
+            cursor.execute("""
+                INSERT INTO ai_usage (user_id, subscription_consultations)
+                VALUES (%s, %s)
+                ON CONFLICT (user_id)
+                DO UPDATE SET
+                    subscription_consultations = ai_usage.subscription_consultations + EXCLUDED.subscription_consultations,
+                    updated_at = CURRENT_TIMESTAMP
+            """, (user_id, consultations_count))
+            
+            connection.commit()
             cursor.close()
             return True
         
@@ -606,6 +1645,56 @@ class Database:
             logger.error(f"❌ Ошибка добавления подписки ИИ для {user_id}: {e}")
             return False
     
+    def backfill_ai_usage(self) -> int:
+        """
+        Пересчет таблицы учета ai_usage по существующим ИИ консультациям и подпискам
+        
+        На время пересчета таблицы-источники блокируются от записи,
+        чтобы счетчики не разошлись с параллельно добавляемыми строками.
+        
+        Returns:
+            int: Количество пересчитанных пользователей (-1 при ошибке)
+        """
+        def _backfill_operation(connection):
+            cursor = connection.cursor()
+            cursor.execute("LOCK TABLE ai_consultations, ai_subscriptions IN SHARE MODE")
+            cursor.execute("""
+                INSERT INTO ai_usage (user_id, consultations_used, subscription_consultations, updated_at)
+                SELECT ids.user_id,
+                       COALESCE(used.total, 0),
+                       COALESCE(purchased.total, 0),
+                       CURRENT_TIMESTAMP
+                FROM (
+                    SELECT user_id FROM ai_consultations
+                    UNION
+                    SELECT user_id FROM ai_subscriptions WHERE payment_status = 'completed'
+                ) ids
+                LEFT JOIN (
+                    SELECT user_id, COUNT(*) AS total FROM ai_consultations GROUP BY user_id
+                ) used ON used.user_id = ids.user_id
+                LEFT JOIN (
+                    SELECT user_id, SUM(consultations_count) AS total FROM ai_subscriptions
+                    WHERE payment_status = 'completed' GROUP BY user_id
+                ) purchased ON purchased.user_id = ids.user_id
+                ON CONFLICT (user_id)
+                DO UPDATE SET
+                    consultations_used = EXCLUDED.consultations_used,
+                    subscription_consultations = EXCLUDED.subscription_consultations,
+                    updated_at = CURRENT_TIMESTAMP
+            """)
+            
+            rows = cursor.rowcount
+            connection.commit()
+            cursor.close()
+            logger.info(f"✅ Учет ИИ консультаций пересчитан для {rows} пользователей")
+            return rows
+        
+        try:
+            return self.execute_with_retry(_backfill_operation)
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересчета учета ИИ консультаций: {e}")
+            return -1
+    
     def can_user_use_ai(self, user_id: int) -> bool:
         """
         Проверка, может ли пользователь использовать ИИ консультации
@@ -628,4 +1717,87 @@ class Database:
         Returns:
             int: Количество оставшихся консультаций (безлимит = -1)
         """
-        return -1  # -1 означает безлимит 
\ No newline at end of file
+        return -1  # -1 означает безлимит 
+
+
+class AsyncDatabase:
+    """
+    Асинхронный интерфейс к Database с тем же набором методов
+    
+    Синхронные операции psycopg2 выполняются в выделенном пуле потоков
+    размером с пул соединений, поэтому обработчики не блокируют event loop.
+    Повтор при сетевых ошибках выполняется с неблокирующей экспоненциальной паузой.
+    
+    Пример:
+        database = AsyncDatabase()
+        await database.add_user(telegram_id=123)
+    """
+    
+    def __init__(self, database: Optional[Database] = None):
+        self.database = database or Database()
+        self.max_retries = self.database.max_retries
+        self.retry_delay = self.database.retry_delay
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.database.pool_max_size,
+            thread_name_prefix="database"
+        )
+    
+    def _run_once(self, method, args, kwargs):
+        """Выполнение метода Database в одну попытку (в потоке пула)"""
+        local = self.database._local
+        local.single_attempt = True
+        local.retryable_error = None
+        try:
+            try:
+                result = method(*args, **kwargs)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # Метод не перехватил сетевую ошибку сам - повторяем его целиком
+                return None, e
+            return result, local.retryable_error
+        finally:
+            local.single_attempt = False
+            local.retryable_error = None
+    
+    async def run(self, method_name: str, *args, **kwargs):
+        """
+        Выполнение метода Database вне event loop
+        
+        Args:
+            method_name: Имя метода Database
+            
+        Returns:
+            Результат метода Database
+        """
+        method = getattr(self.database, method_name)
+        loop = asyncio.get_running_loop()
+        
+        for attempt in range(self.max_retries):
+            result, error = await loop.run_in_executor(self._executor, self._run_once, method, args, kwargs)
+            if error is None:
+                return result
+            
+            if attempt < self.max_retries - 1:
+                delay = self.retry_delay * (2 ** attempt)
+                logger.warning(f"⚠️ {method_name}: повтор через {delay}с (попытка {attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+        
+        logger.error(f"❌ {method_name}: операция не удалась после {self.max_retries} попыток")
+        return result
+    
+    def __getattr__(self, name):
+        attribute = getattr(self.database, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+        
+        async def method(*args, **kwargs):
+            return await self.run(name, *args, **kwargs)
+        
+        method.__name__ = name
+        method.__doc__ = attribute.__doc__
+        return method
+    
+    async def close(self):
+        """Закрытие соединений и пула потоков"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.database.close)
+        self._executor.shutdown(wait=False)
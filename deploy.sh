@@ -14,6 +14,8 @@ tar -czf legal_bot.tar.gz \
     --exclude='*.txt' \
     --exclude='veretenov_session.txt' \
     --exclude='lawyer_data.json' \
+    --exclude='lawyer_data.db*' \
+    --exclude='lawyer_session.db*' \
     --exclude='.git' \
     --exclude='.DS_Store' \
     .
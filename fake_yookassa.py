@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Локальный имитатор API ЮKassa для тестов и замеров задержки платежей
+
+Запуск сервера (бот подключается через YOOKASSA_API_URL=http://127.0.0.1:8090/v3):
+    python fake_yookassa.py --port 8090 --latency 150 --settle-after 5
+
+Замер AsyncPaymentHandler без реального сервиса:
+    python fake_yookassa.py --bench --requests 500 --concurrency 50 --latency 100
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+from aiohttp import web, ClientSession
+
+
+class FakeYooKassa:
+    """Имитация /v3/payments: создание, получение и подтверждение платежей"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 settle_after: float = 0.0, webhook_url: str = None):
+        """
+        Args:
+            latency: Задержка ответа в секундах
+            jitter: Случайная добавка к задержке в секундах
+            error_rate: Доля ответов с ошибкой 500
+            settle_after: Через сколько секунд платеж становится succeeded (0 - только вручную)
+            webhook_url: URL для отправки уведомлений payment.succeeded
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.settle_after = settle_after
+        self.webhook_url = webhook_url
+
+        self.payments = {}
+        self.idempotency_keys = {}
+        self.requests = 0
+
+        self.app = web.Application()
+        self.app.router.add_post("/v3/payments", self.create_payment)
+        self.app.router.add_get("/v3/payments/{payment_id}", self.get_payment)
+        # Служебные методы для тестов
+        self.app.router.add_post("/fake/payments/{payment_id}/{status}", self.set_status)
+
+    async def _simulate(self):
+        self.requests += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            raise web.HTTPInternalServerError(
+                text='{"type": "error", "code": "internal_server_error", "description": "fake error"}',
+                content_type="application/json"
+            )
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        await self._simulate()
+        body = await request.json()
+
+        # Повтор с тем же ключом идемпотентности возвращает тот же платеж
+        key = request.headers.get("Idempotence-Key")
+        if key and key in self.idempotency_keys:
+            return web.json_response(self.payments[self.idempotency_keys[key]])
+
+        payment_id = str(uuid.uuid4())
+        payment = {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": body["amount"],
+            "description": body.get("description", ""),
+            "metadata": body.get("metadata", {}),
+            "confirmation": {
+                "type": "redirect",
+                "confirmation_url": f"https://yoomoney.example/checkout/{payment_id}"
+            },
+            "created_at": self._now(),
+            "test": True,
+            "refundable": False
+        }
+        self.payments[payment_id] = payment
+        if key:
+            self.idempotency_keys[key] = payment_id
+
+        if self.settle_after:
+            asyncio.get_running_loop().call_later(
+                self.settle_after, lambda: asyncio.ensure_future(self._settle(payment_id, "succeeded"))
+            )
+        return web.json_response(payment)
+
+    async def get_payment(self, request: web.Request) -> web.Response:
+        await self._simulate()
+        payment = self.payments.get(request.match_info["payment_id"])
+        if payment is None:
+            return web.json_response(
+                {"type": "error", "code": "not_found", "description": "Payment not found"}, status=404
+            )
+        return web.json_response(payment)
+
+    async def set_status(self, request: web.Request) -> web.Response:
+        payment_id = request.match_info["payment_id"]
+        if payment_id not in self.payments:
+            return web.Response(status=404)
+        await self._settle(payment_id, request.match_info["status"])
+        return web.json_response(self.payments[payment_id])
+
+    async def _settle(self, payment_id: str, status: str):
+        payment = self.payments[payment_id]
+        if payment["status"] != "pending":
+            return
+        payment["status"] = status
+        payment["paid"] = status == "succeeded"
+
+        if self.webhook_url:
+            notification = {"type": "notification", "event": f"payment.{status}", "object": payment}
+            try:
+                async with ClientSession() as session:
+                    async with session.post(self.webhook_url, json=notification) as response:
+                        print(f"📨 Уведомление payment.{status} для {payment_id}: HTTP {response.status}")
+            except Exception as e:
+                print(f"❌ Ошибка отправки уведомления для {payment_id}: {e}")
+
+    async def start(self, host: str, port: int) -> web.AppRunner:
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def percentile(values, percent: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def bench(args):
+    """Замер создания и проверки платежей через AsyncPaymentHandler"""
+    fake = FakeYooKassa(latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate)
+    runner = await fake.start(args.host, args.port)
+
+    os.environ["YOOKASSA_API_URL"] = f"http://{args.host}:{args.port}/v3"
+    os.environ.setdefault("YOOKASSA_SHOP_ID", "fake_shop")
+    os.environ.setdefault("YOOKASSA_SECRET_KEY", "fake_secret")
+    os.environ.setdefault("YOOKASSA_MAX_CONCURRENCY", str(args.concurrency))
+
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    from payment_handler import AsyncPaymentHandler
+
+    payment_handler = AsyncPaymentHandler()
+    latencies = {"create_payment": [], "check_payment_status": []}
+    failures = 0
+    limiter = asyncio.Semaphore(args.concurrency)
+
+    async def one_payment(index: int):
+        nonlocal failures
+        async with limiter:
+            started = time.perf_counter()
+            payment_info = await payment_handler.create_payment("oral", 100000 + index, None)
+            latencies["create_payment"].append(time.perf_counter() - started)
+            if not payment_info["success"]:
+                failures += 1
+                return
+
+            started = time.perf_counter()
+            payment_status = await payment_handler.check_payment_status(payment_info["payment_id"])
+            latencies["check_payment_status"].append(time.perf_counter() - started)
+            if not payment_status["success"]:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_payment(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    await payment_handler.close()
+    await runner.cleanup()
+
+    print(f"📊 Платежей: {args.requests}, параллельно: {args.concurrency}, задержка API: {args.latency}мс")
+    print(f"⏱  Общее время: {elapsed:.2f}с ({args.requests / elapsed:.1f} платежей/с), запросов к API: {fake.requests}")
+    for name, values in latencies.items():
+        values_ms = [value * 1000 for value in values]
+        print(
+            f"   {name}: p50 {percentile(values_ms, 50):.1f}мс, p95 {percentile(values_ms, 95):.1f}мс, "
+            f"p99 {percentile(values_ms, 99):.1f}мс, max {max(values_ms, default=0):.1f}мс"
+        )
+    print(f"❌ Ошибок: {failures}")
+
+
+async def serve(args):
+    fake = FakeYooKassa(
+        latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+        settle_after=args.settle_after, webhook_url=args.webhook_url
+    )
+    runner = await fake.start(args.host, args.port)
+    print(f"🧪 Fake ЮKassa запущена: YOOKASSA_API_URL=http://{args.host}:{args.port}/v3")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный имитатор API ЮKassa")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="Задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500 (0..1)")
+    parser.add_argument("--settle-after", type=float, default=0.0, help="Через сколько секунд платеж оплачивается")
+    parser.add_argument("--webhook-url", help="URL бота для уведомлений, например http://127.0.0.1:8080/yookassa/webhook")
+    parser.add_argument("--bench", action="store_true", help="Замер AsyncPaymentHandler против имитатора")
+    parser.add_argument("--requests", type=int, default=200, help="Количество платежей в замере")
+    parser.add_argument("--concurrency", type=int, default=20, help="Параллельных платежей в замере")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(bench(args) if args.bench else serve(args))
+    except KeyboardInterrupt:
+        print("\n🛑 Остановлено")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,15 @@
 
 import os
 import asyncio
-import json
-from datetime import datetime
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from loguru import logger
+from database import AsyncDatabase
+from lawyer_clients import resolve_client, LawyerStats
+from lawyer_store import migrate_to_database
+from message_parser import parse_message
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -21,75 +22,20 @@ load_dotenv()
 class LawyerClient:
     def __init__(self):
         self.bot_token = os.getenv("LAWYER_BOT_TOKEN")  # Токен для аккаунта @narhipovd
-        self.database_url = os.getenv("DATABASE_URL")
+        # Локальные файлы сессии переносятся в базу при первом запуске
         self.session_file = "lawyer_session.json"
-        self.connection = None
-        self.connect_database()
-        
-        # Загружаем сохраненную сессию
-        self.session_data = self.load_session()
-        
-    def connect_database(self):
-        """Подключение к базе данных"""
-        try:
-            self.connection = psycopg2.connect(self.database_url)
-            logger.info("✅ Подключение к базе данных установлено")
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения к базе данных: {e}")
-            self.connection = None
-    
-    def load_session(self):
-        """Загрузка сохраненной сессии"""
-        try:
-            if os.path.exists(self.session_file):
-                with open(self.session_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except Exception as e:
-            logger.error(f"Ошибка загрузки сессии: {e}")
-        return {}
-    
-    def save_session(self):
-        """Сохранение сессии"""
-        try:
-            with open(self.session_file, 'w', encoding='utf-8') as f:
-                json.dump(self.session_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Ошибка сохранения сессии: {e}")
-    
-    def check_payment(self, user_id: int) -> dict:
-        """
-        Проверка оплаты консультации пользователем
-        
-        Args:
-            user_id: Telegram ID пользователя
-            
-        Returns:
-            dict: Информация о платеже или None
-        """
-        if not self.connection:
-            return None
+        self.session_store_file = os.getenv("LAWYER_SESSION_STORE_PATH", "lawyer_session.db")
+        lawyer_id = os.getenv("LAWYER_TELEGRAM_ID", "")
+        self.lawyer_id = int(lawyer_id) if lawyer_id.isdigit() else 0
+        # Общий пул соединений вместо отдельного подключения
+        self.database = AsyncDatabase()
+        self.stats = LawyerStats(
+            self.database,
+            page_size=int(os.getenv("LAWYER_STATS_PAGE_SIZE", "10")),
+            ttl=float(os.getenv("LAWYER_STATS_CACHE_TTL", "60"))
+        )
         
-        try:
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT * FROM consultations 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC 
-                LIMIT 1
-            """, (user_id,))
-            
-            result = cursor.fetchone()
-            cursor.close()
-            
-            if result:
-                return dict(result)
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка проверки платежа для {user_id}: {e}")
-            return None
-    
-    def get_user_info(self, user_id: int) -> dict:
+    async def get_user_info(self, user_id: int) -> dict:
         """
         Получение информации о пользователе
         
@@ -99,26 +45,7 @@ class LawyerClient:
         Returns:
             dict: Информация о пользователе
         """
-        if not self.connection:
-            return None
-        
-        try:
-            cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("""
-                SELECT * FROM users 
-                WHERE telegram_id = %s
-            """, (user_id,))
-            
-            result = cursor.fetchone()
-            cursor.close()
-            
-            if result:
-                return dict(result)
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения информации о пользователе {user_id}: {e}")
-            return None
+        return await self.database.get_user_info(user_id)
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -127,8 +54,8 @@ class LawyerClient:
         
         await update.message.reply_text(
             "👨‍💼 Добро пожаловать!\n\n"
-            "Напишите ваш ID и кодовое слово ЮРИСТ2024.\n"
-            "Пример: 123456789 ЮРИСТ2024"
+            "Напишите кодовое слово, полученное после оплаты.\n"
+            "Пример: ЮР-7KQ4MZ"
         )
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -138,40 +65,24 @@ class LawyerClient:
         
         logger.info(f"Сообщение от {user.id} (@{user.username}): {message_text[:100]}...")
         
-        # Ищем Telegram ID в сообщении (в любом месте)
-        import re
-        id_match = re.search(r'(\d{8,})', message_text)
-        code_match = re.search(r'ЮРИСТ2024', message_text, re.IGNORECASE)
-        
-        if not id_match:
-            await update.message.reply_text(
-                "❌ Не найден Telegram ID в сообщении.\n\n"
-                "Пожалуйста, укажите ваш ID в любом месте сообщения."
-            )
-            return
-        
-        client_id = int(id_match.group(1))
+        # Кодовое слово и Telegram ID (в любом месте сообщения) - одним проходом
+        parsed = parse_message(message_text)
         
-        if not code_match:
+        if not parsed.has_code_word:
             await update.message.reply_text(
-                "❌ Не найдено кодовое слово ЮРИСТ2024.\n\n"
-                "Пожалуйста, укажите кодовое слово в любом месте сообщения.\n"
-                "Пример: Мой ID 123456789, код ЮРИСТ2024, вопрос: как расторгнуть договор?"
+                "❌ Не найдено кодовое слово.\n\n"
+                "Пожалуйста, укажите кодовое слово из сообщения об оплате.\n"
+                "Пример: Код ЮР-7KQ4MZ, вопрос: как расторгнуть договор?"
             )
             return
         
-        # Проверяем оплату
-        payment_info = self.check_payment(client_id)
-        
-        if not payment_info:
-            await update.message.reply_text(
-                "❌ Вы не оплатили консультацию.\n\n"
-                "Оплатите консультацию через бота и попробуйте снова."
-            )
+        client_id, payment_info, error_text = await resolve_client(self.database, parsed, user.id, self.lawyer_id)
+        if error_text:
+            await update.message.reply_text(error_text)
             return
         
         # Получаем информацию о пользователе
-        user_info = self.get_user_info(client_id)
+        user_info = await self.get_user_info(client_id)
         
         # Формируем простой ответ
         response = f"Здравствуйте!\n\n"
@@ -182,43 +93,59 @@ class LawyerClient:
         
         await update.message.reply_text(response)
         
-        # Сохраняем информацию о клиенте в сессии
-        self.session_data[str(client_id)] = {
-            "user_info": user_info,
-            "payment_info": payment_info,
-            "last_contact": datetime.now().isoformat()
-        }
-        self.save_session()
+        # Сохраняем обращение клиента (та же таблица, что и у основного бота)
+        await self.database.upsert_lawyer_contact(client_id, user_info, payment_info)
+        self.stats.invalidate()
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
         await update.message.reply_text(
             "📋 Инструкция:\n\n"
-            "Клиент пишет: ID + ЮРИСТ2024\n"
-            "Система проверяет оплату\n"
+            "Клиент пишет кодовое слово из сообщения об оплате\n"
+            "Система проверяет оплату и погашает код\n"
             "Если оплачено - можете консультировать\n\n"
-            "Пример: 123456789 ЮРИСТ2024"
+            "Пример: ЮР-7KQ4MZ\n"
+            "Для старых оплат: 123456789 ЮРИСТ2024"
         )
     
+    def _stats_keyboard(self, page: int, pages: int) -> InlineKeyboardMarkup:
+        """Кнопки перехода между страницами /stats"""
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton(label, callback_data=data) for label, data in self.stats.navigation(page, pages)
+        ]])
+    
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик команды /stats - показывает статистику сессии"""
-        if not self.session_data:
-            await update.message.reply_text("📊 Статистика пуста - нет активных клиентов")
+        """Обработчик команды /stats [страница] - сводка и клиенты юриста постранично"""
+        if update.effective_user.id != self.lawyer_id:
+            await update.message.reply_text("❌ У вас нет доступа к этой команде.")
             return
         
-        stats_text = "📊 Статистика активных клиентов:\n\n"
-        
-        for client_id, data in self.session_data.items():
-            user_info = data.get("user_info", {})
-            payment_info = data.get("payment_info", {})
-            last_contact = data.get("last_contact", "")
-            
-            stats_text += f"👤 {user_info.get('first_name', '')} {user_info.get('last_name', '')}\n"
-            stats_text += f"🆔 ID: {client_id}\n"
-            stats_text += f"💰 Оплата: {payment_info.get('amount', 0)}₽\n"
-            stats_text += f"📅 Последний контакт: {last_contact[:10]}\n\n"
+        page = int(context.args[0]) if context.args and context.args[0].isdigit() else 1
+        text, page, pages = await self.stats.get_page(page)
+        await update.message.reply_text(text, reply_markup=self._stats_keyboard(page, pages))
+    
+    async def stats_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Переход между страницами /stats по inline кнопкам"""
+        query = update.callback_query
+        if query.from_user.id != self.lawyer_id:
+            await query.answer("❌ Нет доступа")
+            return
         
-        await update.message.reply_text(stats_text)
+        page, refresh = self.stats.parse_callback(query.data)
+        if refresh:
+            self.stats.invalidate()
+        text, page, pages = await self.stats.get_page(page)
+        await query.answer()
+        try:
+            await query.edit_message_text(text, reply_markup=self._stats_keyboard(page, pages))
+        except BadRequest as e:
+            # Повторное нажатие без изменений в статистике
+            if "not modified" not in str(e).lower():
+                raise
+    
+    async def post_init(self, application: Application):
+        """Однократный перенос клиентов из локальных файлов в базу"""
+        await migrate_to_database(self.database, self.session_store_file, self.session_file)
     
     def run(self):
         """Запуск бота"""
@@ -227,12 +154,13 @@ class LawyerClient:
             return
         
         # Создаем приложение
-        application = Application.builder().token(self.bot_token).build()
+        application = Application.builder().token(self.bot_token).post_init(self.post_init).build()
         
         # Добавляем обработчики
         application.add_handler(CommandHandler("start", self.start_command))
         application.add_handler(CommandHandler("help", self.help_command))
         application.add_handler(CommandHandler("stats", self.stats_command))
+        application.add_handler(CallbackQueryHandler(self.stats_callback, pattern=f"^{LawyerStats.CALLBACK_PREFIX}"))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         
         logger.info("🤖 Бот юриста запущен")
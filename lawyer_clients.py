@@ -0,0 +1,163 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+from cache_utils import TTLCache
+from message_parser import LEGACY_CODE_WORD, ParsedMessage
+
+
+UNPAID_MESSAGE = "❌ Вы не оплатили консультацию.\n\nОплатите консультацию через бота и попробуйте снова."
+
+
+async def resolve_client(database, parsed: ParsedMessage, sender_id: int,
+                         lawyer_id: int) -> Tuple[Optional[int], Optional[Dict], Optional[str]]:
+    """
+    Клиент и оплаченная консультация по кодовому слову из сообщения юристу
+
+    Уникальный код погашается при первом обращении; повторные сообщения
+    того же клиента с погашенным кодом принимаются. Общий ЮРИСТ2024
+    подтверждает только консультации, оплаченные с этим кодовым словом.
+
+    Args:
+        database: AsyncDatabase
+        parsed: Разобранное сообщение с кодовым словом
+        sender_id: Telegram ID отправителя
+        lawyer_id: Telegram ID юриста, погашающего код
+
+    Returns:
+        Tuple: (client_id, консультация, текст ошибки или None)
+    """
+    if parsed.is_legacy_code_word:
+        if parsed.telegram_id is None:
+            return None, None, (
+                "❌ Не найден Telegram ID в сообщении.\n\n"
+                "Пожалуйста, укажите ваш ID в любом месте сообщения."
+            )
+        if not await database.verify_code_word(parsed.telegram_id, LEGACY_CODE_WORD):
+            return None, None, UNPAID_MESSAGE
+        consultation = await database.get_consultation_by_code_word(parsed.telegram_id, LEGACY_CODE_WORD)
+        return parsed.telegram_id, consultation, None
+
+    result = await database.redeem_code_word(parsed.code_word, lawyer_id)
+    consultation = result["consultation"]
+
+    if result["status"] == "redeemed" or (
+        result["status"] == "already_redeemed" and consultation["user_id"] == sender_id
+    ):
+        return consultation["user_id"], consultation, None
+    if result["status"] == "already_redeemed":
+        return None, None, "❌ Это кодовое слово уже использовано."
+    if result["status"] == "unpaid":
+        return None, None, UNPAID_MESSAGE
+    if result["status"] == "not_found":
+        return None, None, "❌ Кодовое слово не найдено. Проверьте написание кода из сообщения бота."
+    return None, None, "❌ Не удалось проверить кодовое слово, попробуйте позже."
+
+
+class LawyerStats:
+    """
+    Статистика /stats для юриста с кэшем
+
+    Сводка и страницы клиентов считаются агрегатами в базе и кэшируются;
+    кэш сбрасывается при новой оплате или обращении клиента (invalidate),
+    а в других процессах устаревает через ttl секунд.
+    """
+
+    # Страница с 20 клиентами гарантированно меньше лимита Telegram (4096 символов)
+    MAX_PAGE_SIZE = 20
+    CALLBACK_PREFIX = "lawyer_stats:"
+
+    def __init__(self, database, page_size: int = 10, ttl: float = 60.0, max_pages: int = 50):
+        """
+        Args:
+            database: AsyncDatabase
+            page_size: Клиентов на странице
+            ttl: Время жизни кэша в секундах
+            max_pages: Сколько страниц хранить в кэше
+        """
+        self.database = database
+        self.page_size = max(1, min(page_size, self.MAX_PAGE_SIZE))
+        self._cache = TTLCache(max_size=max_pages + 1, ttl=ttl)
+
+    def invalidate(self):
+        """Сброс кэша (новая оплата или обращение клиента)"""
+        self._cache.clear()
+
+    async def _summary(self) -> Dict:
+        summary = self._cache.get("summary")
+        if summary is None:
+            summary = await self.database.get_lawyer_stats_summary()
+            if summary:
+                self._cache.set("summary", summary)
+        return summary
+
+    async def _page_rows(self, page: int) -> List[Dict]:
+        rows = self._cache.get(("page", page))
+        if rows is None:
+            rows = await self.database.get_lawyer_stats_page(
+                limit=self.page_size, offset=(page - 1) * self.page_size
+            )
+            self._cache.set(("page", page), rows)
+        return rows
+
+    async def get_page(self, page: int = 1) -> Tuple[str, int, int]:
+        """
+        Текст страницы статистики
+
+        Args:
+            page: Номер страницы (с 1, ограничивается количеством страниц)
+
+        Returns:
+            Tuple[str, int, int]: Текст, номер показанной страницы и количество страниц
+        """
+        summary = await self._summary()
+        if not summary:
+            return "❌ Статистика временно недоступна", 1, 1
+
+        pages = max(1, math.ceil(summary["clients"] / self.page_size))
+        page = max(1, min(page, pages))
+        rows = await self._page_rows(page) if summary["clients"] else []
+
+        text = "📊 Статистика юриста\n\n"
+        text += f"👥 Клиентов: {summary['clients']}\n"
+        text += f"✅ Оплаченных консультаций: {summary['paid_consultations']} от {summary['paying_users']} пользователей\n"
+        text += f"💰 Выручка: {summary['revenue']:.0f}₽\n"
+        if summary["last_contact"]:
+            text += f"📅 Последний контакт: {summary['last_contact'].strftime('%d.%m.%Y %H:%M')}\n"
+
+        if not rows:
+            return text + "\nНет активных клиентов", page, pages
+
+        text += f"\nКлиенты (страница {page}/{pages}):\n\n"
+        for row in rows:
+            name = " ".join(filter(None, (row["first_name"], row["last_name"]))) or "Без имени"
+            username = row["username"] or row["sender_username"]
+            text += f"👤 {name[:64]}" + (f" (@{username})" if username else "") + "\n"
+            text += f"🆔 ID: {row['client_id']}, обращений: {row['contacts_count']}\n"
+            text += f"💰 Оплачено: {row['paid_consultations']} на {row['paid_amount']:.0f}₽\n"
+            text += f"📅 Последний контакт: {row['last_contact'].strftime('%d.%m.%Y %H:%M')}\n\n"
+        return text, page, pages
+
+    def navigation(self, page: int, pages: int) -> List[Tuple[str, str]]:
+        """
+        Кнопки перехода между страницами
+
+        Returns:
+            List[Tuple[str, str]]: Пары (текст кнопки, callback data)
+        """
+        buttons = []
+        if page > 1:
+            buttons.append(("⬅️ Назад", f"{self.CALLBACK_PREFIX}{page - 1}"))
+        buttons.append(("🔄 Обновить", f"{self.CALLBACK_PREFIX}{page}:refresh"))
+        if page < pages:
+            buttons.append(("Вперед ➡️", f"{self.CALLBACK_PREFIX}{page + 1}"))
+        return buttons
+
+    def parse_callback(self, data: str) -> Tuple[int, bool]:
+        """
+        Номер страницы и признак обновления из callback data кнопки
+
+        Returns:
+            Tuple[int, bool]: Страница и True, если нужно сбросить кэш
+        """
+        page, _, action = data[len(self.CALLBACK_PREFIX):].partition(":")
+        return (int(page) if page.isdigit() else 1), action == "refresh"
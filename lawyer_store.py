@@ -0,0 +1,146 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+class LawyerStore:
+    """
+    Прежнее хранилище клиентов юриста в SQLite (режим WAL)
+
+    Используется только для переноса клиентов в базу данных
+    (migrate_to_database). При первом открытии импортируются данные из
+    старого JSON файла.
+    """
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None):
+        """
+        Args:
+            path: Путь к файлу базы SQLite
+            legacy_json_path: JSON файл прежнего формата для однократного импорта
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL не теряет целостность при сбое, fsync только при checkpoint
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS clients (
+                client_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                last_contact TEXT,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_clients_last_contact ON clients (last_contact DESC)"
+        )
+
+        if legacy_json_path and os.path.exists(legacy_json_path):
+            self.import_json(legacy_json_path)
+
+    @staticmethod
+    def _dumps(record: Dict) -> str:
+        # В данных из базы есть datetime и Decimal
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+    def get_clients(self, limit: Optional[int] = None, offset: int = 0) -> List[Tuple[str, Dict]]:
+        """
+        Клиенты по убыванию времени последнего контакта
+
+        Args:
+            limit: Максимальное количество клиентов (None - все)
+            offset: Смещение
+
+        Returns:
+            List[Tuple[str, Dict]]: Пары (client_id, данные клиента)
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT client_id, data FROM clients ORDER BY last_contact DESC LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [(row["client_id"], json.loads(row["data"])) for row in rows]
+
+    def import_json(self, json_path: str) -> int:
+        """
+        Импорт клиентов из JSON файла прежнего формата
+
+        Поддерживаются {"clients": {id: данные}} (lawyer_data.json) и {id: данные}
+        (lawyer_session.json). Уже сохраненные клиенты не перезаписываются.
+        После импорта файл переименовывается в *.imported.
+
+        Returns:
+            int: Количество импортированных клиентов
+        """
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения {json_path} для импорта: {e}")
+            return 0
+
+        clients = data.get("clients", {}) if isinstance(data.get("clients"), dict) else data
+        rows = [
+            (str(client_id), self._dumps(record), record.get("last_contact"))
+            for client_id, record in clients.items() if isinstance(record, dict)
+        ]
+
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                before = self._connection.total_changes
+                self._connection.executemany("""
+                    INSERT INTO clients (client_id, data, last_contact) VALUES (?, ?, ?)
+                    ON CONFLICT (client_id) DO NOTHING
+                """, rows)
+                imported = self._connection.total_changes - before
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+        os.replace(json_path, f"{json_path}.imported")
+        logger.info(f"Импортировано клиентов юриста из {json_path}: {imported}")
+        return imported
+
+    def close(self):
+        """Закрытие базы"""
+        with self._lock:
+            self._connection.close()
+
+
+async def migrate_to_database(database, store_path: str, legacy_json_path: Optional[str] = None) -> int:
+    """
+    Однократный перенос локальных данных юриста (SQLite или JSON) в таблицу lawyer_contacts
+
+    Args:
+        database: AsyncDatabase
+        store_path: Файл SQLite хранилища
+        legacy_json_path: JSON файл прежнего формата
+
+    Returns:
+        int: Количество перенесенных клиентов (-1 при ошибке, файлы остаются на месте)
+    """
+    if not os.path.exists(store_path) and not (legacy_json_path and os.path.exists(legacy_json_path)):
+        return 0
+
+    store = LawyerStore(store_path, legacy_json_path)
+    try:
+        contacts = [dict(record, client_id=client_id) for client_id, record in store.get_clients()]
+    finally:
+        store.close()
+
+    imported = await database.import_lawyer_contacts(contacts)
+    if imported < 0:
+        logger.error(f"❌ Перенос клиентов юриста из {store_path} не удался, повтор при следующем запуске")
+        return imported
+
+    os.replace(store_path, f"{store_path}.imported")
+    logger.info(f"Клиенты юриста перенесены из {store_path} в базу данных: {imported} из {len(contacts)}")
+    return imported
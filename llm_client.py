@@ -0,0 +1,223 @@
+import os
+import json
+import asyncio
+from typing import Optional, Dict, AsyncIterator
+
+import httpx
+from loguru import logger
+
+
+# Модели, которым OpenRouter передает явные точки кэширования промпта (cache_control).
+# OpenAI, DeepSeek и Gemini 2.5 кэшируют общий префикс автоматически
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini-2.5")
+
+
+def supports_prompt_cache_control(model: str) -> bool:
+    """Поддерживает ли модель явное кэширование префикса промпта"""
+    return model.startswith(CACHE_CONTROL_MODEL_PREFIXES)
+
+
+class LLMStreamError(Exception):
+    """Потоковый ответ не завершен: ошибка API, таймаут или обрыв соединения"""
+
+
+class LLMUsage:
+    """Учет токенов запросов к модели по полю usage ответа OpenRouter"""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def record(self, usage: Optional[Dict], model: Optional[str] = None):
+        """
+        Учет usage одного запроса
+
+        Args:
+            usage: Поле usage ответа (prompt_tokens, completion_tokens, prompt_tokens_details, cost)
+            model: Модель, ответившая на запрос (для лога)
+        """
+        if not usage:
+            return
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += usage.get("cost") or 0.0
+        logger.debug(
+            f"Токены запроса к {model or 'OpenRouter'}: промпт {prompt_tokens} "
+            f"(из кэша {cached_tokens}), ответ {completion_tokens}"
+        )
+
+    def get_metrics(self) -> Dict:
+        """Суммарные и средние токены запросов"""
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.requests, 1) if self.requests else 0.0,
+            "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            "cost": round(self.cost, 6)
+        }
+
+
+class OpenRouterClient:
+    """Асинхронный клиент OpenRouter с общим пулом keep-alive соединений"""
+
+    def __init__(self, api_key: str, url: str = "https://openrouter.ai/api/v1/chat/completions"):
+        self.api_key = api_key
+        self.url = url
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "HTTP-Referer": "https://github.com/your-repo/legal-bot",
+            "X-Title": "Legal AI Bot"
+        }
+
+        # Таймауты и лимиты настраиваются через переменные окружения
+        self.timeout = float(os.getenv("OPENROUTER_TIMEOUT", "30"))
+        self.connect_timeout = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "5"))
+        self.max_concurrency = int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "100"))
+        self.max_keepalive = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "20"))
+
+        # Ограничение количества одновременных запросов к API
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+        # Токены всех запросов, включая потоковые
+        self.usage = LLMUsage()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Возвращает общий HTTP клиент, создавая его при первом обращении"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=60
+                )
+            )
+            logger.info(
+                f"HTTP клиент OpenRouter создан (одновременных запросов: {self.max_concurrency}, "
+                f"keep-alive соединений: {self.max_keepalive})"
+            )
+        return self._client
+
+    async def chat_completion(self, payload: Dict, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        Отправка запроса chat/completions без блокировки event loop
+
+        Args:
+            payload: Тело запроса к OpenRouter
+            timeout: Таймаут запроса в секундах (по умолчанию OPENROUTER_TIMEOUT)
+
+        Returns:
+            Dict: Ответ API или None при ошибке
+        """
+        client = self._get_client()
+        request_timeout = httpx.Timeout(timeout or self.timeout, connect=self.connect_timeout)
+
+        try:
+            async with self._semaphore:
+                response = await client.post(self.url, json=payload, timeout=request_timeout)
+
+            if response.status_code == 200:
+                result = response.json()
+                self.usage.record(result.get("usage"), result.get("model"))
+                return result
+
+            logger.error(f"Ошибка OpenRouter API: {response.status_code} - {response.text}")
+            return None
+
+        except httpx.TimeoutException as e:
+            logger.error(f"Таймаут запроса к OpenRouter: {e!r}")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка запроса к OpenRouter: {e}")
+            return None
+
+    async def stream_chat_completion(self, payload: Dict, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Потоковый запрос chat/completions (SSE, stream: true)
+
+        Args:
+            payload: Тело запроса к OpenRouter
+            timeout: Таймаут ожидания очередного фрагмента в секундах
+
+        Yields:
+            str: Очередной фрагмент текста ответа
+
+        Raises:
+            LLMStreamError: Ответ не получен полностью (в том числе после части фрагментов)
+        """
+        client = self._get_client()
+        request_timeout = httpx.Timeout(timeout or self.timeout, connect=self.connect_timeout)
+        stream_payload = dict(payload, stream=True)
+
+        try:
+            async with self._semaphore:
+                async with client.stream("POST", self.url, json=stream_payload, timeout=request_timeout) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        logger.error(f"Ошибка OpenRouter API (stream): {response.status_code} - {body.decode(errors='replace')}")
+                        raise LLMStreamError(f"HTTP {response.status_code}")
+
+                    async for line in response.aiter_lines():
+                        # Пропускаем пустые строки и служебные комментарии SSE
+                        if not line or line.startswith(":"):
+                            continue
+                        if not line.startswith("data:"):
+                            continue
+
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            return
+
+                        try:
+                            event = json.loads(data)
+                        except json.JSONDecodeError:
+                            logger.warning(f"Некорректный фрагмент SSE от OpenRouter: {data[:100]}")
+                            continue
+
+                        if "error" in event:
+                            logger.error(f"Ошибка OpenRouter в потоке: {event['error']}")
+                            raise LLMStreamError(str(event["error"]))
+
+                        # usage приходит в последнем фрагменте перед [DONE]
+                        if event.get("usage"):
+                            self.usage.record(event["usage"], event.get("model"))
+
+                        choices = event.get("choices") or []
+                        if not choices:
+                            continue
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            yield content
+
+            # Соединение закрыто без [DONE] - ответ оборван
+            logger.error("Поток OpenRouter оборвался до завершения ответа")
+            raise LLMStreamError("поток завершился без [DONE]")
+
+        except LLMStreamError:
+            raise
+        except httpx.TimeoutException as e:
+            logger.error(f"Таймаут потокового запроса к OpenRouter: {e!r}")
+            raise LLMStreamError("таймаут") from e
+        except Exception as e:
+            logger.error(f"Ошибка потокового запроса к OpenRouter: {e}")
+            raise LLMStreamError(str(e)) from e
+
+    async def close(self):
+        """Закрытие пула соединений"""
+        if self._client and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("🔌 HTTP клиент OpenRouter закрыт")
@@ -0,0 +1,391 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+from loguru import logger
+
+from llm_client import LLMStreamError
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для одной модели
+
+    После failure_threshold ошибок подряд модель исключается из запросов
+    на reset_timeout секунд, затем пропускается один пробный запрос:
+    успех возвращает модель в работу, ошибка снова ее выключает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Ошибок подряд до выключения
+            reset_timeout: Пауза до пробного запроса в секундах
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probe_in_flight = False
+
+    def is_available(self) -> bool:
+        """Можно ли будет отправить запрос (без учета пробного запроса)"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._probe_in_flight
+
+    def allow_request(self) -> bool:
+        """Разрешение на запрос; вызывается непосредственно перед отправкой"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self):
+        """Отмена запроса без результата (проигравший дублирующий запрос)"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ModelHealth:
+    """Состояние одной модели: доля успешных ответов, задержки и выключатель"""
+
+    def __init__(self, target: str, breaker: CircuitBreaker, latency_samples: int = 100):
+        """
+        Args:
+            target: Модель OpenRouter, при необходимости с провайдером (model@provider)
+            breaker: Выключатель модели
+            latency_samples: Сколько последних задержек учитывать в p95
+        """
+        self.target = target
+        self.model, _, self.provider = target.partition("@")
+        self.breaker = breaker
+        # Полные ответы (по ним считается задержка дублирования) и первые фрагменты потоков
+        self.latencies = deque(maxlen=latency_samples)
+        self.first_chunk_latencies = deque(maxlen=latency_samples)
+        # Экспоненциальное среднее доли успешных ответов
+        self.score = 1.0
+        self.requests = 0
+        self.failures = 0
+
+    def record(self, success: bool, latency: float, streaming: bool = False):
+        self.requests += 1
+        self.score = 0.8 * self.score + 0.2 * (1.0 if success else 0.0)
+        if success:
+            (self.first_chunk_latencies if streaming else self.latencies).append(latency)
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def latency_quantile(self, quantile: float, streaming: bool = False) -> Optional[float]:
+        """Квантиль задержки успешных ответов или первых фрагментов потока (None, пока замеров мало)"""
+        samples = self.first_chunk_latencies if streaming else self.latencies
+        if len(samples) < 10:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+    def get_metrics(self) -> Dict:
+        p50 = self.latency_quantile(0.5)
+        p95 = self.latency_quantile(0.95)
+        ttfb_p95 = self.latency_quantile(0.95, streaming=True)
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "score": round(self.score, 3),
+            "breaker": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "ttfb_p95_ms": round(ttfb_p95 * 1000, 1) if ttfb_p95 is not None else None
+        }
+
+
+class LLMRouter:
+    """
+    Запросы к нескольким моделям OpenRouter с переключением и дублированием
+
+    Модели перебираются в заданном порядке; модели с низкой долей успешных
+    ответов уходят в конец, выключенные (circuit breaker) пропускаются.
+    При ошибке запрос сразу повторяется на следующей модели. Если основная
+    модель не ответила за свою p95 задержку, параллельно отправляется
+    дублирующий запрос к следующей модели и берется первый успешный ответ.
+    """
+
+    # Модели с долей успешных ответов ниже порога пробуются последними
+    HEALTHY_SCORE = 0.5
+
+    def __init__(self, client, models: List[str], hedging: bool = True, hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 1.0, hedge_default_delay: float = 8.0,
+                 attempt_timeout: Optional[float] = None, failure_threshold: int = 3,
+                 reset_timeout: float = 30.0):
+        """
+        Args:
+            client: OpenRouterClient
+            models: Модели в порядке предпочтения (model или model@provider)
+            hedging: Отправлять дублирующий запрос, если основная модель медлит
+            hedge_quantile: Квантиль задержки основной модели, после которой запрос дублируется
+            hedge_min_delay: Минимальная задержка перед дублированием в секундах
+            hedge_default_delay: Задержка перед дублированием, пока замеров мало
+            attempt_timeout: Таймаут одной попытки (по умолчанию таймаут клиента)
+            failure_threshold: Ошибок подряд до выключения модели
+            reset_timeout: Пауза до пробного запроса к выключенной модели
+        """
+        if not models:
+            raise ValueError("Не задано ни одной модели")
+        self.client = client
+        self.hedging = hedging
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_default_delay = hedge_default_delay
+        self.attempt_timeout = attempt_timeout
+        self.models = [
+            ModelHealth(target, CircuitBreaker(failure_threshold, reset_timeout)) for target in models
+        ]
+
+        # Метрики
+        self.requests = 0
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.exhausted = 0
+
+    @property
+    def primary_model(self) -> str:
+        return self.models[0].model
+
+    def _candidates(self) -> List[ModelHealth]:
+        ordered = sorted(
+            enumerate(self.models),
+            key=lambda item: (item[1].score < self.HEALTHY_SCORE, item[0])
+        )
+        return [health for _, health in ordered if health.breaker.is_available()]
+
+    @staticmethod
+    def _attempt_payload(payload: Dict, health: ModelHealth) -> Dict:
+        attempt = dict(payload, model=health.model)
+        if health.provider:
+            attempt["provider"] = {"order": [health.provider], "allow_fallbacks": False}
+        return attempt
+
+    def _hedge_delay(self, health: ModelHealth) -> float:
+        delay = health.latency_quantile(self.hedge_quantile)
+        if delay is None:
+            delay = self.hedge_default_delay
+        return max(self.hedge_min_delay, delay)
+
+    async def _attempt(self, payload: Dict, health: ModelHealth) -> Optional[Dict]:
+        started = time.perf_counter()
+        result = None
+        try:
+            result = await self.client.chat_completion(self._attempt_payload(payload, health), timeout=self.attempt_timeout)
+        except asyncio.CancelledError:
+            # Проигравший дублирующий запрос - не ошибка модели
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка запроса к модели {health.target}: {e}")
+        success = bool(result and result.get("choices"))
+        health.record(success, time.perf_counter() - started)
+        if not success:
+            logger.warning(f"⚠️ Модель {health.target} не ответила, состояние: {health.breaker.state}")
+        return result if success else None
+
+    async def chat_completion(self, payload: Dict) -> Optional[Dict]:
+        """
+        Запрос chat/completions с переключением между моделями
+
+        Args:
+            payload: Тело запроса (поле model заменяется для каждой попытки)
+
+        Returns:
+            Dict: Первый успешный ответ или None, если не ответила ни одна модель
+        """
+        self.requests += 1
+        candidates = self._candidates()
+        if not candidates:
+            self.exhausted += 1
+            logger.error("❌ Все модели ИИ выключены после ошибок, запрос отклонен")
+            return None
+
+        pending: Dict[asyncio.Task, ModelHealth] = {}
+        # Попытки, занявшие пробный запрос восстанавливающейся модели
+        probes = set()
+        next_index = 0
+        primary = None
+
+        def launch() -> bool:
+            # Пробный запрос к восстанавливающейся модели занимается только при отправке
+            nonlocal next_index, primary
+            while next_index < len(candidates):
+                health = candidates[next_index]
+                next_index += 1
+                if health.breaker.allow_request():
+                    primary = primary or health
+                    task = asyncio.create_task(self._attempt(payload, health))
+                    pending[task] = health
+                    if health.breaker.state == CircuitBreaker.HALF_OPEN:
+                        probes.add(task)
+                    return True
+            return False
+
+        if not launch():
+            self.exhausted += 1
+            logger.error("❌ Все модели ИИ выключены после ошибок, запрос отклонен")
+            return None
+        try:
+            while pending:
+                # Дублируем только пока одна попытка в полете и есть запасная модель
+                can_hedge = self.hedging and len(pending) == 1 and next_index < len(candidates)
+                timeout = self._hedge_delay(next(iter(pending.values()))) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if launch():
+                        self.hedged += 1
+                        logger.info(f"Модель {primary.target} медлит, запрос продублирован на другую модель")
+                    continue
+
+                for task in done:
+                    health = pending.pop(task)
+                    result = task.result()
+                    if result:
+                        if health is not primary:
+                            # Основная модель еще в полете - выиграл дублирующий запрос
+                            if primary in pending.values():
+                                self.hedge_wins += 1
+                            else:
+                                self.failovers += 1
+                        return result
+
+                if not pending and next_index < len(candidates):
+                    launch()
+        finally:
+            for task, health in pending.items():
+                task.cancel()
+                # Отмененная проба не дала результата - следующий запрос снова может ее занять
+                if task in probes:
+                    health.breaker.release_probe()
+
+        self.exhausted += 1
+        logger.error("❌ Ни одна модель ИИ не ответила")
+        return None
+
+    async def stream_chat_completion(self, payload: Dict) -> AsyncIterator[str]:
+        """
+        Потоковый запрос с переключением между моделями до первого фрагмента
+
+        Пока модель не прислала ни одного фрагмента, при ошибке запрос
+        повторяется на следующей модели; начатый ответ не переключается.
+
+        Yields:
+            str: Очередной фрагмент текста ответа
+
+        Raises:
+            LLMStreamError: Начатый ответ оборвался
+        """
+        self.requests += 1
+        candidates = self._candidates()
+        if not candidates:
+            self.exhausted += 1
+            logger.error("❌ Все модели ИИ выключены после ошибок, запрос отклонен")
+            return
+
+        attempted = 0
+        for health in candidates:
+            if not health.breaker.allow_request():
+                continue
+            attempted += 1
+            probe = health.breaker.state == CircuitBreaker.HALF_OPEN
+            started = time.perf_counter()
+            first_chunk_latency = None
+            try:
+                async for chunk in self.client.stream_chat_completion(self._attempt_payload(payload, health), timeout=self.attempt_timeout):
+                    if first_chunk_latency is None:
+                        first_chunk_latency = time.perf_counter() - started
+                    yield chunk
+            except LLMStreamError:
+                health.record(False, time.perf_counter() - started)
+                logger.warning(f"⚠️ Модель {health.target} не ответила в потоке, состояние: {health.breaker.state}")
+                # Начатый ответ другой моделью не продолжить
+                if first_chunk_latency is not None:
+                    raise
+                continue
+            finally:
+                # Поток закрыт обработчиком до результата - проба освобождается
+                if probe:
+                    health.breaker.release_probe()
+
+            if first_chunk_latency is None:
+                health.record(False, time.perf_counter() - started)
+                logger.warning(f"⚠️ Модель {health.target} вернула пустой ответ, состояние: {health.breaker.state}")
+                continue
+            health.record(True, first_chunk_latency, streaming=True)
+            if attempted > 1:
+                self.failovers += 1
+            return
+
+        self.exhausted += 1
+        logger.error("❌ Ни одна модель ИИ не ответила")
+
+    def get_metrics(self) -> Dict:
+        """Счетчики переключений и состояние моделей"""
+        return {
+            "requests": self.requests,
+            "failovers": self.failovers,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "exhausted": self.exhausted,
+            "models": {health.target: health.get_metrics() for health in self.models}
+        }
+
+
+def create_llm_router(client, default_model: str) -> LLMRouter:
+    """
+    Маршрутизатор моделей по настройкам окружения
+
+    OPENROUTER_MODELS - модели через запятую в порядке предпочтения
+    (model или model@provider), по умолчанию одна default_model.
+    """
+    models = [model.strip() for model in os.getenv("OPENROUTER_MODELS", "").split(",") if model.strip()]
+    router = LLMRouter(
+        client,
+        models or [default_model],
+        hedging=os.getenv("LLM_HEDGING_ENABLED", "true").lower() == "true",
+        hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+        hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")),
+        hedge_default_delay=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8")),
+        attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT", "20")),
+        failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "3")),
+        reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30"))
+    )
+    logger.info(f"Модели ИИ: {', '.join(health.target for health in router.models)}")
+    return router
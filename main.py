@@ -1,17 +1,32 @@
 import os
 import asyncio
 import signal
-import json
-import requests
 import re
-from datetime import datetime
+import math
+import secrets
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram.error import BadRequest, RetryAfter
 from loguru import logger
-from payment_handler import PaymentHandler
-from database import Database
-import psycopg2.extras
+from payment_handler import AsyncPaymentHandler
+from database import AsyncDatabase
+from llm_client import OpenRouterClient, LLMStreamError, supports_prompt_cache_control
+from llm_router import create_llm_router
+from answer_cache import AnswerCache
+from cache_utils import TTLCache
+from lawyer_clients import resolve_client, LawyerStats
+from lawyer_store import migrate_to_database
+from message_parser import parse_message, LEGACY_CODE_WORD
+from state_store import create_state_store
+from rate_limiter import AdmissionController, create_rate_limiter
+from conversation_context import ConversationContext
+from write_behind import WriteBehindQueue
+from aiohttp import web
+from payment_status_cache import PaymentStatusCache
+from reconciliation import PaymentReconciler
+from webhook_server import WebhookServer, TelegramWebhookHandler, YooKassaWebhookHandler
+from update_processor import KeyedUpdateProcessor
 
 # Импорты для клиента юриста (опционально)
 try:
@@ -28,6 +43,12 @@ load_dotenv()
 # Настройка логирования
 logger.add("bot.log", rotation="1 day", retention="7 days")
 
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Добавляется к системному промпту юридической консультации
+LLM_FORMATTING_INSTRUCTION = "\n\nВАЖНО: Отвечай простым текстом без использования специальных символов разметки, эмодзи или форматирования."
+
 
 class TelegramSessionManager:
     """Менеджер для управления сессией Telegram аккаунта юриста"""
@@ -165,19 +186,35 @@ class LegalBot:
             raise ValueError("BOT_TOKEN не найден в .env файле")
         
         # Настройка OpenRouter для Gemini
+        self.llm_client = None
         if self.openrouter_api_key:
             logger.info("Настройка OpenRouter API для Gemini...")
-            self.openrouter_url = "https://openrouter.ai/api/v1/chat/completions"
-            self.openrouter_headers = {
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://github.com/your-repo/legal-bot",
-                "X-Title": "Legal AI Bot"
-            }
+            self.llm_client = OpenRouterClient(self.openrouter_api_key)
             logger.info("OpenRouter API настроен успешно")
         else:
             logger.warning("OPENROUTER_API_KEY не найден в переменных окружения")
         
+        # Модель и кэширование системного промпта у провайдера
+        self.llm_model = os.getenv("OPENROUTER_MODEL", "google/gemini-2.0-flash-lite-001")
+        self.llm_prompt_cache = os.getenv("OPENROUTER_PROMPT_CACHE", "true").lower() == "true"
+        
+        # Запасные модели: переключение при ошибках и дублирование медленных запросов
+        self.llm_router = create_llm_router(self.llm_client, self.llm_model) if self.llm_client else None
+        
+        # Потоковая выдача ответов ИИ с редактированием сообщения
+        self.llm_streaming_enabled = os.getenv("OPENROUTER_STREAMING", "true").lower() == "true"
+        self.stream_edit_interval = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+        self.stream_min_chars = int(os.getenv("STREAM_MIN_CHARS", "40"))
+        
+        # Кэш ответов ИИ: точные совпадения и похожие вопросы
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true":
+            self.answer_cache = AnswerCache(
+                max_size=int(os.getenv("ANSWER_CACHE_MAX_SIZE", "1000")),
+                ttl=float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600))),
+                similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.85"))
+            )
+        
         # Настройка доступа для юристов
         lawyer_id_str = os.getenv("LAWYER_TELEGRAM_ID", "0")
         try:
@@ -190,25 +227,111 @@ class LegalBot:
             89895202224  # Номер телефона юриста
         ]
         
-        self.application = Application.builder().token(self.bot_token).build()
-        self.payment_handler = PaymentHandler()
-        self.database = Database()
+        # Режим получения обновлений: polling (по умолчанию) или webhook
+        self.bot_mode = os.getenv("BOT_MODE", "polling").lower()
+        self.webhook_server = None
+        self.webhook_path = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+        self.webhook_secret = os.getenv("WEBHOOK_SECRET")
+        if self.bot_mode == "webhook" and not self.webhook_secret:
+            # При нескольких экземплярах бота секрет должен быть общим
+            self.webhook_secret = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET не задан, сгенерирован временный секрет (не подходит для нескольких экземпляров)")
+        
+        # Уведомления ЮKassa о платежах (работают и в режиме polling)
+        self.yookassa_webhook_enabled = os.getenv("YOOKASSA_WEBHOOK_ENABLED", "false").lower() == "true"
+        self.yookassa_webhook_path = os.getenv("YOOKASSA_WEBHOOK_PATH", "/yookassa/webhook")
+        
+        # Обновления разных пользователей обрабатываются параллельно, одного - по порядку
+        self.update_processor = KeyedUpdateProcessor(
+            max_workers=int(os.getenv("BOT_CONCURRENT_UPDATES", "32")),
+            max_pending=int(os.getenv("BOT_MAX_PENDING_UPDATES", "1024")),
+            hot_key_threshold=int(os.getenv("BOT_HOT_USER_THRESHOLD", "10"))
+        )
+        
+        self.application = (
+            Application.builder()
+            .token(self.bot_token)
+            .concurrent_updates(self.update_processor)
+            .build()
+        )
+        self.payment_handler = AsyncPaymentHandler()
+        # Кэш статусов платежей: повторные проверки не обращаются к ЮKassa
+        self.payment_status_cache = PaymentStatusCache(
+            loader=self.payment_handler.check_payment_status,
+            max_size=int(os.getenv("PAYMENT_STATUS_CACHE_SIZE", "10000")),
+            pending_ttl=float(os.getenv("PAYMENT_STATUS_PENDING_TTL", "5"))
+        )
+        self.database = AsyncDatabase()
+        # Отложенная пакетная запись пользователей и ИИ консультаций
+        self.write_queue = WriteBehindQueue(
+            self.database,
+            batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100")),
+            flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0")),
+            max_queue_size=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+        )
+        # Фоновая сверка неоплаченных консультаций с ЮKassa
+        self.reconciler = None
+        if os.getenv("RECONCILE_ENABLED", "true").lower() == "true" and self.payment_handler.shop_id:
+            self.reconciler = PaymentReconciler(
+                self.database,
+                fetch_status=lambda payment_id: self.payment_status_cache.get(payment_id, refresh=True),
+                on_transition=self.handle_reconciled_payment,
+                batch_size=int(os.getenv("RECONCILE_BATCH_SIZE", "100")),
+                interval=float(os.getenv("RECONCILE_INTERVAL", "60")),
+                concurrency=int(os.getenv("RECONCILE_CONCURRENCY", "5")),
+                min_age=float(os.getenv("RECONCILE_MIN_AGE", "30"))
+            )
         self._load_texts()
+        
+        # История диалога для уточняющих вопросов к ИИ в пределах бюджета токенов
+        self.conversation_context = None
+        if os.getenv("AI_CONTEXT_ENABLED", "true").lower() == "true":
+            self.conversation_context = ConversationContext(
+                self.database,
+                token_budget=int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "2000")),
+                max_turns=int(os.getenv("AI_CONTEXT_MAX_TURNS", "6")),
+                window=float(os.getenv("AI_CONTEXT_WINDOW", "3600")),
+                max_users=int(os.getenv("AI_CONTEXT_CACHE_SIZE", "10000")),
+                skip_answers=self.error_messages.values()
+            )
+        
         self._setup_handlers()
         
         # Инициализация клиента юриста
         self.lawyer_client_enabled = os.getenv("LAWYER_CLIENT_ENABLED", "false").lower() == "true"
         self.lawyer_client = None
+        # Аккаунт юриста (обновляется только при переподключении) и кэш отправителей
+        self.lawyer_me = None
+        self.lawyer_entity_cache = TTLCache(
+            max_size=int(os.getenv("LAWYER_ENTITY_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("LAWYER_ENTITY_CACHE_TTL", "3600"))
+        )
+        self._lawyer_watch_task = None
         self.lawyer_session_file = "veretenov_session.txt"
+        # Клиенты юриста хранятся в базе, локальные файлы переносятся при первом запуске
         self.lawyer_data_file = "lawyer_data.json"
+        self.lawyer_store_file = os.getenv("LAWYER_STORE_PATH", "lawyer_data.db")
+        self.lawyer_stats = LawyerStats(
+            self.database,
+            page_size=int(os.getenv("LAWYER_STATS_PAGE_SIZE", "10")),
+            ttl=float(os.getenv("LAWYER_STATS_CACHE_TTL", "60"))
+        )
         
         # Инициализация менеджера сессий
         self.session_manager = TelegramSessionManager()
         
-        # Словарь для хранения пользователей, ожидающих ввода email
-        self.email_waiting_users = {}
-        # Словарь для хранения email пользователей
-        self.user_emails = {}
+        # Состояние диалогов (ожидание ввода email) с ограниченным временем жизни;
+        # при STATE_STORE_BACKEND=postgres общее для всех экземпляров бота
+        self.state = create_state_store(self.database)
+        self.email_waiting_ttl = float(os.getenv("EMAIL_WAITING_TTL", "900"))
+        
+        # Лимит вопросов к ИИ на пользователя и общая очередь запросов к ИИ
+        self.rate_limiter = create_rate_limiter(self.state)
+        self.llm_admission = AdmissionController(
+            max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", "20")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "50")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+        )
         
         if self.lawyer_client_enabled:
             self._init_lawyer_client()
@@ -268,6 +391,44 @@ class LegalBot:
                 'general_error': "Извините, произошла ошибка, попробуйте еще раз"
             }
             logger.info("Fallback тексты установлены")
+        
+        self._build_llm_template()
+    
+    def _build_llm_template(self):
+        """
+        Неизменная часть запроса к OpenRouter: модель, параметры и системное сообщение
+        
+        Собирается один раз при загрузке текстов. Системное сообщение стоит первым
+        и не меняется между запросами, поэтому провайдер может переиспользовать
+        закэшированный префикс промпта.
+        """
+        system_prompt = f"{self.legal_ai_prompt}{LLM_FORMATTING_INSTRUCTION}"
+        models = [health.model for health in self.llm_router.models] if self.llm_router else [self.llm_model]
+        
+        # Остальные провайдеры пропускают точку кэширования
+        if self.llm_prompt_cache and any(supports_prompt_cache_control(model) for model in models):
+            content = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+            logger.info("Кэширование системного промпта включено")
+        else:
+            content = system_prompt
+        
+        self.llm_system_message = {"role": "system", "content": content}
+        self.llm_payload_template = {
+            "model": models[0],
+            "temperature": 0.3,
+            "max_tokens": 1500,
+            # Токены и стоимость запроса в ответе (в потоке - в последнем фрагменте)
+            "usage": {"include": True}
+        }
+    
+    async def _warm_answer_cache(self):
+        """Прогрев кэша ответов ИИ из истории консультаций"""
+        if not self.answer_cache:
+            return
+        
+        rows = await self.database.get_recent_ai_consultations(int(os.getenv("ANSWER_CACHE_WARM_LIMIT", "1000")))
+        loaded = self.answer_cache.warm(rows, skip_answers=self.error_messages.values())
+        logger.info(f"Кэш ответов ИИ прогрет: {loaded} записей")
     
     def _setup_handlers(self):
         """Настройка обработчиков команд"""
@@ -299,92 +460,23 @@ class LegalBot:
             
             self.lawyer_api_id = int(api_id)
             self.lawyer_api_hash = api_hash
-            self.lawyer_data = self._load_lawyer_data()
             
             logger.info("✅ Клиент юриста инициализирован")
             
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации клиента юриста: {e}")
     
-    def _load_lawyer_data(self):
-        """Загрузка данных клиента юриста"""
-        try:
-            if os.path.exists(self.lawyer_data_file):
-                with open(self.lawyer_data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка JSON в файле {self.lawyer_data_file}: {e}")
-            # Создаем резервную копию поврежденного файла
-            backup_file = f"{self.lawyer_data_file}.backup"
-            try:
-                import shutil
-                shutil.copy2(self.lawyer_data_file, backup_file)
-                logger.info(f"Создана резервная копия: {backup_file}")
-            except Exception as backup_error:
-                logger.error(f"Не удалось создать резервную копию: {backup_error}")
-        except Exception as e:
-            logger.error(f"Ошибка загрузки данных юриста: {e}")
-        return {"clients": {}, "settings": {}}
-    
-    def _save_lawyer_data(self):
-        """Сохранение данных клиента юриста"""
-        try:
-            with open(self.lawyer_data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.lawyer_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Ошибка сохранения данных юриста: {e}")
-    
     def _load_lawyer_session(self):
         """Загрузка сессии юриста"""
         return self.session_manager.load_session()
     
-    def _check_lawyer_payment(self, user_id: int) -> dict:
+    async def _check_lawyer_payment(self, user_id: int) -> dict:
         """Проверка оплаты консультации для юриста"""
-        if not self.database.connection:
-            return None
-        
-        try:
-            cursor = self.database.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("""
-                SELECT * FROM consultations 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC 
-                LIMIT 1
-            """, (user_id,))
-            
-            result = cursor.fetchone()
-            cursor.close()
-            
-            if result:
-                return dict(result)
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка проверки платежа для {user_id}: {e}")
-            return None
+        return await self.database.get_last_paid_consultation(user_id)
     
-    def _get_lawyer_user_info(self, user_id: int) -> dict:
+    async def _get_lawyer_user_info(self, user_id: int) -> dict:
         """Получение информации о пользователе для юриста"""
-        if not self.database.connection:
-            return None
-        
-        try:
-            cursor = self.database.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("""
-                SELECT * FROM users 
-                WHERE telegram_id = %s
-            """, (user_id,))
-            
-            result = cursor.fetchone()
-            cursor.close()
-            
-            if result:
-                return dict(result)
-            return None
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения информации о пользователе {user_id}: {e}")
-            return None
+        return await self.database.get_user_info(user_id)
     
     async def check_code_word_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда для проверки кодового слова юристом"""
@@ -395,26 +487,25 @@ class LegalBot:
             await update.message.reply_text("❌ У вас нет доступа к этой команде.")
             return
         
-        # Получаем аргументы команды
-        args = context.args
-        if len(args) < 2:
+        # /check ЮР-XXXXXX или, для прежних консультаций, /check <telegram_id> ЮРИСТ2024
+        parsed = parse_message(" ".join(context.args))
+        if not parsed.has_code_word or (parsed.is_legacy_code_word and parsed.telegram_id is None):
             await update.message.reply_text(
                 "💡 Как использовать команду проверки:\n\n"
-                "/check <telegram_id> <кодовое_слово>\n\n"
+                "/check <кодовое_слово>\n\n"
                 "Пример:\n"
+                "/check ЮР-7KQ4MZ\n\n"
+                "Для консультаций с кодовым словом ЮРИСТ2024 укажите Telegram ID клиента:\n"
                 "/check 123456789 ЮРИСТ2024\n\n"
                 "Или просто перешлите сообщение от клиента с кодовым словом."
             )
             return
         
         try:
-            client_telegram_id = int(args[0])
-            code_word = args[1]
-            
-            await self.verify_code_word_for_lawyer(update, client_telegram_id, code_word)
-            
-        except ValueError:
-            await update.message.reply_text("❌ Ошибка: Telegram ID должен быть числом.")
+            if parsed.is_legacy_code_word:
+                await self.verify_code_word_for_lawyer(update, parsed.telegram_id, parsed.code_word)
+            else:
+                await self.redeem_code_word_for_lawyer(update, parsed.code_word)
         except Exception as e:
             logger.error(f"Ошибка проверки кодового слова: {e}")
             await update.message.reply_text("❌ Произошла ошибка при проверке кодового слова.")
@@ -423,11 +514,11 @@ class LegalBot:
         """Проверка кодового слова для юриста"""
         try:
             # Проверяем кодовое слово в базе данных
-            is_valid = self.database.verify_code_word(client_telegram_id, code_word)
+            is_valid = await self.database.verify_code_word(client_telegram_id, code_word)
             
             if is_valid:
                 # Получаем информацию о консультации
-                consultation = self.database.get_consultation_by_code_word(client_telegram_id, code_word)
+                consultation = await self.database.get_consultation_by_code_word(client_telegram_id, code_word)
                 
                 if consultation:
                     # Формируем сообщение с информацией о клиенте
@@ -469,7 +560,59 @@ class LegalBot:
                 "Пожалуйста, попробуйте еще раз или обратитесь к администратору."
             )
     
-    async def notify_lawyer(self, user_id: int, amount: float, consultation_name: str, consultation_type: str):
+    async def redeem_code_word_for_lawyer(self, update: Update, code_word: str):
+        """Проверка и погашение уникального кодового слова юристом"""
+        lawyer_id = update.effective_user.id
+        result = await self.database.redeem_code_word(code_word, lawyer_id)
+        consultation = result["consultation"]
+        
+        if result["status"] == "redeemed":
+            message = f"✅ Кодовое слово {code_word} ВЕРНОЕ и погашено!\n\n"
+            message += f"📋 Информация о клиенте:\n"
+            message += f"👤 Имя: {consultation.get('first_name') or 'Не указано'} {consultation.get('last_name') or ''}\n"
+            message += f"📱 Username: @{consultation.get('username') or 'Не указан'}\n"
+            message += f"🆔 Telegram ID: {consultation['user_id']}\n"
+            message += f"💰 Сумма: {consultation['amount']}₽\n"
+            message += f"📋 Тип: {consultation['consultation_type']}\n"
+            message += f"📅 Дата оплаты: {(consultation['paid_at'] or consultation['created_at']).strftime('%d.%m.%Y %H:%M')}\n"
+            message += f"🆔 ID платежа: {consultation['payment_id']}\n\n"
+            message += f"✅ Можно оказывать консультацию"
+            logger.info(f"Кодовое слово {code_word} погашено юристом {lawyer_id} для клиента {consultation['user_id']}")
+        
+        elif result["status"] == "already_redeemed":
+            message = (
+                f"⚠️ Кодовое слово {code_word} уже использовано\n\n"
+                f"📅 Погашено: {consultation['code_word_redeemed_at'].strftime('%d.%m.%Y %H:%M')}\n"
+                f"👨‍💼 Юристом: {consultation['code_word_redeemed_by']}\n"
+                f"🆔 Telegram ID клиента: {consultation['user_id']}\n\n"
+                f"⚠️ Консультация по этому коду уже оказывается"
+            )
+            logger.warning(f"Повторная проверка погашенного кодового слова {code_word} юристом {lawyer_id}")
+        
+        elif result["status"] == "unpaid":
+            message = (
+                f"❌ Консультация с кодовым словом {code_word} не оплачена\n\n"
+                f"⚠️ Не оказывайте консультацию без подтверждения оплаты"
+            )
+        
+        elif result["status"] == "not_found":
+            message = (
+                f"❌ Кодовое слово {code_word} НЕВЕРНОЕ!\n\n"
+                f"Проверьте написание кода у клиента.\n\n"
+                f"⚠️ Не оказывайте консультацию без подтверждения оплаты"
+            )
+            logger.warning(f"Неизвестное кодовое слово {code_word} от юриста {lawyer_id}")
+        
+        else:
+            message = (
+                "❌ Ошибка при проверке кодового слова\n\n"
+                "Пожалуйста, попробуйте еще раз или обратитесь к администратору."
+            )
+        
+        await update.message.reply_text(message)
+    
+    async def notify_lawyer(self, user_id: int, amount: float, consultation_name: str, consultation_type: str,
+                            code_word: str = LEGACY_CODE_WORD):
         """
         Уведомляет юриста о новой оплаченной консультации
         """
@@ -481,7 +624,7 @@ class LegalBot:
                 return
             
             # Получаем информацию о пользователе
-            user_info = self.database.get_user_info(user_id)
+            user_info = await self.database.get_user_info(user_id)
             
             message = f"💰 НОВАЯ ОПЛАЧЕННАЯ КОНСУЛЬТАЦИЯ!\n\n"
             message += f"👤 Клиент: {user_info.get('first_name', '')} {user_info.get('last_name', '')}\n"
@@ -489,7 +632,7 @@ class LegalBot:
             message += f"🆔 Telegram ID: {user_id}\n"
             message += f"💰 Сумма: {amount}₽\n"
             message += f"📋 Тип: {consultation_name}\n"
-            message += f"🔐 Кодовое слово: ЮРИСТ2024\n\n"
+            message += f"🔐 Кодовое слово: {code_word}\n\n"
             message += f"📞 Контакты для связи:\n"
             message += f"👤 Telegram: @narhipovd\n\n"
             message += f"💡 Ожидайте обращения клиента с кодовым словом"
@@ -504,52 +647,141 @@ class LegalBot:
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления юристу: {e}")
     
-    def get_legal_advice_from_gemini(self, user_message):
+    def _build_llm_payload(self, user_message, history=None):
         """
-        Получает юридическую консультацию через OpenRouter API с Gemini 2.0 Flash Lite
+        Формирование тела запроса к OpenRouter для юридической консультации
+        
+        Args:
+            user_message: Текущий вопрос пользователя
+            history: Предыдущие сообщения диалога (user/assistant) от старых к новым
+        """
+        payload = dict(self.llm_payload_template)
+        payload["messages"] = [self.llm_system_message, *(history or ()), {"role": "user", "content": user_message}]
+        return payload
+    
+    async def _get_dialog_history(self, user_id, user_message):
+        """История диалога пользователя для запроса к ИИ (пустая без контекста)"""
+        if not self.conversation_context or user_id is None:
+            return []
+        return await self.conversation_context.get_history(user_id, user_message)
+    
+    def _remember_answer(self, user_id, user_message, answer, history, from_cache=False):
+        """Сохранение ответа в кэше ответов и в истории диалога"""
+        # Ответ на уточняющий вопрос зависит от истории, в общий кэш он не попадает
+        if self.answer_cache and not history and not from_cache:
+            self.answer_cache.put(user_message, answer)
+        if self.conversation_context and user_id is not None:
+            self.conversation_context.add_turn(user_id, user_message, answer)
+    
+    async def get_legal_advice_from_gemini(self, user_message, user_id=None):
+        """
+        Получает юридическую консультацию через OpenRouter API (модель OPENROUTER_MODEL)
+        
+        Args:
+            user_message: Вопрос пользователя
+            user_id: ID пользователя для учета истории диалога
         """
         if not self.openrouter_api_key:
             logger.warning("OPENROUTER_API_KEY не установлен, консультация пропущена")
             return None
         
+        history = await self._get_dialog_history(user_id, user_message)
+        
+        if self.answer_cache and not history:
+            cached_answer = self.answer_cache.get(user_message)
+            if cached_answer:
+                logger.info("Ответ ИИ найден в кэше")
+                self._remember_answer(user_id, user_message, cached_answer, history, from_cache=True)
+                return cached_answer
+        
         try:
-            # Формируем промпт для юридической консультации
-            system_prompt = self.legal_ai_prompt
-            
-            # Добавляем дополнительную инструкцию о форматировании
-            formatting_instruction = "\n\nВАЖНО: Отвечай простым текстом без использования специальных символов разметки, эмодзи или форматирования."
-            prompt = f"{system_prompt}{formatting_instruction}\n\nПользователь: {user_message}"
-            
-            data = {
-                "model": "google/gemini-2.0-flash-lite-001",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "temperature": 0.3,
-                "max_tokens": 1500
-            }
+            result = await self.llm_router.chat_completion(self._build_llm_payload(user_message, history))
             
-            response = requests.post(
-                self.openrouter_url, 
-                headers=self.openrouter_headers, 
-                json=data, 
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content'].strip()
-            else:
-                logger.error(f"Ошибка OpenRouter API: {response.status_code} - {response.text}")
-                return None
+            if result:
+                answer = result['choices'][0]['message']['content'].strip()
+                self._remember_answer(user_id, user_message, answer, history)
+                return answer
+            return None
                 
         except Exception as e:
             logger.error(f"Ошибка при получении консультации через OpenRouter: {e}")
             return None
     
+    async def stream_legal_advice_from_gemini(self, update: Update, user_message, reply_markup):
+        """
+        Потоковая консультация: сразу отправляет заглушку и редактирует ее по мере генерации ответа
+        
+        Returns:
+            str: Полный текст ответа или None, если ответ не получен
+        """
+        user_id = update.effective_user.id
+        history = await self._get_dialog_history(user_id, user_message)
+        
+        if self.answer_cache and not history:
+            cached_answer = self.answer_cache.get(user_message)
+            if cached_answer:
+                logger.info("Ответ ИИ найден в кэше")
+                self._remember_answer(user_id, user_message, cached_answer, history, from_cache=True)
+                await self._send_long_message(update, cached_answer, reply_markup)
+                return cached_answer
+        
+        placeholder = await update.message.reply_text("⏳ Готовлю ответ...")
+        
+        loop = asyncio.get_running_loop()
+        answer = ""
+        shown_length = 0
+        last_edit = loop.time()
+        
+        try:
+            async for chunk in self.llm_router.stream_chat_completion(self._build_llm_payload(user_message, history)):
+                answer += chunk
+                
+                # Ограничиваем частоту редактирования, чтобы не упереться в лимиты Telegram
+                now = loop.time()
+                if now - last_edit < self.stream_edit_interval or len(answer) - shown_length < self.stream_min_chars:
+                    continue
+                if shown_length >= TELEGRAM_MESSAGE_LIMIT:
+                    continue
+                
+                await self._edit_streamed_message(placeholder, answer[:TELEGRAM_MESSAGE_LIMIT])
+                shown_length = len(answer)
+                last_edit = loop.time()
+        except LLMStreamError:
+            # Оборванный ответ не показываем как окончательный и не сохраняем
+            logger.error(f"Потоковый ответ для пользователя {user_id} оборвался после {len(answer)} символов")
+            answer = ""
+        
+        answer = answer.strip()
+        if not answer:
+            await self._edit_streamed_message(placeholder, self.error_messages['processing_error'], reply_markup)
+            return None
+        
+        self._remember_answer(user_id, user_message, answer, history)
+        
+        # Финальное сообщение: длинный ответ разбиваем на части по лимиту Telegram
+        parts = [answer[i:i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(answer), TELEGRAM_MESSAGE_LIMIT)]
+        await self._edit_streamed_message(placeholder, parts[0], reply_markup if len(parts) == 1 else None)
+        for index, part in enumerate(parts[1:], start=2):
+            await update.message.reply_text(part, reply_markup=reply_markup if index == len(parts) else None)
+        
+        return answer
+    
+    async def _send_long_message(self, update: Update, text, reply_markup=None):
+        """Отправка текста частями по лимиту Telegram, клавиатура прикрепляется к последней части"""
+        parts = [text[i:i + TELEGRAM_MESSAGE_LIMIT] for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)]
+        for index, part in enumerate(parts, start=1):
+            await update.message.reply_text(part, reply_markup=reply_markup if index == len(parts) else None)
+    
+    async def _edit_streamed_message(self, message, text, reply_markup=None):
+        """Редактирование сообщения с потоковым ответом"""
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+        except RetryAfter as e:
+            logger.warning(f"Превышен лимит редактирования сообщений, пропускаем обновление ({e.retry_after}с)")
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                logger.error(f"Ошибка редактирования потокового сообщения: {e}")
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
@@ -557,13 +789,13 @@ class LegalBot:
         
         # Сохраняем информацию о пользователе в базу данных
         try:
-            self.database.add_user(
+            await self.write_queue.add_user(
                 telegram_id=user.id,
                 username=user.username,
                 first_name=user.first_name,
                 last_name=user.last_name
             )
-            logger.info(f"Пользователь {user.id} сохранен в базу данных")
+            logger.info(f"Пользователь {user.id} добавлен в очередь записи в базу данных")
         except Exception as e:
             logger.error(f"Ошибка сохранения пользователя {user.id} в базу данных: {e}")
         
@@ -752,7 +984,7 @@ class LegalBot:
         user_id = query.from_user.id
         
         # Сохраняем состояние ожидания email
-        self.email_waiting_users[user_id] = consultation_type
+        await self.state.set("email_waiting", user_id, consultation_type, ttl=self.email_waiting_ttl)
         
         message_text = (
             f"📧 Введите ваш email для отправки чека:\n\n"
@@ -780,16 +1012,15 @@ class LegalBot:
         user_id = query.from_user.id
         
         # Создаем платеж без чека
-        payment_info = self.payment_handler.create_payment(consultation_type, user_id, None)
+        payment_info = await self.payment_handler.create_payment(consultation_type, user_id, None)
         
         if payment_info["success"]:
             # Сохраняем консультацию в базу данных (без email)
-            self.database.add_consultation(
+            await self.database.add_consultation(
                 user_id=user_id,
                 consultation_type=consultation_type,
                 amount=payment_info["amount"],
                 payment_id=payment_info["payment_id"],
-                code_word="ЮРИСТ2024",
                 email=None
             )
             try:
@@ -908,89 +1139,19 @@ class LegalBot:
         
         logger.info(f"Пользователь {user_id} проверяет статус платежа {payment_id}")
         
-        payment_status = self.payment_handler.check_payment_status(payment_id)
+        # Если оплата уже подтверждена (например, уведомлением ЮKassa), запрос к API не нужен
+        consultation = await self.database.get_consultation_by_payment_id(payment_id)
+        if consultation and consultation["payment_status"] == "completed":
+            await self._send_payment_already_confirmed(query, payment_id, consultation["code_word"])
+            return
+        
+        payment_status = await self.payment_status_cache.get(payment_id)
         
         if payment_status["success"]:
             if payment_status["status"] == "succeeded":
-                # Платеж успешен
-                amount = payment_status["amount"]
-                consultation_type = payment_status["metadata"].get("consultation_type", "oral")
-                
-                # Получаем email из базы данных
-                user_email = self.database.get_consultation_email(payment_id)
-                
-                # Определяем название типа консультации
-                consultation_name = "Устная консультация" if consultation_type == "oral" else "Полная консультация с изучением документов"
-                
-                keyboard = [
-                    [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                # Отправляем сообщение об успешной оплате
-                await query.message.reply_text(
-                    f"✅ Платеж успешно оплачен!\n\n"
-                    f"💰 Сумма: {amount}₽\n"
-                    f"📋 Тип консультации: {consultation_name}\n"
-                    f"🆔 ID платежа: {payment_id}\n\n"
-                    f"Спасибо за оплату! Наш юрист свяжется с вами в ближайшее время.\n\n"
-                    f"📞 Контакты для связи:\n"
-                    f"👤 Telegram: @narhipovd",
-                    reply_markup=reply_markup
-                )
-                
-                # Создаем чек через ЮKassa
-                try:
-                    # Получаем email из базы данных
-                    user_email = self.database.get_consultation_email(payment_id)
-                    receipt_result = self.payment_handler.create_receipt(payment_id, user_email)
-                    if receipt_result["success"]:
-                        await query.message.reply_text(
-                            f"🧾 Чек отправлен!\n\n"
-                            f"✅ Официальный чек создан автоматически\n"
-                            f"📧 Чек отправлен на email\n"
-                            f"🆔 ID платежа: {payment_id}\n\n"
-                            f"💡 Если чек не пришел, проверьте папку 'Спам'"
-                        )
-                        logger.info(f"Чек ЮKassa подтвержден для пользователя {user_id}: {receipt_result.get('receipt_id')}")
-                    else:
-                        logger.error(f"Ошибка проверки чека ЮKassa для пользователя {user_id}: {receipt_result.get('error')}")
-                        # Отправляем уведомление об ошибке
-                        await query.message.reply_text(
-                            f"⚠️ Платеж успешен, но возникла проблема с чеком\n\n"
-                            f"📋 Услуга: {consultation_name}\n"
-                            f"💰 Сумма: {amount}₽\n"
-                            f"🆔 ID платежа: {payment_id}\n\n"
-                            f"📞 Обратитесь в поддержку: @narhipovd"
-                        )
-                except Exception as e:
-                    logger.error(f"Ошибка создания чека ЮKassa для пользователя {user_id}: {e}")
-                    # Отправляем уведомление об ошибке
-                    await query.message.reply_text(
-                        f"⚠️ Платеж успешен, но возникла проблема с чеком\n\n"
-                        f"📋 Услуга: {consultation_name}\n"
-                        f"💰 Сумма: {amount}₽\n"
-                        f"🆔 ID платежа: {payment_id}\n\n"
-                        f"📞 Обратитесь в поддержку: @narhipovd"
-                    )
-                
-                # Отправляем кодовое слово отдельным сообщением
-                await query.message.reply_text(
-                    f"🔐 КОДОВОЕ СЛОВО ДЛЯ ЮРИСТА\n\n"
-                    f"📝 ЮРИСТ2024\n\n"
-                    f"⚠️ ВАЖНО: При обращении к юристу обязательно назовите это кодовое слово для подтверждения оплаты.\n\n"
-                    f"💡 Как использовать:\n"
-                    f"1. Свяжитесь с юристом по указанным контактам\n"
-                    f"2. Назовите кодовое слово: ЮРИСТ2024\n"
-                    f"3. Укажите ваш Telegram ID: {user_id}\n"
-                    f"4. Опишите ваш вопрос\n\n"
-                    f"🔒 Кодовое слово действительно только для этой консультации."
-                )
-                
-                logger.info(f"Успешный платеж от пользователя {user_id}: {amount}₽ за {consultation_type} консультацию")
-                
-                # Уведомляем юриста о новой оплаченной консультации
-                await self.notify_lawyer(user_id, amount, consultation_name, consultation_type)
+                # Платеж успешен - подтверждаем его (сообщения отправит общий обработчик)
+                if not await self.confirm_successful_payment(payment_status):
+                    await self._send_payment_already_confirmed(query, payment_id)
                 
             elif payment_status["status"] == "pending":
                 # Платеж в обработке
@@ -1009,6 +1170,9 @@ class LegalBot:
                 
             else:
                 # Платеж не оплачен или отменен
+                if payment_status["status"] == "canceled":
+                    await self.database.update_payment_status(payment_id, "canceled")
+                
                 keyboard = [
                     [InlineKeyboardButton("🔄 Попробовать снова", callback_data="real_lawyer")],
                     [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
@@ -1036,6 +1200,204 @@ class LegalBot:
                 reply_markup=reply_markup
             )
     
+    async def _send_payment_already_confirmed(self, query, payment_id, code_word=None):
+        """Ответ на повторную проверку уже подтвержденного платежа"""
+        if code_word is None:
+            consultation = await self.database.get_consultation_by_payment_id(payment_id)
+            code_word = consultation and consultation["code_word"]
+        
+        keyboard = [
+            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await query.message.reply_text(
+            f"✅ Оплата уже подтверждена\n\n"
+            f"🆔 ID платежа: {payment_id}\n\n"
+            f"🔐 Кодовое слово для юриста: {code_word or LEGACY_CODE_WORD}\n"
+            f"👤 Telegram: @narhipovd",
+            reply_markup=reply_markup
+        )
+    
+    async def confirm_successful_payment(self, payment_status: dict) -> bool:
+        """
+        Подтверждение успешного платежа консультации
+        
+        Статус в базе меняется с pending на completed один раз, поэтому при
+        одновременном уведомлении ЮKassa и нажатии "Проверить оплату"
+        пользователь и юрист получают сообщения только один раз.
+        
+        Args:
+            payment_status: Результат PaymentHandler.check_payment_status со статусом succeeded
+            
+        Returns:
+            bool: True если платеж подтвержден этим вызовом
+        """
+        payment_id = payment_status["payment_id"]
+        
+        consultation = await self.database.update_payment_status(payment_id, "completed")
+        if not consultation:
+            current = await self.database.get_consultation_by_payment_id(payment_id)
+            if current and current["payment_status"] == "pending":
+                # Запись не обновилась из-за ошибки базы данных - уведомление нужно повторить
+                raise RuntimeError(f"Не удалось подтвердить платеж {payment_id}")
+            if not current:
+                logger.warning(f"Платеж {payment_id} не найден среди консультаций")
+            return False
+        
+        await self._notify_payment_confirmed(consultation, payment_status)
+        return True
+    
+    async def _notify_payment_confirmed(self, consultation: dict, payment_status: dict):
+        """Сообщения пользователю и юристу о подтвержденной оплате"""
+        # Новая оплата меняет выручку в /stats юриста
+        self.lawyer_stats.invalidate()
+        
+        payment_id = payment_status["payment_id"]
+        user_id = consultation["user_id"]
+        amount = payment_status["amount"]
+        consultation_type = (payment_status.get("metadata") or {}).get(
+            "consultation_type", consultation["consultation_type"]
+        )
+        consultation_name = "Устная консультация" if consultation_type == "oral" else "Полная консультация с изучением документов"
+        # Консультации, созданные до уникальных кодов, проверяются по общему слову и Telegram ID
+        code_word = consultation.get("code_word") or LEGACY_CODE_WORD
+        bot = self.application.bot
+        
+        keyboard = [
+            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        try:
+            # Отправляем сообщение об успешной оплате
+            await bot.send_message(
+                chat_id=user_id,
+                text=(
+                    f"✅ Платеж успешно оплачен!\n\n"
+                    f"💰 Сумма: {amount}₽\n"
+                    f"📋 Тип консультации: {consultation_name}\n"
+                    f"🆔 ID платежа: {payment_id}\n\n"
+                    f"Спасибо за оплату! Наш юрист свяжется с вами в ближайшее время.\n\n"
+                    f"📞 Контакты для связи:\n"
+                    f"👤 Telegram: @narhipovd"
+                ),
+                reply_markup=reply_markup
+            )
+            
+            # Проверяем чек ЮKassa (статус платежа уже известен, повторный запрос к API не нужен)
+            try:
+                receipt_result = await self.payment_handler.create_receipt(
+                    payment_id, consultation["email"], payment_status=payment_status["status"]
+                )
+                if receipt_result["success"]:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=(
+                            f"🧾 Чек отправлен!\n\n"
+                            f"✅ Официальный чек создан автоматически\n"
+                            f"📧 Чек отправлен на email\n"
+                            f"🆔 ID платежа: {payment_id}\n\n"
+                            f"💡 Если чек не пришел, проверьте папку 'Спам'"
+                        )
+                    )
+                    logger.info(f"Чек ЮKassa подтвержден для пользователя {user_id}: {receipt_result.get('receipt_id')}")
+                else:
+                    logger.error(f"Ошибка проверки чека ЮKassa для пользователя {user_id}: {receipt_result.get('error')}")
+                    await self._send_receipt_problem(user_id, consultation_name, amount, payment_id)
+            except Exception as e:
+                logger.error(f"Ошибка создания чека ЮKassa для пользователя {user_id}: {e}")
+                await self._send_receipt_problem(user_id, consultation_name, amount, payment_id)
+            
+            # Отправляем кодовое слово отдельным сообщением
+            await bot.send_message(
+                chat_id=user_id,
+                text=(
+                    f"🔐 КОДОВОЕ СЛОВО ДЛЯ ЮРИСТА\n\n"
+                    f"📝 {code_word}\n\n"
+                    f"⚠️ ВАЖНО: При обращении к юристу обязательно назовите это кодовое слово для подтверждения оплаты.\n\n"
+                    f"💡 Как использовать:\n"
+                    f"1. Свяжитесь с юристом по указанным контактам\n"
+                    f"2. Назовите кодовое слово: {code_word}\n"
+                    + (f"   и ваш Telegram ID: {user_id}\n" if code_word == LEGACY_CODE_WORD else "")
+                    + f"3. Опишите ваш вопрос\n\n"
+                    f"🔒 Кодовое слово действительно только для этой консультации и погашается при первой проверке юристом."
+                )
+            )
+        except Exception as e:
+            # Статус уже сохранен - пользователь увидит его по кнопке "Проверить оплату"
+            logger.error(f"Ошибка отправки подтверждения оплаты пользователю {user_id}: {e}")
+        
+        logger.info(f"Успешный платеж от пользователя {user_id}: {amount}₽ за {consultation_type} консультацию")
+        
+        # Уведомляем юриста о новой оплаченной консультации
+        await self.notify_lawyer(user_id, amount, consultation_name, consultation_type, code_word)
+    
+    async def _send_receipt_problem(self, user_id, consultation_name, amount, payment_id):
+        """Уведомление о проблеме с чеком при успешном платеже"""
+        await self.application.bot.send_message(
+            chat_id=user_id,
+            text=(
+                f"⚠️ Платеж успешен, но возникла проблема с чеком\n\n"
+                f"📋 Услуга: {consultation_name}\n"
+                f"💰 Сумма: {amount}₽\n"
+                f"🆔 ID платежа: {payment_id}\n\n"
+                f"📞 Обратитесь в поддержку: @narhipovd"
+            )
+        )
+    
+    async def handle_yookassa_payment(self, payment_status: dict):
+        """
+        Обработка проверенного уведомления ЮKassa о платеже
+        
+        Args:
+            payment_status: Актуальный статус платежа, полученный из API ЮKassa
+        """
+        payment_id = payment_status["payment_id"]
+        
+        if payment_status["status"] == "succeeded":
+            await self.confirm_successful_payment(payment_status)
+            
+        elif payment_status["status"] == "canceled":
+            consultation = await self.database.update_payment_status(payment_id, "canceled")
+            if consultation:
+                await self._notify_payment_canceled(consultation, payment_id)
+    
+    async def _notify_payment_canceled(self, consultation: dict, payment_id: str):
+        """Сообщение пользователю об отмененном платеже"""
+        keyboard = [
+            [InlineKeyboardButton("🔄 Попробовать снова", callback_data="real_lawyer")],
+            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        await self.application.bot.send_message(
+            chat_id=consultation["user_id"],
+            text=(
+                f"❌ Платеж отменен\n\n"
+                f"🆔 ID платежа: {payment_id}\n\n"
+                f"Попробуйте создать новый платеж."
+            ),
+            reply_markup=reply_markup
+        )
+        logger.info(f"Платеж {payment_id} пользователя {consultation['user_id']} отменен")
+    
+    async def handle_reconciled_payment(self, consultation: dict, payment_status: dict):
+        """
+        Сообщения по платежу, статус которого обновила фоновая сверка
+        
+        Args:
+            consultation: Консультация, переведенная из pending
+            payment_status: Статус платежа из ЮKassa
+        """
+        try:
+            if consultation["payment_status"] == "completed":
+                await self._notify_payment_confirmed(consultation, payment_status)
+            else:
+                await self._notify_payment_canceled(consultation, payment_status["payment_id"])
+        except Exception as e:
+            logger.error(f"Ошибка уведомления по платежу {payment_status['payment_id']}: {e}")
+    
     # Удалены старые обработчики Telegram Payments
     # async def pre_checkout_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
     # async def successful_payment_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1075,7 +1437,7 @@ class LegalBot:
         user = query.from_user
         
         # Сохраняем информацию о пользователе в базу данных
-        self.database.add_user(
+        await self.write_queue.add_user(
             telegram_id=user.id,
             username=user.username,
             first_name=user.first_name,
@@ -1115,9 +1477,10 @@ class LegalBot:
         
         logger.info(f"Пользователь {user_id} отправил сообщение: {user_message[:50]}...")
         
-        # Проверяем, ожидает ли пользователь ввода email
-        if user_id in self.email_waiting_users:
-            await self.handle_email_input(update, user_message)
+        # Проверяем, ожидает ли пользователь ввода email (состояние снимается сразу)
+        consultation_type = await self.state.pop("email_waiting", user_id)
+        if consultation_type is not None:
+            await self.handle_email_input(update, user_message, consultation_type)
             return
         
         # Проверяем, является ли пользователь юристом
@@ -1128,6 +1491,7 @@ class LegalBot:
         
 
         
+        admitted = False
         try:
             # Проверяем, есть ли токен OpenRouter
             if not self.openrouter_api_key:
@@ -1137,11 +1501,49 @@ class LegalBot:
                 )
                 return
             
+            # Лимит вопросов пользователя: лишние отклоняются сразу, без запроса к ИИ
+            if self.rate_limiter:
+                allowed, retry_after = await self.rate_limiter.check(user_id)
+                if not allowed:
+                    await update.message.reply_text(
+                        f"⏳ Слишком много вопросов подряд. Пожалуйста, подождите {math.ceil(retry_after)} с и задайте вопрос снова."
+                    )
+                    return
+            
+            admitted = await self.llm_admission.acquire(
+                on_queued=lambda: update.message.reply_text("⏳ Сейчас много обращений, ваш вопрос в очереди. Пожалуйста, подождите...")
+            )
+            if not admitted:
+                await update.message.reply_text(
+                    "⏳ ИИ консультант сейчас перегружен. Пожалуйста, подождите минуту и задайте вопрос снова."
+                )
+                return
+            
             logger.info(f"Отправляем запрос к Gemini через OpenRouter для пользователя {user_id}")
             
+            # Создаем кнопки для ответа ИИ
+            keyboard = [
+                [InlineKeyboardButton("🤖 ИИ консультация", callback_data="ai_consultation")],
+                [InlineKeyboardButton("👨‍💼 Связаться с юристом", callback_data="real_lawyer")],
+                [InlineKeyboardButton("ℹ️ О нас", callback_data="about")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            if self.llm_streaming_enabled:
+                # Ответ отправляется пользователю по мере генерации
+                ai_response = await self.stream_legal_advice_from_gemini(update, user_message, reply_markup)
+                if not ai_response:
+                    logger.error(f"Не удалось получить потоковый ответ от Gemini для пользователя {user_id}")
+                    ai_response = self.error_messages['processing_error']
+                
+                # Сохраняем ИИ консультацию в базу данных
+                await self.write_queue.add_ai_consultation(user_id, user_message, ai_response)
+                logger.info(f"Gemini через OpenRouter ответил пользователю {user_id} (stream)")
+                return
+            
             # Получаем консультацию через OpenRouter
             try:
-                ai_response = self.get_legal_advice_from_gemini(user_message)
+                ai_response = await self.get_legal_advice_from_gemini(user_message, user_id)
                 if ai_response:
                     logger.info(f"Получен ответ от Gemini для пользователя {user_id}: {ai_response[:100]}...")
                 else:
@@ -1152,16 +1554,8 @@ class LegalBot:
                 logger.error(f"Gemini через OpenRouter недоступен для пользователя {user_id}: {gemini_error}")
                 ai_response = self.error_messages['processing_error']
             
-            # Создаем кнопки для ответа ИИ
-            keyboard = [
-                [InlineKeyboardButton("🤖 ИИ консультация", callback_data="ai_consultation")],
-                [InlineKeyboardButton("👨‍💼 Связаться с юристом", callback_data="real_lawyer")],
-                [InlineKeyboardButton("ℹ️ О нас", callback_data="about")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
             # Сохраняем ИИ консультацию в базу данных
-            self.database.add_ai_consultation(user_id, user_message, ai_response)
+            await self.write_queue.add_ai_consultation(user_id, user_message, ai_response)
             
             # Отправляем ответ пользователю с кнопками
             # Отключаем Markdown для ответов от Gemini, так как они могут содержать сложную разметку
@@ -1180,17 +1574,15 @@ class LegalBot:
                 self.error_messages['processing_error'],
                 reply_markup=reply_markup
             )
+        finally:
+            if admitted:
+                self.llm_admission.release()
     
-    async def handle_email_input(self, update: Update, email: str):
+    async def handle_email_input(self, update: Update, email: str, consultation_type: str = "oral"):
         """Обработка ввода email для чека"""
         user_id = update.effective_user.id
-        consultation_type = self.email_waiting_users.get(user_id, "oral")
-        
-        # Удаляем пользователя из ожидающих
-        del self.email_waiting_users[user_id]
         
         # Проверяем корректность email
-        import re
         email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
         
         if not re.match(email_pattern, email):
@@ -1212,21 +1604,17 @@ class LegalBot:
             )
             return
         
-        # Сохраняем email пользователя
-        self.user_emails[user_id] = email
-        
         # Создаем платеж с email
-        payment_info = self.payment_handler.create_payment(consultation_type, user_id, email)
+        payment_info = await self.payment_handler.create_payment(consultation_type, user_id, email)
         
         if payment_info["success"]:
             try:
                 # Сохраняем email в базу данных сразу после создания платежа
-                self.database.add_consultation(
+                await self.database.add_consultation(
                     user_id=user_id,
                     consultation_type=consultation_type,
                     amount=payment_info["amount"],
                     payment_id=payment_info["payment_id"],
-                    code_word="ЮРИСТ2024",
                     email=email
                 )
                 
@@ -1266,17 +1654,23 @@ class LegalBot:
         
         logger.info(f"Получено сообщение от юриста {user_id}: {message_text[:50]}...")
         
-        # Ищем кодовое слово в сообщении
-        import re
-        code_word_match = re.search(r'ЮРИСТ2024', message_text, re.IGNORECASE)
+        # Кодовое слово, Telegram ID и ID платежа - одним проходом
+        parsed = parse_message(message_text)
+        
+        if parsed.has_code_word and not parsed.is_legacy_code_word:
+            # Уникальный код однозначно определяет консультацию, Telegram ID не нужен
+            await self.redeem_code_word_for_lawyer(update, parsed.code_word)
         
-        if code_word_match:
-            # Ищем Telegram ID в сообщении
-            telegram_id_match = re.search(r'(\d{8,})', message_text)
+        elif parsed.has_code_word:
+            client_telegram_id = parsed.telegram_id
+            if client_telegram_id is None and parsed.payment_id:
+                # ID клиента не указан - находим его по платежу
+                consultation = await self.database.get_consultation_by_payment_id(parsed.payment_id)
+                if consultation:
+                    client_telegram_id = consultation["user_id"]
             
-            if telegram_id_match:
-                client_telegram_id = int(telegram_id_match.group(1))
-                await self.verify_code_word_for_lawyer(update, client_telegram_id, "ЮРИСТ2024")
+            if client_telegram_id:
+                await self.verify_code_word_for_lawyer(update, client_telegram_id, parsed.code_word)
             else:
                 await update.message.reply_text(
                     "❌ Кодовое слово найдено, но не найден Telegram ID клиента\n\n"
@@ -1290,9 +1684,9 @@ class LegalBot:
                 "💡 Как использовать бота для проверки кодовых слов:\n\n"
                 "1. Перешлите сообщение от клиента с кодовым словом\n"
                 "2. Или напишите сообщение в формате:\n"
-                "   'Клиент ID: 123456789, код: ЮРИСТ2024'\n"
+                "   'Код клиента: ЮР-7KQ4MZ'\n"
                 "3. Или используйте команду:\n"
-                "   /check 123456789 ЮРИСТ2024\n\n"
+                "   /check ЮР-7KQ4MZ\n\n"
                 "Бот автоматически проверит кодовое слово и покажет информацию о клиенте."
             )
     
@@ -1306,49 +1700,32 @@ class LegalBot:
             logger.debug(f"Пропускаем сообщение из чата (не личное): {event.chat_id}")
             return
         
-        sender = await event.get_sender()
-        message_text = event.text
-        
-        # Проверяем, что сообщение не от самого юриста
-        me = await self.lawyer_client.get_me()
-        if sender.id == me.id:
+        # Проверяем, что сообщение не от самого юриста (без запроса к Telegram)
+        if self._is_lawyer_self(event.sender_id):
             logger.debug(f"Пропускаем собственное сообщение от юриста")
             return
         
+        sender = await self._get_lawyer_sender(event)
+        message_text = event.text
+        
         logger.info(f"Личное сообщение от {sender.id} (@{sender.username}): {message_text[:100]}...")
         
-        # Ищем кодовое слово в сообщении (в любом месте)
-        code_match = re.search(r'ЮРИСТ2024', message_text, re.IGNORECASE)
+        # Кодовое слово и Telegram ID (в любом месте сообщения) - одним проходом
+        parsed = parse_message(message_text)
         
         # Если кодового слова нет, не отвечаем
-        if not code_match:
+        if not parsed.has_code_word:
             logger.debug(f"Кодовое слово не найдено в сообщении от {sender.id}, пропускаем")
             return
         
-        # Ищем Telegram ID в сообщении (в любом месте)
-        id_match = re.search(r'(\d{8,})', message_text)
-        
-        if not id_match:
-            await event.reply(
-                "❌ Не найден Telegram ID в сообщении.\n\n"
-                "Пожалуйста, укажите ваш ID в любом месте сообщения."
-            )
-            return
-        
-        client_id = int(id_match.group(1))
-        
-        # Проверяем оплату
-        payment_info = self._check_lawyer_payment(client_id)
-        
-        if not payment_info:
-            await event.reply(
-                "❌ Вы не оплатили консультацию.\n\n"
-                "Оплатите консультацию через бота и попробуйте снова."
-            )
+        lawyer_id = self.lawyer_me.id if self.lawyer_me else 0
+        client_id, payment_info, error_text = await resolve_client(self.database, parsed, sender.id, lawyer_id)
+        if error_text:
+            await event.reply(error_text)
             return
         
         # Получаем информацию о пользователе
-        user_info = self._get_lawyer_user_info(client_id)
+        user_info = await self._get_lawyer_user_info(client_id)
         
         # Формируем простой ответ
         response = f"Здравствуйте!\n\n"
@@ -1359,15 +1736,11 @@ class LegalBot:
         
         await event.reply(response)
         
-        # Сохраняем информацию о клиенте
-        self.lawyer_data["clients"][str(client_id)] = {
-            "user_info": user_info,
-            "payment_info": payment_info,
-            "last_contact": datetime.now().isoformat(),
-            "sender_id": sender.id,
-            "sender_username": sender.username
-        }
-        self._save_lawyer_data()
+        # Сохраняем обращение клиента (общая таблица для всех процессов юриста)
+        await self.database.upsert_lawyer_contact(
+            client_id, user_info, payment_info, sender.id, sender.username
+        )
+        self.lawyer_stats.invalidate()
     
     async def _handle_lawyer_client_command(self, event):
         """Обработка команд для клиента юриста (только личные сообщения)"""
@@ -1379,21 +1752,18 @@ class LegalBot:
             logger.debug(f"Пропускаем команду из чата (не личное): {event.chat_id}")
             return
         
-        sender = await event.get_sender()
-        
         # Проверяем, что команда не от самого юриста
-        me = await self.lawyer_client.get_me()
-        if sender.id == me.id:
+        if self._is_lawyer_self(event.sender_id):
             logger.debug(f"Пропускаем собственную команду от юриста")
             return
         
-        command = event.text.lower()
+        command, *args = event.text.lower().split()
         
         if command == "/start":
             await event.reply(
                 "👨‍💼 Добро пожаловать!\n\n"
-                "Напишите ваш ID и кодовое слово ЮРИСТ2024.\n"
-                "Пример: 123456789 ЮРИСТ2024\n\n"
+                "Напишите кодовое слово, полученное после оплаты.\n"
+                "Пример: ЮР-7KQ4MZ\n\n"
                 "Команды:\n"
                 "/help - Инструкция\n"
                 "/stats - Статистика"
@@ -1402,30 +1772,73 @@ class LegalBot:
         elif command == "/help":
             await event.reply(
                 "📋 Инструкция:\n\n"
-                "Клиент пишет: ID + ЮРИСТ2024\n"
-                "Система проверяет оплату\n"
+                "Клиент пишет кодовое слово из сообщения об оплате\n"
+                "Система проверяет оплату и погашает код\n"
                 "Если оплачено - можете консультировать\n\n"
-                "Пример: 123456789 ЮРИСТ2024"
+                "Пример: ЮР-7KQ4MZ\n"
+                "Для старых оплат: 123456789 ЮРИСТ2024"
             )
         
         elif command == "/stats":
-            if not self.lawyer_data["clients"]:
-                await event.reply("📊 Статистика пуста - нет активных клиентов")
+            # Сводка с выручкой - только для юристов из списка доступа
+            if event.sender_id not in self.allowed_lawyers:
+                await event.reply("❌ У вас нет доступа к этой команде.")
                 return
             
-            stats_text = "📊 Статистика активных клиентов:\n\n"
-            
-            for client_id, data in self.lawyer_data["clients"].items():
-                user_info = data.get("user_info", {})
-                payment_info = data.get("payment_info", {})
-                last_contact = data.get("last_contact", "")
-                
-                stats_text += f"👤 {user_info.get('first_name', '')} {user_info.get('last_name', '')}\n"
-                stats_text += f"🆔 ID: {client_id}\n"
-                stats_text += f"💰 Оплата: {payment_info.get('amount', 0)}₽\n"
-                stats_text += f"📅 Последний контакт: {last_contact[:10]}\n\n"
-            
-            await event.reply(stats_text)
+            page = int(args[0]) if args and args[0].isdigit() else 1
+            text, page, pages = await self.lawyer_stats.get_page(page)
+            # Аккаунт юриста - не бот, inline кнопки недоступны, поэтому переход командой
+            if page < pages:
+                text += f"➡️ Следующая страница: /stats {page + 1}"
+            await event.reply(text)
+    
+    def _is_lawyer_self(self, sender_id) -> bool:
+        """Сообщение отправлено самим юристом"""
+        return self.lawyer_me is not None and sender_id == self.lawyer_me.id
+    
+    async def _get_lawyer_sender(self, event):
+        """Отправитель сообщения клиенту юриста с кэшированием по sender_id"""
+        sender = self.lawyer_entity_cache.get(event.sender_id)
+        if sender is None:
+            sender = await event.get_sender()
+            if sender is not None:
+                self.lawyer_entity_cache.set(event.sender_id, sender)
+        return sender
+    
+    async def _refresh_lawyer_me(self):
+        """Получение аккаунта юриста (при запуске и после переподключения)"""
+        self.lawyer_me = await self.lawyer_client.get_me()
+        logger.info(f"✅ Клиент юриста подключен как: {self.lawyer_me.first_name} (@{self.lawyer_me.username})")
+    
+    async def _watch_lawyer_connection(self):
+        """Переподключение клиента юриста после разрыва соединения"""
+        while True:
+            await self.lawyer_client.disconnected
+            logger.warning("⚠️ Клиент юриста отключен, переподключаемся...")
+            
+            delay = 5
+            while not self.lawyer_client.is_connected():
+                await asyncio.sleep(delay)
+                try:
+                    await self.lawyer_client.connect()
+                    await self._refresh_lawyer_me()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка переподключения клиента юриста: {e}")
+                    delay = min(delay * 2, 300)
+    
+    async def _stop_lawyer_client(self):
+        """Отключение клиента юриста"""
+        if self._lawyer_watch_task:
+            self._lawyer_watch_task.cancel()
+            try:
+                await self._lawyer_watch_task
+            except asyncio.CancelledError:
+                pass
+            self._lawyer_watch_task = None
+        
+        if self.lawyer_client and self.lawyer_client.is_connected():
+            await self.lawyer_client.disconnect()
+            logger.info("Клиент юриста отключен")
     
     async def _start_lawyer_client(self):
         """Запуск клиента юриста"""
@@ -1455,8 +1868,12 @@ class LegalBot:
                 logger.info("💡 Удалите файл veretenov_session.txt и перезапустите бота для повторной авторизации")
                 return
             
-            me = await self.lawyer_client.get_me()
-            logger.info(f"✅ Клиент юриста подключен как: {me.first_name} (@{me.username})")
+            # Аккаунт юриста запрашивается один раз, а не на каждое сообщение
+            await self._refresh_lawyer_me()
+            self._lawyer_watch_task = asyncio.create_task(self._watch_lawyer_connection())
+            
+            # Однократный перенос клиентов из локальных файлов в базу
+            await migrate_to_database(self.database, self.lawyer_store_file, self.lawyer_data_file)
             
             # Регистрируем обработчики только для личных сообщений
             @self.lawyer_client.on(events.NewMessage(pattern=r'^/', func=lambda e: e.is_private))
@@ -1486,23 +1903,40 @@ class LegalBot:
         else:
             logger.warning("⚠️ Сессия Telegram не создана, клиент юриста будет работать в режиме бота")
         
+        # Прогреваем кэш ответов ИИ из истории консультаций
+        await self._warm_answer_cache()
+        
+        # Запускаем фоновую пакетную запись в базу данных
+        self.write_queue.start()
+        
+        # Запускаем сверку неоплаченных консультаций
+        if self.reconciler:
+            self.reconciler.start()
+        
+        # Запускаем удаление истекшего состояния диалогов
+        self.state.start()
+        
         # Запускаем клиент юриста в отдельной задаче
         lawyer_task = None
         if self.lawyer_client_enabled:
             lawyer_task = asyncio.create_task(self._start_lawyer_client())
         
         try:
-            logger.info("Запуск polling...")
             await self.application.initialize()
             await self.application.start()
-            await self.application.updater.start_polling()
+            await self._start_http_server()
+            
+            if self.bot_mode == "webhook":
+                await self._start_webhook()
+            else:
+                logger.info("Запуск polling...")
+                await self.application.updater.start_polling()
             
-            # Ждем завершения
-            while True:
-                await asyncio.sleep(1)
+            # Ждем сигнала завершения (SIGINT/SIGTERM)
+            await self._wait_for_shutdown_signal()
                 
         except Exception as e:
-            logger.error(f"Ошибка при запуске polling: {e}")
+            logger.error(f"Ошибка при запуске бота ({self.bot_mode}): {e}")
         finally:
             # Останавливаем клиент юриста
             if lawyer_task:
@@ -1511,18 +1945,116 @@ class LegalBot:
                     await lawyer_task
                 except asyncio.CancelledError:
                     pass
+            await self._stop_lawyer_client()
+            
+            # Прекращаем прием новых обновлений
+            if self.webhook_server:
+                await self.webhook_server.stop()
+            if self.application.updater and self.application.updater.running:
+                await self.application.updater.stop()
             
             # Закрываем приложение
-            await self.application.updater.stop()
-            await self.application.stop()
+            if self.application.running:
+                await self.application.stop()
             await self.application.shutdown()
             
+            # Останавливаем сверку платежей
+            if self.reconciler:
+                await self.reconciler.stop()
+            await self.state.stop()
+            
+            # Сбрасываем отложенные записи в базу данных до закрытия соединений
+            await self.write_queue.stop()
+            
+            # Закрываем пул соединений OpenRouter
+            if self.llm_client:
+                await self.llm_client.close()
+            
+            # Останавливаем пул потоков ЮKassa
+            await self.payment_handler.close()
+            
             # Закрываем соединение с базой данных
             if hasattr(self, 'database'):
                 logger.info("Закрытие соединения с базой данных...")
-                self.database.close()
+                await self.database.close()
             logger.info("Бот остановлен")
     
+    async def _start_http_server(self):
+        """Запуск встроенного HTTP сервера для webhook Telegram и уведомлений ЮKassa"""
+        if self.bot_mode != "webhook" and not self.yookassa_webhook_enabled:
+            return
+        
+        self.webhook_server = WebhookServer(
+            host=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8080"))
+        )
+        self.webhook_server.add_route("GET", "/metrics", self._metrics_endpoint)
+        
+        if self.bot_mode == "webhook":
+            telegram_handler = TelegramWebhookHandler(self.application, self.webhook_secret)
+            self.webhook_server.add_route("POST", self.webhook_path, telegram_handler.handle)
+        
+        if self.yookassa_webhook_enabled:
+            yookassa_handler = YooKassaWebhookHandler(
+                lambda payment_id: self.payment_status_cache.get(payment_id, refresh=True),
+                self.handle_yookassa_payment,
+                verify_ip=os.getenv("YOOKASSA_WEBHOOK_VERIFY_IP", "true").lower() == "true",
+                trust_forwarded_for=os.getenv("WEBHOOK_TRUST_FORWARDED_FOR", "false").lower() == "true"
+            )
+            self.webhook_server.add_route("POST", self.yookassa_webhook_path, yookassa_handler.handle)
+            logger.info(f"Прием уведомлений ЮKassa: {self.yookassa_webhook_path}")
+        
+        await self.webhook_server.start()
+    
+    async def _start_webhook(self):
+        """Регистрация webhook Telegram на встроенном HTTP сервере"""
+        webhook_url = os.getenv("WEBHOOK_URL")
+        if not webhook_url:
+            raise ValueError("WEBHOOK_URL не задан для режима webhook")
+        
+        await self.application.bot.set_webhook(
+            url=webhook_url.rstrip("/") + self.webhook_path,
+            secret_token=self.webhook_secret,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+        )
+        logger.info(f"Webhook установлен: {webhook_url.rstrip('/')}{self.webhook_path}")
+    
+    def get_metrics(self) -> dict:
+        """Метрики бота для мониторинга"""
+        return {
+            "updates": self.update_processor.get_metrics(),
+            "write_behind": self.write_queue.get_metrics(),
+            "answer_cache": self.answer_cache.get_metrics() if self.answer_cache else None,
+            "payment_status_cache": self.payment_status_cache.get_metrics(),
+            "reconciliation": self.reconciler.get_metrics() if self.reconciler else None,
+            "state_store": self.state.get_metrics(),
+            "conversation_context": self.conversation_context.get_metrics() if self.conversation_context else None,
+            "llm_usage": self.llm_client.usage.get_metrics() if self.llm_client else None,
+            "llm_router": self.llm_router.get_metrics() if self.llm_router else None,
+            "rate_limit": self.rate_limiter.get_metrics() if self.rate_limiter else None,
+            "llm_admission": self.llm_admission.get_metrics()
+        }
+    
+    async def _metrics_endpoint(self, request):
+        """HTTP обработчик метрик"""
+        return web.json_response(self.get_metrics())
+    
+    async def _wait_for_shutdown_signal(self):
+        """Ожидание SIGINT/SIGTERM для корректной остановки"""
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # На Windows обработчики сигналов в event loop недоступны, остается Ctrl+C
+                pass
+        
+        await stop_event.wait()
+        logger.info("Получен сигнал завершения, останавливаем бота...")
+    
     def run(self):
         """Запуск бота (синхронная обертка)"""
         asyncio.run(self.run_async())
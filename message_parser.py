@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Разбор сообщений клиентов и юриста: кодовое слово, Telegram ID и ID платежа
+
+Все признаки извлекаются одним проходом одного заранее скомпилированного
+выражения. Здесь же генерируются уникальные кодовые слова консультаций
+(ЮР-7KQ4MZ). Замер на типичных сообщениях:
+    python message_parser.py --bench --iterations 20000
+"""
+
+import re
+import sys
+import time
+import secrets
+import argparse
+from typing import NamedTuple, Optional
+
+
+# Общее кодовое слово консультаций, оплаченных до появления уникальных
+LEGACY_CODE_WORD = "ЮРИСТ2024"
+
+CODE_WORD_PREFIX = "ЮР-"
+# Без 0, 1, I и O, которые легко перепутать при переписывании
+CODE_WORD_ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+CODE_WORD_LENGTH = 6
+
+# Кириллические буквы, которые пишутся так же, как латинские из алфавита кода
+_LOOKALIKES = str.maketrans("АВЕКМНРСТУХ", "ABEKMHPCTYX")
+_CODE_CHARS = "2-9A-HJ-NP-Za-hj-np-zАВЕКМНРСТУХавекмнрстух"
+
+# Опережающая проверка первого символа позволяет движку быстро пропускать
+# текст, с которого не начинается ни один признак. ID платежа ЮKassa (UUID)
+# проверяется первым, чтобы его цифры не приняли за Telegram ID.
+_MESSAGE_RE = re.compile(
+    r"(?=[0-9a-fA-FЮю])(?:"
+    r"(?P<payment_id>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})"
+    r"|(?P<legacy_code_word>[Юю][Рр][Ии][Сс][Тт]2024)"
+    rf"|[Юю][Рр][-‐–—](?P<code_word>[{_CODE_CHARS}]{{{CODE_WORD_LENGTH}}})(?![0-9A-Za-zА-Яа-яЁё])"
+    r"|(?P<telegram_id>\d{8,})"
+    r")"
+)
+
+
+def generate_code_word() -> str:
+    """Новое случайное кодовое слово консультации (32^6 ≈ 10^9 вариантов)"""
+    return CODE_WORD_PREFIX + "".join(secrets.choice(CODE_WORD_ALPHABET) for _ in range(CODE_WORD_LENGTH))
+
+
+def normalize_code_word(code: str) -> str:
+    """Кодовое слово в каноническом виде (верхний регистр, латиница, ЮР-)"""
+    return CODE_WORD_PREFIX + code.upper().translate(_LOOKALIKES)
+
+
+class ParsedMessage(NamedTuple):
+    """Признаки, найденные в сообщении (None - не найден)"""
+    code_word: Optional[str] = None
+    telegram_id: Optional[int] = None
+    payment_id: Optional[str] = None
+
+    @property
+    def has_code_word(self) -> bool:
+        return self.code_word is not None
+
+    @property
+    def is_legacy_code_word(self) -> bool:
+        """Общее кодовое слово: консультация ищется по Telegram ID"""
+        return self.code_word == LEGACY_CODE_WORD
+
+
+EMPTY = ParsedMessage()
+
+
+def parse_message(text: Optional[str]) -> ParsedMessage:
+    """
+    Поиск кодового слова, Telegram ID и ID платежа в сообщении
+
+    Берется первое вхождение каждого признака, как и при отдельных поисках;
+    уникальное кодовое слово предпочитается общему ЮРИСТ2024.
+
+    Args:
+        text: Текст сообщения
+
+    Returns:
+        ParsedMessage: Найденные признаки
+    """
+    if not text:
+        return EMPTY
+
+    code_word = telegram_id = payment_id = None
+    for match in _MESSAGE_RE.finditer(text):
+        group = match.lastgroup
+        if group == "code_word":
+            if code_word is None or code_word == LEGACY_CODE_WORD:
+                code_word = normalize_code_word(match.group(group))
+        elif group == "legacy_code_word":
+            if code_word is None:
+                code_word = LEGACY_CODE_WORD
+        elif group == "telegram_id":
+            if telegram_id is None:
+                telegram_id = int(match.group())
+        elif payment_id is None:
+            payment_id = match.group().lower()
+
+        if code_word not in (None, LEGACY_CODE_WORD) and telegram_id is not None and payment_id is not None:
+            break
+
+    return ParsedMessage(code_word, telegram_id, payment_id)
+
+
+# Типичные сообщения клиентов и юриста
+BENCH_CORPUS = [
+    "123456789 ЮРИСТ2024",
+    "ЮРИСТ2024 987654321",
+    "Здравствуйте, мой код ЮР-7KQ4MZ",
+    "юр-7кq4мz, хочу проконсультироваться по трудовому договору",
+    "Здравствуйте! Мой ID 5123456789, кодовое слово юрист2024. Хочу узнать, как расторгнуть договор аренды.",
+    "Клиент говорит кодовое слово ЮРИСТ2024, его ID: 123456789",
+    "Оплатил консультацию, платеж 2d7f3e1a-000f-5000-9000-1b2c3d4e5f60, ID 712345678",
+    "Добрый день, подскажите по поводу наследства",
+    "Мой телефон 89161234567, перезвоните пожалуйста",
+    "/check 123456789 ЮРИСТ2024",
+    "Спасибо!",
+    "Вопрос: " + "как вернуть деньги за некачественный товар, если продавец отказывается? " * 10 + "ID 123456789 ЮРИСТ2024",
+]
+
+
+def _parse_legacy(text: str) -> ParsedMessage:
+    """Прежний разбор отдельными re.search (для сравнения в замере)"""
+    import re
+    code_match = re.search(r'ЮРИСТ2024', text, re.IGNORECASE)
+    id_match = re.search(r'(\d{8,})', text)
+    return ParsedMessage(
+        LEGACY_CODE_WORD if code_match else None,
+        int(id_match.group(1)) if id_match else None
+    )
+
+
+def bench(iterations: int):
+    """Замер разбора корпуса типичных сообщений"""
+    for name, parser in (("re.search по отдельности", _parse_legacy), ("parse_message", parse_message)):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for text in BENCH_CORPUS:
+                parser(text)
+        elapsed = time.perf_counter() - started
+        per_message = elapsed / (iterations * len(BENCH_CORPUS)) * 1e6
+        print(f"⏱  {name}: {elapsed:.3f}с, {per_message:.2f}мкс на сообщение")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор сообщений клиентов юриста")
+    parser.add_argument("text", nargs="*", help="Текст сообщения для разбора")
+    parser.add_argument("--bench", action="store_true", help="Замер на корпусе типичных сообщений")
+    parser.add_argument("--iterations", type=int, default=10000, help="Проходов по корпусу в замере")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.iterations)
+    elif args.text:
+        print(parse_message(" ".join(args.text)))
+    else:
+        parser.print_help(sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,31 @@
 import os
 import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from loguru import logger
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from yookassa import Configuration, Payment
+from requests import exceptions as requests_exceptions
+from yookassa.domain.exceptions import (
+    ApiError, InternalServerError, ResponseProcessingError, TooManyRequestsError
+)
 from yookassa.domain.request import PaymentRequest
 
 
+# Временные ошибки, после которых запрос к ЮKassa можно повторить: сеть и таймауты,
+# 500, 429, 202 (обработка не завершена) и ответ шлюза не в JSON (502/504)
+RETRYABLE_ERRORS = (
+    requests_exceptions.ConnectionError,
+    requests_exceptions.Timeout,
+    requests_exceptions.ChunkedEncodingError,
+    requests_exceptions.JSONDecodeError,
+    InternalServerError,
+    TooManyRequestsError,
+    ResponseProcessingError
+)
+
+
 class PaymentHandler:
     def __init__(self):
         # Настройка ЮKassa
@@ -20,17 +39,42 @@ class PaymentHandler:
             Configuration.secret_key = self.secret_key
             logger.info("ЮKassa настроена успешно")
         
+        # Альтернативный адрес API (например, локальный fake_yookassa.py для тестов)
+        api_url = os.getenv("YOOKASSA_API_URL")
+        if api_url:
+            Configuration.api_url = api_url
+            logger.warning(f"ЮKassa: используется API {api_url}")
+        
         # Цены консультаций в рублях (увеличены на 5%)
         self.oral_consultation_price = 3150.0  # 3000 + 5% = 3150 руб
         self.full_consultation_price = 13650.0  # 13000 + 5% = 13650 руб
     
-    def create_payment(self, consultation_type: str = "oral", user_id: int = None, user_email: str = None) -> dict:
+    @staticmethod
+    def is_retryable_error(error: Exception) -> bool:
+        """
+        Можно ли повторить запрос после ошибки (сеть, 5xx, 429, 202)
+        
+        Ошибки в коде и отказы ЮKassa (4xx) не повторяются. Сетевую ошибку SDK
+        ЮKassa пробрасывает как AttributeError внутри обработки исключения
+        requests, поэтому проверяется и цепочка исключений.
+        """
+        while error is not None:
+            # ApiError без подкласса - неожиданный код ответа, на практике 502/503/504 шлюза
+            if isinstance(error, RETRYABLE_ERRORS) or type(error) is ApiError:
+                return True
+            error = error.__cause__ or error.__context__
+        return False
+    
+    def create_payment(self, consultation_type: str = "oral", user_id: int = None, user_email: str = None,
+                       idempotency_key: str = None) -> dict:
         """
         Создание платежа через ЮKassa
         
         Args:
             consultation_type: Тип консультации (oral/full)
             user_id: ID пользователя Telegram
+            user_email: Email для чека
+            idempotency_key: Ключ идемпотентности (повтор с тем же ключом не создаст второй платеж)
             
         Returns:
             dict: Информация о платеже
@@ -96,7 +140,7 @@ class PaymentHandler:
             )
             
             # Создаем платеж
-            payment = Payment.create(payment_request)
+            payment = Payment.create(payment_request, idempotency_key)
             
             logger.info(f"Платеж создан: {payment.id}")
             
@@ -115,7 +159,8 @@ class PaymentHandler:
             logger.error(f"Ошибка создания платежа: {e}")
             return {
                 "success": False,
-                "error": str(e)
+                "error": str(e),
+                "retryable": self.is_retryable_error(e)
             }
     
     def check_payment_status(self, payment_id: str) -> dict:
@@ -152,7 +197,8 @@ class PaymentHandler:
             logger.error(f"Ошибка проверки статуса платежа: {e}")
             return {
                 "success": False,
-                "error": str(e)
+                "error": str(e),
+                "retryable": self.is_retryable_error(e)
             }
     
     def get_consultation_price_rub(self, consultation_type: str = "oral") -> float:
@@ -228,7 +274,8 @@ class PaymentHandler:
         """
         return 12.5
     
-    def create_receipt(self, payment_id: str, user_email: str = None, user_phone: str = None) -> dict:
+    def create_receipt(self, payment_id: str, user_email: str = None, user_phone: str = None,
+                       payment_status: str = None) -> dict:
         """
         Проверка создания чека через ЮKassa
         
@@ -236,6 +283,7 @@ class PaymentHandler:
             payment_id: ID платежа
             user_email: Email пользователя (опционально)
             user_phone: Телефон пользователя (опционально)
+            payment_status: Уже известный статус платежа (без повторного запроса к API)
             
         Returns:
             dict: Результат проверки чека
@@ -248,18 +296,20 @@ class PaymentHandler:
                     "error": "ЮKassa не настроена"
                 }
             
-            # Получаем информацию о платеже
-            payment = Payment.find_one(payment_id)
-            if not payment:
-                logger.error(f"Платеж {payment_id} не найден")
-                return {
-                    "success": False,
-                    "error": "Платеж не найден"
-                }
+            if payment_status is None:
+                # Получаем информацию о платеже
+                payment = Payment.find_one(payment_id)
+                if not payment:
+                    logger.error(f"Платеж {payment_id} не найден")
+                    return {
+                        "success": False,
+                        "error": "Платеж не найден"
+                    }
+                payment_status = payment.status
             
             # Проверяем, что платеж успешен
-            if payment.status != "succeeded":
-                logger.warning(f"Платеж {payment_id} не оплачен (статус: {payment.status})")
+            if payment_status != "succeeded":
+                logger.warning(f"Платеж {payment_id} не оплачен (статус: {payment_status})")
                 return {
                     "success": False,
                     "error": "Платеж не оплачен"
@@ -279,5 +329,99 @@ class PaymentHandler:
             logger.error(f"Ошибка проверки чека для платежа {payment_id}: {e}")
             return {
                 "success": False,
-                "error": str(e)
-            } 
\ No newline at end of file
+                "error": str(e),
+                "retryable": self.is_retryable_error(e)
+            }
+
+
+class AsyncPaymentHandler:
+    """
+    Асинхронный интерфейс к PaymentHandler
+    
+    Блокирующие вызовы SDK ЮKassa выполняются в выделенном пуле потоков,
+    количество одновременных запросов ограничено, каждый запрос ограничен
+    таймаутом и повторяется с экспоненциальной паузой при временных ошибках.
+    Остальные методы PaymentHandler доступны без изменений.
+    
+    Пример:
+        payment_handler = AsyncPaymentHandler()
+        payment_info = await payment_handler.create_payment("oral", user_id)
+    """
+    
+    def __init__(self, payment_handler: PaymentHandler = None):
+        self.payment_handler = payment_handler or PaymentHandler()
+        self.max_concurrency = int(os.getenv("YOOKASSA_MAX_CONCURRENCY", "10"))
+        self.timeout = float(os.getenv("YOOKASSA_TIMEOUT", "15"))
+        self.max_retries = int(os.getenv("YOOKASSA_MAX_RETRIES", "3"))
+        self.retry_delay = float(os.getenv("YOOKASSA_RETRY_DELAY", "0.5"))
+        
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="yookassa")
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+    
+    async def _call_once(self, method, *args, **kwargs) -> dict:
+        """Один вызов SDK в пуле потоков с таймаутом"""
+        await self._semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, lambda: method(*args, **kwargs))
+        # Слот освобождается, когда поток действительно завершился, а не по таймауту
+        future.add_done_callback(lambda _: self._semaphore.release())
+        
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return {
+                "success": False,
+                "error": f"Таймаут запроса к ЮKassa ({self.timeout}с)",
+                "retryable": True
+            }
+    
+    async def run(self, method_name: str, *args, **kwargs) -> dict:
+        """
+        Выполнение метода PaymentHandler вне event loop с повтором временных ошибок
+        
+        Args:
+            method_name: Имя метода PaymentHandler
+            
+        Returns:
+            dict: Результат метода PaymentHandler
+        """
+        method = getattr(self.payment_handler, method_name)
+        
+        for attempt in range(self.max_retries):
+            result = await self._call_once(method, *args, **kwargs)
+            if result.get("success") or not result.get("retryable"):
+                return result
+            
+            if attempt < self.max_retries - 1:
+                delay = self.retry_delay * (2 ** attempt)
+                logger.warning(f"⚠️ ЮKassa {method_name}: {result.get('error')}, повтор через {delay}с (попытка {attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+        
+        logger.error(f"❌ ЮKassa {method_name}: запрос не удался после {self.max_retries} попыток")
+        return result
+    
+    async def create_payment(self, consultation_type: str = "oral", user_id: int = None,
+                             user_email: str = None) -> dict:
+        """Создание платежа (повторы используют один ключ идемпотентности)"""
+        idempotency_key = str(uuid.uuid4())
+        return await self.run("create_payment", consultation_type, user_id, user_email,
+                              idempotency_key=idempotency_key)
+    
+    async def check_payment_status(self, payment_id: str) -> dict:
+        """Проверка статуса платежа"""
+        return await self.run("check_payment_status", payment_id)
+    
+    async def create_receipt(self, payment_id: str, user_email: str = None, user_phone: str = None,
+                             payment_status: str = None) -> dict:
+        """Проверка чека платежа"""
+        if payment_status is not None:
+            # Статус уже известен - запрос к API не нужен
+            return self.payment_handler.create_receipt(payment_id, user_email, user_phone, payment_status)
+        return await self.run("create_receipt", payment_id, user_email, user_phone)
+    
+    def __getattr__(self, name):
+        return getattr(self.payment_handler, name)
+    
+    async def close(self):
+        """Остановка пула потоков"""
+        self._executor.shutdown(wait=False)
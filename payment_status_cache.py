@@ -0,0 +1,102 @@
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Dict
+
+from loguru import logger
+
+from cache_utils import TTLCache
+
+
+# Статусы ЮKassa, после которых платеж больше не меняется
+TERMINAL_STATUSES = {"succeeded", "canceled"}
+
+
+class PaymentStatusCache:
+    """
+    Кэш статусов платежей ЮKassa с объединением одновременных запросов
+
+    Завершенные платежи (succeeded, canceled) хранятся до вытеснения из LRU,
+    pending и waiting_for_capture - несколько секунд. Ошибки не кэшируются.
+    Одновременные проверки одного платежа ждут один общий запрос к API.
+    """
+
+    def __init__(self, loader: Callable[[str], Awaitable[Dict]], max_size: int = 10000,
+                 pending_ttl: float = 5.0):
+        """
+        Args:
+            loader: Корутина получения статуса платежа (формат PaymentHandler.check_payment_status)
+            max_size: Максимальное количество платежей в кэше
+            pending_ttl: Время жизни незавершенного статуса в секундах
+        """
+        self.loader = loader
+        self.pending_ttl = pending_ttl
+        self._cache = TTLCache(max_size=max_size, ttl=None)
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.lookups = 0
+        self.coalesced = 0
+
+    def _store(self, payment_status: Dict):
+        if not payment_status.get("success"):
+            return
+        ttl = None if payment_status["status"] in TERMINAL_STATUSES else self.pending_ttl
+        self._cache.set(payment_status["payment_id"], payment_status, ttl=ttl)
+
+    def set(self, payment_status: Dict):
+        """Сохранение статуса, полученного в обход кэша (например, из уведомления)"""
+        self._store(payment_status)
+
+    def invalidate(self, payment_id: str):
+        """Удаление статуса платежа из кэша"""
+        self._cache.pop(payment_id)
+
+    async def get(self, payment_id: str, refresh: bool = False) -> Dict:
+        """
+        Получение статуса платежа
+
+        Args:
+            payment_id: ID платежа в ЮKassa
+            refresh: Не использовать незавершенный статус из кэша
+
+        Returns:
+            dict: Информация о статусе платежа
+        """
+        cached = self._cache.get(payment_id)
+        if cached is not None and (not refresh or cached["status"] in TERMINAL_STATUSES):
+            return cached
+
+        task = self._in_flight.get(payment_id)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # Запрос к API выполняется отдельной задачей: отмена одного из
+            # ожидающих (в том числе первого) не отменяет его для остальных
+            task = asyncio.ensure_future(self._fetch(payment_id))
+            self._in_flight[payment_id] = task
+            task.add_done_callback(partial(self._finish, payment_id))
+            self.lookups += 1
+        return await asyncio.shield(task)
+
+    async def _fetch(self, payment_id: str) -> Dict:
+        try:
+            payment_status = await self.loader(payment_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения статуса платежа {payment_id}: {e!r}")
+            raise
+        self._store(payment_status)
+        return payment_status
+
+    def _finish(self, payment_id: str, task: asyncio.Task):
+        del self._in_flight[payment_id]
+        # Помечаем исключение прочитанным, даже если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+    def get_metrics(self) -> Dict:
+        """Счетчики кэша и объединенных запросов"""
+        metrics = self._cache.get_metrics()
+        metrics.update({
+            "api_lookups": self.lookups,
+            "coalesced_lookups": self.coalesced,
+            "in_flight": len(self._in_flight)
+        })
+        return metrics
@@ -0,0 +1,246 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+from cache_utils import TTLCache
+
+
+class TokenBucket:
+    """Корзина токенов одного пользователя"""
+
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+    def take(self, capacity: float, refill_rate: float, now: float) -> Tuple[bool, float]:
+        """
+        Списание одного токена
+
+        Returns:
+            Tuple[bool, float]: Разрешен ли запрос и через сколько секунд появится токен
+        """
+        self.tokens = min(capacity, self.tokens + max(0.0, now - self.updated_at) * refill_rate)
+        self.updated_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True, 0.0
+        return False, (1.0 - self.tokens) / refill_rate
+
+
+class RateLimiter:
+    """
+    Ограничение частоты вопросов к ИИ для каждого пользователя (token bucket)
+
+    Пользователь может задать подряд до capacity вопросов, дальше - по одному
+    в 60 / per_minute секунд. Корзины хранятся в памяти; полная корзина
+    ничем не отличается от новой, поэтому она удаляется после полного
+    восстановления. С хранилищем состояния (state_store) корзины сохраняются
+    и переживают перезапуск бота. Общим лимитом для нескольких экземпляров
+    бота это не является: корзина читается из памяти экземпляра, а в
+    хранилище записывается без блокировки.
+    """
+
+    NAMESPACE = "rate_limit"
+
+    def __init__(self, capacity: int = 5, per_minute: float = 5.0, max_users: int = 100000, store=None):
+        """
+        Args:
+            capacity: Сколько вопросов можно задать подряд
+            per_minute: Скорость восстановления (вопросов в минуту)
+            max_users: Сколько корзин хранить в памяти
+            store: StateStore для сохранения корзин (None - только память)
+        """
+        self.capacity = float(capacity)
+        self.refill_rate = per_minute / 60.0
+        self.store = store
+        self.refill_time = self.capacity / self.refill_rate
+        self._buckets = TTLCache(max_size=max_users, ttl=self.refill_time)
+
+        # Метрики
+        self.allowed = 0
+        self.limited = 0
+
+    async def _load(self, user_id: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None and self.store is not None:
+            try:
+                saved = await self.store.get(self.NAMESPACE, user_id)
+                if saved:
+                    bucket = TokenBucket(saved["tokens"], saved["updated_at"])
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения лимита запросов пользователя {user_id}: {e}")
+        if bucket is None:
+            bucket = TokenBucket(self.capacity, now)
+        return bucket
+
+    async def check(self, user_id: int) -> Tuple[bool, float]:
+        """
+        Проверка и учет очередного вопроса пользователя
+
+        Args:
+            user_id: ID пользователя в Telegram
+
+        Returns:
+            Tuple[bool, float]: Разрешен ли вопрос и сколько секунд ждать следующего
+        """
+        # Время по часам системы, чтобы сохраненные корзины были верны после перезапуска
+        now = time.time()
+        bucket = await self._load(user_id, now)
+        allowed, retry_after = bucket.take(self.capacity, self.refill_rate, now)
+        self._buckets.set(user_id, bucket)
+
+        if self.store is not None:
+            try:
+                await self.store.set(
+                    self.NAMESPACE, user_id,
+                    {"tokens": bucket.tokens, "updated_at": bucket.updated_at},
+                    ttl=self.refill_time
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения лимита запросов пользователя {user_id}: {e}")
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+            logger.info(f"Пользователь {user_id} превысил лимит вопросов к ИИ, ожидание {retry_after:.0f}с")
+        return allowed, retry_after
+
+    def get_metrics(self) -> Dict:
+        """Счетчики разрешенных и отклоненных вопросов"""
+        return {
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "tracked_users": len(self._buckets),
+            "persistent": self.store is not None
+        }
+
+
+class AdmissionController:
+    """
+    Общее ограничение одновременных запросов к ИИ
+
+    Не больше max_concurrent запросов выполняются одновременно, еще до
+    max_queue ждут своей очереди не дольше queue_timeout секунд. Запросы
+    сверх очереди и дождавшиеся таймаута отклоняются сразу, чтобы
+    пользователь получил быстрый ответ вместо долгого ожидания.
+    """
+
+    def __init__(self, max_concurrent: int = 20, max_queue: int = 50, queue_timeout: float = 30.0):
+        """
+        Args:
+            max_concurrent: Максимум одновременных запросов к ИИ
+            max_queue: Максимум запросов в очереди
+            queue_timeout: Максимальное ожидание в очереди в секундах
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.waiting = 0
+
+        # Метрики
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.max_wait = 0.0
+
+    async def acquire(self, on_queued: Optional[Callable[[], Awaitable]] = None) -> bool:
+        """
+        Получение места для запроса к ИИ
+
+        Args:
+            on_queued: Корутина, вызываемая, если запросу придется ждать в очереди
+
+        Returns:
+            bool: True - место получено (обязательно вызвать release), False - запрос отклонен
+        """
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return self._admit()
+
+        if self.waiting >= self.max_queue:
+            self.shed += 1
+            logger.warning(f"⚠️ Очередь запросов к ИИ заполнена ({self.waiting}), запрос отклонен")
+            return False
+
+        self.waiting += 1
+        self.queued += 1
+        started = time.perf_counter()
+        # Ожидание места отдельной задачей: при таймауте или отмене ее можно отменить,
+        # а место, полученное одновременно с таймаутом, вернуть
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            if on_queued:
+                await on_queued()
+            await asyncio.wait_for(asyncio.shield(acquire), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(acquire)
+            self.timed_out += 1
+            logger.warning(f"⚠️ Запрос к ИИ не дождался очереди за {self.queue_timeout:.0f}с")
+            return False
+        except BaseException:
+            self._abandon(acquire)
+            raise
+        finally:
+            self.waiting -= 1
+            self.max_wait = max(self.max_wait, time.perf_counter() - started)
+        return self._admit()
+
+    def _abandon(self, acquire: asyncio.Future):
+        """Отмена ожидания места; уже полученное место возвращается"""
+        acquire.cancel()
+        acquire.add_done_callback(self._release_if_acquired)
+
+    def _release_if_acquired(self, acquire: asyncio.Future):
+        if not acquire.cancelled() and acquire.exception() is None:
+            self._semaphore.release()
+
+    def _admit(self) -> bool:
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        """Освобождение места после запроса к ИИ"""
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def get_metrics(self) -> Dict:
+        """Счетчики очереди запросов к ИИ"""
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "max_wait_ms": round(self.max_wait * 1000, 1)
+        }
+
+
+def create_rate_limiter(state_store) -> Optional[RateLimiter]:
+    """
+    Ограничение частоты вопросов по настройкам окружения
+
+    RATE_LIMIT_ENABLED (по умолчанию true), RATE_LIMIT_BURST и
+    RATE_LIMIT_PER_MINUTE; RATE_LIMIT_PERSIST=true сохраняет корзины
+    в хранилище состояния диалогов (STATE_STORE_BACKEND).
+    """
+    if os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "true":
+        return None
+    persist = os.getenv("RATE_LIMIT_PERSIST", "false").lower() == "true"
+    return RateLimiter(
+        capacity=int(os.getenv("RATE_LIMIT_BURST", "5")),
+        per_minute=float(os.getenv("RATE_LIMIT_PER_MINUTE", "5")),
+        max_users=int(os.getenv("RATE_LIMIT_MAX_USERS", "100000")),
+        store=state_store if persist else None
+    )
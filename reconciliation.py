@@ -0,0 +1,159 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+
+# Статус консультации в базе для завершенных статусов ЮKassa
+STATUS_MAPPING = {
+    "succeeded": "completed",
+    "canceled": "canceled"
+}
+
+
+class PaymentReconciler:
+    """
+    Фоновая сверка неоплаченных консультаций с ЮKassa
+
+    Консультации со статусом pending читаются пакетами по возрастанию id,
+    статусы платежей запрашиваются параллельно (не больше concurrency),
+    завершенные платежи обновляются в базе одним запросом на пакет.
+    Позиция сохраняется после каждого пакета, поэтому после перезапуска
+    сверка продолжается с того же места.
+    """
+
+    CHECKPOINT_NAME = "payment_reconciliation"
+
+    def __init__(self, database, fetch_status: Callable[[str], Awaitable[Dict]],
+                 on_transition: Optional[Callable[[Dict, Dict], Awaitable[None]]] = None,
+                 batch_size: int = 100, interval: float = 60.0, concurrency: int = 5,
+                 min_age: float = 30.0):
+        """
+        Args:
+            database: AsyncDatabase
+            fetch_status: Корутина получения статуса платежа (формат PaymentHandler.check_payment_status)
+            on_transition: Корутина, вызываемая для каждой консультации с измененным статусом
+            batch_size: Размер пакета консультаций
+            interval: Пауза между проходами в секундах
+            concurrency: Максимум одновременных запросов к ЮKassa
+            min_age: Не сверять консультации моложе этого возраста (секунд), их подтвердит пользователь или уведомление
+        """
+        self.database = database
+        self.fetch_status = fetch_status
+        self.on_transition = on_transition
+        self.batch_size = batch_size
+        self.interval = interval
+        self.min_age = min_age
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.passes = 0
+        self.checked = 0
+        self.updated = 0
+        self.errors = 0
+        self.last_pass_duration = 0.0
+
+    def start(self):
+        """Запуск фоновой сверки"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Сверка платежей запущена (пакет {self.batch_size}, интервал {self.interval}с)")
+
+    async def stop(self):
+        """Остановка фоновой сверки"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("Сверка платежей остановлена")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"❌ Ошибка сверки платежей: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _fetch(self, payment_id: str) -> Dict:
+        async with self._semaphore:
+            try:
+                return await self.fetch_status(payment_id)
+            except Exception as e:
+                return {"success": False, "payment_id": payment_id, "error": str(e)}
+
+    async def run_once(self) -> int:
+        """
+        Один проход по всем неоплаченным консультациям начиная с сохраненной позиции
+
+        Returns:
+            int: Количество консультаций с измененным статусом
+        """
+        started = time.perf_counter()
+        last_id = await self.database.get_checkpoint(self.CHECKPOINT_NAME)
+        updated = 0
+
+        while True:
+            rows = await self.database.get_pending_payments(last_id, self.batch_size, self.min_age)
+            if not rows:
+                break
+
+            updated += await self._reconcile_batch(rows)
+            last_id = rows[-1]["id"]
+            await self.database.save_checkpoint(self.CHECKPOINT_NAME, last_id)
+
+            if len(rows) < self.batch_size:
+                break
+
+        # Проход завершен - следующий начнется с начала таблицы
+        await self.database.save_checkpoint(self.CHECKPOINT_NAME, 0)
+
+        self.passes += 1
+        self.last_pass_duration = time.perf_counter() - started
+        if updated:
+            logger.info(f"Сверка платежей: обновлено {updated} за {self.last_pass_duration:.1f}с")
+        return updated
+
+    async def _reconcile_batch(self, rows: List[Dict]) -> int:
+        statuses = await asyncio.gather(*(self._fetch(row["payment_id"]) for row in rows))
+        self.checked += len(rows)
+
+        by_payment_id = {}
+        changes = []
+        for payment_status in statuses:
+            if not payment_status.get("success"):
+                self.errors += 1
+                continue
+            new_status = STATUS_MAPPING.get(payment_status["status"])
+            if new_status:
+                by_payment_id[payment_status["payment_id"]] = payment_status
+                changes.append((payment_status["payment_id"], new_status))
+
+        if not changes:
+            return 0
+
+        transitioned = await self.database.apply_payment_statuses(changes)
+        if transitioned is None:
+            raise RuntimeError(f"не удалось обновить статусы {len(changes)} платежей")
+
+        self.updated += len(transitioned)
+        if self.on_transition:
+            for consultation in transitioned:
+                await self.on_transition(consultation, by_payment_id[consultation["payment_id"]])
+        return len(transitioned)
+
+    def get_metrics(self) -> Dict:
+        """Счетчики сверки"""
+        return {
+            "passes": self.passes,
+            "checked": self.checked,
+            "updated": self.updated,
+            "errors": self.errors,
+            "last_pass_duration_ms": round(self.last_pass_duration * 1000, 1)
+        }
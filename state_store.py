@@ -0,0 +1,159 @@
+import os
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from loguru import logger
+
+from cache_utils import TTLCache
+
+
+class StateStore(ABC):
+    """
+    Хранилище состояния диалогов с временем жизни записей
+
+    Ключи группируются по видам состояния (namespace), например
+    email_waiting. Значения должны сериализоваться в JSON.
+    """
+
+    def __init__(self, default_ttl: float = 900.0):
+        """
+        Args:
+            default_ttl: Время жизни записи по умолчанию в секундах
+        """
+        self.default_ttl = default_ttl
+
+    @abstractmethod
+    async def get(self, namespace: str, key) -> Any:
+        """Значение или None, если его нет или срок истек"""
+
+    @abstractmethod
+    async def set(self, namespace: str, key, value: Any, ttl: Optional[float] = None):
+        """Сохранение значения (ttl по умолчанию default_ttl)"""
+
+    @abstractmethod
+    async def pop(self, namespace: str, key) -> Any:
+        """Удаление значения с возвратом (None, если его нет или срок истек)"""
+
+    def start(self):
+        """Запуск фоновых задач хранилища"""
+
+    async def stop(self):
+        """Остановка фоновых задач хранилища"""
+
+    def get_metrics(self) -> dict:
+        """Метрики хранилища"""
+        return {}
+
+
+class MemoryStateStore(StateStore):
+    """
+    Состояние в памяти процесса
+
+    Размер ограничен (LRU), записи истекают по времени. Подходит для
+    одного экземпляра бота; при перезапуске состояние теряется.
+    """
+
+    def __init__(self, default_ttl: float = 900.0, max_size: int = 100000):
+        """
+        Args:
+            default_ttl: Время жизни записи по умолчанию в секундах
+            max_size: Максимальное количество записей всех видов
+        """
+        super().__init__(default_ttl)
+        self._cache = TTLCache(max_size=max_size, ttl=default_ttl)
+
+    async def get(self, namespace: str, key) -> Any:
+        return self._cache.get((namespace, key))
+
+    async def set(self, namespace: str, key, value: Any, ttl: Optional[float] = None):
+        self._cache.set((namespace, key), value, ttl=ttl)
+
+    async def pop(self, namespace: str, key) -> Any:
+        return self._cache.pop((namespace, key))
+
+    def get_metrics(self) -> dict:
+        return {"backend": "memory", **self._cache.get_metrics()}
+
+
+class PostgresStateStore(StateStore):
+    """
+    Состояние в таблице conversation_state
+
+    Переживает перезапуск и общее для всех экземпляров бота. Истекшие
+    записи не возвращаются и периодически удаляются фоновой задачей.
+    """
+
+    def __init__(self, database, default_ttl: float = 900.0, purge_interval: float = 300.0):
+        """
+        Args:
+            database: AsyncDatabase
+            default_ttl: Время жизни записи по умолчанию в секундах
+            purge_interval: Пауза между удалениями истекших записей в секундах
+        """
+        super().__init__(default_ttl)
+        self.database = database
+        self.purge_interval = purge_interval
+        self._task: Optional[asyncio.Task] = None
+        self.purged = 0
+
+    async def get(self, namespace: str, key) -> Any:
+        return await self.database.get_state(namespace, str(key))
+
+    async def set(self, namespace: str, key, value: Any, ttl: Optional[float] = None):
+        ttl = self.default_ttl if ttl is None else ttl
+        await self.database.set_state(namespace, str(key), value, ttl)
+
+    async def pop(self, namespace: str, key) -> Any:
+        return await self.database.pop_state(namespace, str(key))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                deleted = await self.database.purge_expired_state()
+                self.purged += deleted
+                if deleted:
+                    logger.debug(f"Удалено истекшее состояние диалогов: {deleted}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка удаления истекшего состояния диалогов: {e}")
+
+    def get_metrics(self) -> dict:
+        return {"backend": "postgres", "purged": self.purged}
+
+
+def create_state_store(database) -> StateStore:
+    """
+    Хранилище состояния по настройкам окружения
+
+    STATE_STORE_BACKEND=memory (по умолчанию) или postgres,
+    STATE_TTL - время жизни записи по умолчанию, STATE_MAX_SIZE - размер
+    хранилища в памяти.
+    """
+    backend = os.getenv("STATE_STORE_BACKEND", "memory").lower()
+    default_ttl = float(os.getenv("STATE_TTL", "900"))
+
+    if backend == "postgres":
+        logger.info("Состояние диалогов хранится в PostgreSQL")
+        return PostgresStateStore(
+            database,
+            default_ttl=default_ttl,
+            purge_interval=float(os.getenv("STATE_PURGE_INTERVAL", "300"))
+        )
+
+    if backend != "memory":
+        logger.warning(f"Неизвестный STATE_STORE_BACKEND={backend}, используется memory")
+    return MemoryStateStore(default_ttl=default_ttl, max_size=int(os.getenv("STATE_MAX_SIZE", "100000")))
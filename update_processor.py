@@ -0,0 +1,155 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from loguru import logger
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class _KeyStats:
+    __slots__ = ("pending", "processed", "busy_time", "max_wait", "lock")
+
+    def __init__(self):
+        self.pending = 0
+        self.processed = 0
+        self.busy_time = 0.0
+        self.max_wait = 0.0
+        self.lock = asyncio.Lock()
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка для одного пользователя
+
+    Обновления разных пользователей обрабатываются одновременно (не больше max_workers),
+    обновления одного пользователя - строго последовательно в порядке поступления.
+    Обновление, ожидающее своей очереди у пользователя, не занимает рабочий слот.
+    """
+
+    def __init__(self, max_workers: int = 32, max_pending: int = 1024, hot_key_threshold: int = 10,
+                 max_tracked_keys: int = 10000):
+        """
+        Args:
+            max_workers: Максимальное количество одновременно обрабатываемых обновлений
+            max_pending: Максимальное количество обновлений в обработке и ожидании
+            hot_key_threshold: Длина очереди пользователя, при которой пишется предупреждение
+            max_tracked_keys: Сколько пользователей хранить в накопленной статистике
+        """
+        super().__init__(max_concurrent_updates=max(max_pending, max_workers))
+        self.max_workers = max_workers
+        self.hot_key_threshold = hot_key_threshold
+        self.max_tracked_keys = max_tracked_keys
+        self._workers = asyncio.BoundedSemaphore(max_workers)
+        self._keys: Dict[Hashable, _KeyStats] = {}
+        # Накопленная статистика по пользователям (переживает удаление блокировки)
+        self._totals: Dict[Hashable, list] = {}
+        self.active = 0
+        self.processed = 0
+
+    @staticmethod
+    def get_update_key(update: object) -> Optional[Hashable]:
+        """Ключ упорядочивания: пользователь, а при его отсутствии - чат"""
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        """Обработка обновления после предыдущих обновлений того же пользователя"""
+        key = self.get_update_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        stats = self._keys.get(key)
+        if stats is None:
+            stats = self._keys[key] = _KeyStats()
+        stats.pending += 1
+        if stats.pending == self.hot_key_threshold:
+            logger.warning(f"⚠️ Очередь обновлений пользователя {key} достигла {stats.pending}")
+
+        queued_at = time.perf_counter()
+        try:
+            async with stats.lock:
+                async with self._workers:
+                    started = time.perf_counter()
+                    stats.max_wait = max(stats.max_wait, started - queued_at)
+                    self.active += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.active -= 1
+                        stats.busy_time += time.perf_counter() - started
+                        stats.processed += 1
+                        self.processed += 1
+        finally:
+            stats.pending -= 1
+            if stats.pending == 0:
+                # Пользователь больше ничего не ждет - освобождаем блокировку
+                del self._keys[key]
+                self._record_totals(key, stats)
+
+    def _record_totals(self, key: Hashable, stats: _KeyStats):
+        totals = self._totals.setdefault(key, [0, 0.0, 0.0])
+        totals[0] += stats.processed
+        totals[1] += stats.busy_time
+        totals[2] = max(totals[2], stats.max_wait)
+
+        if len(self._totals) > self.max_tracked_keys:
+            # Оставляем половину пользователей с наибольшим временем обработки
+            keep = sorted(self._totals.items(), key=lambda item: item[1][1], reverse=True)
+            self._totals = dict(keep[:self.max_tracked_keys // 2])
+
+    async def initialize(self) -> None:
+        logger.info(f"Параллельная обработка обновлений: {self.max_workers} обработчиков")
+
+    async def shutdown(self) -> None:
+        if self._keys:
+            logger.warning(f"Обработчик обновлений остановлен, пользователей с ожидающими обновлениями: {len(self._keys)}")
+
+    def get_metrics(self, top: int = 10) -> Dict:
+        """
+        Метрики очередей обновлений
+
+        Args:
+            top: Количество пользователей в списках самых загруженных
+
+        Returns:
+            Dict: Общие счетчики, самые длинные очереди и пользователи, дольше всех занимавшие обработчики
+        """
+        queues = sorted(
+            ({"key": str(key), "pending": stats.pending, "max_wait_ms": round(stats.max_wait * 1000, 1)}
+             for key, stats in self._keys.items()),
+            key=lambda item: item["pending"], reverse=True
+        )[:top]
+
+        busy: Dict[Hashable, list] = {key: list(values) for key, values in self._totals.items()}
+        for key, stats in self._keys.items():
+            values = busy.setdefault(key, [0, 0.0, 0.0])
+            values[0] += stats.processed
+            values[1] += stats.busy_time
+            values[2] = max(values[2], stats.max_wait)
+        busiest = sorted(
+            ({"key": str(key), "processed": values[0], "busy_ms": round(values[1] * 1000, 1),
+              "max_wait_ms": round(values[2] * 1000, 1)}
+             for key, values in busy.items()),
+            key=lambda item: item["busy_ms"], reverse=True
+        )[:top]
+
+        return {
+            "max_workers": self.max_workers,
+            "active": self.active,
+            "waiting": sum(stats.pending for stats in self._keys.values()) - self.active,
+            "keys_in_flight": len(self._keys),
+            "processed": self.processed,
+            "longest_queues": queues,
+            "busiest_keys": busiest
+        }
+
+    def reset_metrics(self):
+        """Сброс накопленной статистики по пользователям"""
+        self._totals.clear()
@@ -0,0 +1,153 @@
+import hmac
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiohttp import web
+from loguru import logger
+from telegram import Update
+from telegram.ext import Application
+from yookassa.domain.common import SecurityHelper
+
+
+class WebhookServer:
+    """Встроенный асинхронный HTTP сервер для приема webhook-уведомлений"""
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080):
+        self.host = host
+        self.port = port
+        self.app = web.Application(client_max_size=1024 ** 2)
+        self.app.router.add_get("/healthz", self._health)
+        self._runner: Optional[web.AppRunner] = None
+
+    def add_route(self, method: str, path: str, handler: Callable[[web.Request], Awaitable[web.Response]]):
+        """Регистрация обработчика до запуска сервера"""
+        self.app.router.add_route(method, path, handler)
+
+    async def _health(self, request: web.Request) -> web.Response:
+        """Проверка работоспособности для балансировщика нагрузки"""
+        return web.json_response({"status": "ok"})
+
+    async def start(self):
+        """Запуск HTTP сервера"""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"🌐 HTTP сервер запущен на {self.host}:{self.port}")
+
+    async def stop(self):
+        """Остановка HTTP сервера"""
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+            logger.info("🌐 HTTP сервер остановлен")
+
+
+class TelegramWebhookHandler:
+    """Прием обновлений Telegram через webhook с проверкой секретного токена"""
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, application: Application, secret_token: str):
+        self.application = application
+        self.secret_token = secret_token
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Проверка запроса и передача обновления в очередь приложения"""
+        # Сравнение байтов: для str с не-ASCII символами compare_digest бросает TypeError.
+        # aiohttp декодирует заголовки с surrogateescape, поэтому кодируем так же
+        received_token = request.headers.get(self.SECRET_HEADER, "").encode("utf-8", "surrogateescape")
+        if not hmac.compare_digest(received_token, self.secret_token.encode("utf-8")):
+            logger.warning(f"Webhook Telegram: неверный секретный токен от {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.error(f"Webhook Telegram: некорректное обновление: {e}")
+            return web.Response(status=400)
+
+        # Обработка идет асинхронно, Telegram получает ответ сразу
+        await self.application.update_queue.put(update)
+        return web.Response(status=200)
+
+
+class YooKassaWebhookHandler:
+    """
+    Прием HTTP-уведомлений ЮKassa о статусе платежей
+
+    Уведомления ЮKassa не подписаны, поэтому подлинность проверяется дважды:
+    по IP-адресу отправителя и повторным запросом статуса платежа к API.
+    Ответ не 200 заставляет ЮKassa повторить уведомление позже.
+    """
+
+    EVENTS = {"payment.succeeded", "payment.canceled"}
+
+    def __init__(self, fetch_status: Callable[[str], Awaitable[Dict]],
+                 on_payment: Callable[[Dict], Awaitable[None]],
+                 verify_ip: bool = True, trust_forwarded_for: bool = False):
+        """
+        Args:
+            fetch_status: Корутина получения актуального статуса платежа из API
+            on_payment: Обработчик проверенного статуса платежа
+            verify_ip: Проверять, что уведомление пришло из сети ЮKassa
+            trust_forwarded_for: Брать IP из X-Forwarded-For (за обратным прокси)
+        """
+        self.fetch_status = fetch_status
+        self.on_payment = on_payment
+        self.verify_ip = verify_ip
+        self.trust_forwarded_for = trust_forwarded_for
+        self._security = SecurityHelper()
+
+    def _client_ip(self, request: web.Request) -> str:
+        if self.trust_forwarded_for:
+            forwarded = request.headers.get("X-Forwarded-For")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.remote or ""
+
+    def _is_trusted(self, ip: str) -> bool:
+        try:
+            return self._security.is_ip_trusted(ip)
+        except Exception:
+            return False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Проверка уведомления и обновление статуса платежа"""
+        ip = self._client_ip(request)
+        if self.verify_ip and not self._is_trusted(ip):
+            logger.warning(f"Webhook ЮKassa: уведомление с недоверенного адреса {ip}")
+            return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            event = data["event"]
+            payment_id = data["object"]["id"]
+        except Exception as e:
+            logger.error(f"Webhook ЮKassa: некорректное уведомление: {e}")
+            return web.Response(status=400)
+
+        if event not in self.EVENTS:
+            return web.Response(status=200)
+
+        # Статус берем из API, а не из тела уведомления
+        try:
+            payment_status = await self.fetch_status(payment_id)
+        except Exception:
+            return web.Response(status=500)
+        if not payment_status["success"]:
+            logger.error(f"Webhook ЮKassa: не удалось проверить платеж {payment_id}: {payment_status.get('error')}")
+            return web.Response(status=500)
+
+        if event != f"payment.{payment_status['status']}":
+            logger.warning(f"Webhook ЮKassa: событие {event} не совпадает со статусом платежа {payment_id} ({payment_status['status']})")
+            return web.Response(status=200)
+
+        try:
+            await self.on_payment(payment_status)
+        except Exception as e:
+            logger.error(f"Webhook ЮKassa: ошибка обработки платежа {payment_id}: {e}")
+            return web.Response(status=500)
+
+        logger.info(f"Webhook ЮKassa: {event} для платежа {payment_id} обработан")
+        return web.Response(status=200)
@@ -0,0 +1,261 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+
+class WriteBehindQueue:
+    """
+    Буфер отложенной записи пользователей и ИИ консультаций
+
+    Строки копятся в памяти и записываются пакетами (INSERT ... ON CONFLICT)
+    при достижении batch_size или по истечении flush_interval секунд.
+    При остановке буфер полностью сбрасывается в базу данных.
+    """
+
+    def __init__(self, database, batch_size: int = 100, flush_interval: float = 1.0,
+                 max_queue_size: int = 10000, max_flush_attempts: int = 3):
+        """
+        Args:
+            database: AsyncDatabase
+            batch_size: Размер пакета, при котором запись запускается сразу
+            flush_interval: Максимальное время ожидания записи в секундах
+            max_queue_size: Размер буфера, при котором добавление ждет записи
+            max_flush_attempts: Неудачных пакетных записей до построчной записи и построчных попыток до отбрасывания строки
+        """
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_flush_attempts = max_flush_attempts
+
+        self._users: List[Dict] = []
+        self._ai_consultations: List[Dict] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._failed_attempts = 0
+
+        # Метрики
+        self.flushes = 0
+        self.flush_failures = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Количество строк, ожидающих записи"""
+        return len(self._users) + len(self._ai_consultations)
+
+    def start(self):
+        """Запуск фоновой записи"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Буфер отложенной записи запущен (пакет {self.batch_size}, интервал {self.flush_interval}с)")
+
+    async def _enqueue(self, rows: List[Dict], row: Dict):
+        # Если база не успевает, притормаживаем добавление вместо неограниченного роста буфера
+        if self.depth >= self.max_queue_size:
+            logger.warning(f"⚠️ Буфер отложенной записи переполнен ({self.depth}), ожидаем запись")
+            await self.flush()
+
+        # База недоступна и буфер полон - новая строка отбрасывается, размер буфера не растет
+        if self.depth >= self.max_queue_size:
+            self.rows_dropped += 1
+            logger.error(f"❌ Буфер отложенной записи переполнен ({self.depth}), строка отброшена")
+            return
+
+        rows.append(row)
+        if self.depth >= self.batch_size:
+            self._wakeup.set()
+
+    async def add_user(self, telegram_id: int, username: Optional[str] = None,
+                       first_name: Optional[str] = None, last_name: Optional[str] = None,
+                       phone: Optional[str] = None):
+        """Добавление или обновление пользователя (отложенно)"""
+        await self._enqueue(self._users, {
+            "telegram_id": telegram_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "phone": phone
+        })
+
+    async def add_ai_consultation(self, user_id: int, question: str, answer: str = None):
+        """Добавление ИИ консультации (отложенно)"""
+        await self._enqueue(self._ai_consultations, {
+            "user_id": user_id,
+            "question": question,
+            "answer": answer,
+            "created_at": datetime.now()
+        })
+
+    async def _run(self):
+        """Фоновый цикл записи по размеру пакета или по таймеру"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка фоновой записи буфера: {e}")
+
+    async def flush(self) -> bool:
+        """
+        Запись всех накопленных строк пакетами
+
+        Returns:
+            bool: True если буфер полностью записан
+        """
+        async with self._flush_lock:
+            while self.depth:
+                users = self._users[:self.batch_size]
+                ai_consultations = self._ai_consultations[:self.batch_size]
+                del self._users[:len(users)]
+                del self._ai_consultations[:len(ai_consultations)]
+
+                started = time.perf_counter()
+                success = await self.database.write_batch(users, ai_consultations)
+                latency = time.perf_counter() - started
+
+                self.flushes += 1
+                self.last_flush_latency = latency
+                self.max_flush_latency = max(self.max_flush_latency, latency)
+                self._total_flush_latency += latency
+
+                if success:
+                    self._failed_attempts = 0
+                    self.rows_written += len(users) + len(ai_consultations)
+                    logger.debug(
+                        f"Записан пакет: {len(users)} пользователей, {len(ai_consultations)} ИИ консультаций "
+                        f"за {latency * 1000:.1f}мс (в очереди {self.depth})"
+                    )
+                    continue
+
+                self.flush_failures += 1
+                self._failed_attempts += 1
+
+                if self._failed_attempts >= self.max_flush_attempts:
+                    # Пакет раз за разом не записывается - изолируем проблемные строки
+                    self._failed_attempts = 0
+                    if await self._write_rows_individually(users, ai_consultations):
+                        continue
+                    return False
+
+                # Возвращаем строки в начало буфера до следующей попытки
+                self._users[:0] = users
+                self._ai_consultations[:0] = ai_consultations
+                return False
+
+            return True
+
+    async def _write_rows_individually(self, users: List[Dict], ai_consultations: List[Dict]) -> bool:
+        """
+        Построчная запись пакета, который не удалось записать целиком
+
+        Каждая строка пишется отдельной транзакцией тем же write_batch (с созданием
+        пользователя и исходным created_at). Если база недоступна - до начала записи
+        или после ошибки очередной строки, - незаписанные строки возвращаются в буфер
+        без учета попытки и запись прекращается; иначе они повторяются и
+        отбрасываются после max_flush_attempts построчных попыток.
+
+        Returns:
+            bool: False, если база недоступна
+        """
+        if not await self.database.is_available():
+            self._users[:0] = users
+            self._ai_consultations[:0] = ai_consultations
+            return False
+
+        logger.warning(f"⚠️ Построчная запись пакета из {len(users) + len(ai_consultations)} строк")
+
+        rows = [(row, True) for row in users] + [(row, False) for row in ai_consultations]
+        failed_users = []
+        failed_ai_consultations = []
+        outage = False
+        for index, (row, is_user) in enumerate(rows):
+            batch = ([row], []) if is_user else ([], [row])
+            if await self.database.write_batch(*batch):
+                self.rows_written += 1
+                continue
+            # Ошибка отдельной строки или недоступность базы: во втором случае запись прекращается
+            if not await self.database.is_available():
+                outage = True
+                break
+            (failed_users if is_user else failed_ai_consultations).append(row)
+
+        failed_users = self._count_row_attempt(failed_users, "пользователя", "telegram_id")
+        failed_ai_consultations = self._count_row_attempt(failed_ai_consultations, "ИИ консультации", "user_id")
+        if outage:
+            # Строка, на которой пропала база, и оставшиеся строки возвращаются без учета попытки
+            failed_users += [row for row, is_user in rows[index:] if is_user]
+            failed_ai_consultations += [row for row, is_user in rows[index:] if not is_user]
+
+        # Незаписанные строки возвращаются в начало буфера
+        self._users[:0] = failed_users
+        self._ai_consultations[:0] = failed_ai_consultations
+        return not outage
+
+    def _count_row_attempt(self, rows: List[Dict], kind: str, key: str) -> List[Dict]:
+        """Учет неудачной построчной попытки; возвращает строки для повтора"""
+        retry = []
+        for row in rows:
+            row["_attempts"] = row.get("_attempts", 0) + 1
+            if row["_attempts"] >= self.max_flush_attempts:
+                self.rows_dropped += 1
+                logger.error(f"❌ Строка {kind} {row[key]} не записана после {row['_attempts']} попыток, отброшена")
+            else:
+                retry.append(row)
+        return retry
+
+    async def stop(self):
+        """Остановка фоновой записи с полным сбросом буфера"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        pending = self.depth
+        for _ in range(self.max_flush_attempts):
+            if await self.flush():
+                break
+
+        if self.depth:
+            # Последняя попытка: построчная запись оставшихся строк
+            users, ai_consultations = self._users, self._ai_consultations
+            self._users, self._ai_consultations = [], []
+            await self._write_rows_individually(users, ai_consultations)
+
+        if self.depth:
+            self.rows_dropped += self.depth
+            logger.error(f"❌ При остановке не записано строк: {self.depth}")
+            self._users, self._ai_consultations = [], []
+
+        logger.info(f"Буфер отложенной записи остановлен (сброшено строк: {pending}, потеряно: {self.rows_dropped})")
+
+    def get_metrics(self) -> Dict:
+        """Метрики буфера: глубина очереди и задержка записи"""
+        return {
+            "queue_depth": self.depth,
+            "pending_users": len(self._users),
+            "pending_ai_consultations": len(self._ai_consultations),
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "last_flush_latency_ms": round(self.last_flush_latency * 1000, 2),
+            "avg_flush_latency_ms": round(self._total_flush_latency / self.flushes * 1000, 2) if self.flushes else 0.0,
+            "max_flush_latency_ms": round(self.max_flush_latency * 1000, 2)
+        }